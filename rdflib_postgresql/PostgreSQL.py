@@ -37,13 +37,27 @@ import sys
 import itertools
 import random
 import string
+import time
+import threading
+import json
+import base64
+import datetime
+from contextlib import contextmanager
+from decimal import Decimal
+from io import BytesIO
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import sha as sha1
 from rdflib.graph import Graph, QuotedGraph
-from rdflib import Literal, RDF, URIRef
+from rdflib import BNode, Literal, RDF, RDFS, URIRef, Variable
+from rdflib.paths import Path
 from rdfextras.store.REGEXMatching import NATIVE_REGEX, REGEXTerm
 from rdfextras.store.AbstractSQLStore import (
     COUNT_SELECT,
     CONTEXT_SELECT,
     TRIPLE_SELECT,
+    TRIPLE_SELECT_NO_ORDER,
     ASSERTED_NON_TYPE_PARTITION,
     ASSERTED_TYPE_PARTITION,
     QUOTED_PARTITION,
@@ -51,8 +65,14 @@ from rdfextras.store.AbstractSQLStore import (
     FULL_TRIPLE_PARTITIONS,
     table_name_prefixes,
     AbstractSQLStore,
+    createTerm,
     extractTriple,
     )
+from rdfextras.utils.termutils import (
+    normalizeGraph,
+    statement2TermCombination,
+    term2Letter,
+    )
 from rdflib.py3compat import PY3
 from rdflib.store import NO_STORE, VALID_STORE
 import logging
@@ -63,6 +83,16 @@ def bb(u):
 
 Any = None
 
+# The version of the tables, indexes, etc. init_db creates and open brings
+# stores up to (see PostgreSQL._schemaUpgrades), recorded in the comments of
+# a store's tables
+SCHEMA_VERSION = 5
+SCHEMA_VERSION_MARKER = 'schema version: '
+
+# Statements of a hot predicate, numbered after the partitions of
+# AbstractSQLStore
+HOT_PREDICATE_PARTITION = 7
+
 
 def _debug(*args, **kw):
     logger = logging.getLogger(__name__)
@@ -79,6 +109,45 @@ def ParseConfigurationString(config_string):
     dbname
     host
     port (optional - defaults to 5432)
+
+    Keys other than the connection parameters configure the store itself:
+    write_buffer (optional - number of buffered writes that triggers a
+        flush, disabled by default)
+    write_buffer_interval (optional - seconds after which buffered writes
+        are flushed by the next write; reads and commit() flush them
+        whatever their age, and there is no timer flushing an idle store)
+    unique (optional - 'true' creates new stores with unique statement
+        indexes, so that adding a statement twice is a no-op; an existing
+        store is unique if it has the indexes, with or without the key)
+    partition (optional - 'hash' or 'hash:N' creates new stores with the
+        statement tables hash partitioned by context into N partitions
+        (default 8), 'list' creates them list partitioned by context, with
+        dedicated partitions added by create_context_partition)
+    hot_predicates (optional - comma separated predicate URIs whose
+        statements are stored in a table of their own, as rdf:type
+        statements are; the hot tables an existing store already has are
+        used with or without the key)
+    estimate_len (optional - 'true' makes len() of the whole store an
+        estimate from the planner statistics rather than an exact count)
+    text_search (optional - comma separated language tags, or 'all', whose
+        literals get a full-text index, see PostgreSQL.text_search)
+    trigram (optional - 'true' creates pg_trgm indexes over the subject and
+        object columns, which REGEXTerm and substring matches can use)
+    rdfs_closure (optional - 'true' maintains the transitive closure of
+        rdfs:subClassOf and rdfs:subPropertyOf, see rdfs_subterms)
+    rdfs_entailment (optional - 'true' implies rdfs_closure, and makes
+        patterns with the predicate rdf:type match the members of
+        subclasses as well)
+    replicas (optional - comma separated read replicas, each
+        host[:port][/dbname] with the other connection parameters taken
+        from the primary, see PostgreSQL._readCursor)
+    read_your_writes (optional - 'true' keeps reads on the primary after
+        a commit until a replica has replayed it)
+    layout (optional - 'shared' keeps the statements of every store in
+        one set of tables, keyed by store, instead of tables of their own,
+        see PostgreSQL._configureLayout)
+    shards, shard_by (ShardedPostgreSQL stores only, see
+        rdflib_postgresql.ShardedPostgreSQL)
     """
     parts = config_string.split(' ')
     parts = (part.split('=', 1) for part in parts)
@@ -102,8 +171,45 @@ def GetConfigurationString(configuration):
     """
     Given a config-form string, return a dsn-form string
     """
+    return dsnString(ParseConfigurationString(configuration))
+
+
+def GetReplicaConfigurationStrings(configuration):
+    """
+    Given a config-form string, return the dsn-form strings of the read
+    replicas it lists
+    """
+    return [GetConfigurationString(replica) for replica
+            in GetEndpointConfigurationStrings(configuration, 'replicas')]
+
+
+def GetEndpointConfigurationStrings(configuration, key):
+    """
+    Given a config-form string, return the config-form strings of the
+    endpoints (host[:port][/dbname]) listed under key, which take their
+    other keys from the configuration
+    """
     configDict = ParseConfigurationString(configuration)
+    configurations = []
+    for endpoint in configDict.pop(key, '').split(','):
+        if not endpoint:
+            continue
+        address, _, dbname = endpoint.partition('/')
+        host, _, port = address.partition(':')
+        endpointDict = dict(configDict)
+        for name, value in (('host', host), ('port', port),
+                            ('dbname', dbname)):
+            if value:
+                endpointDict[name] = value
+        configurations.append(' '.join(
+            ['%s=%s' % item for item in sorted(endpointDict.items())]))
+    return configurations
+
 
+def dsnString(configDict):
+    """
+    Given a parsed config-form string, return a dsn-form string
+    """
     dsn = dict(dbname=configDict['dbname'],
                user=configDict['user'],
                password=configDict['password'])
@@ -116,31 +222,179 @@ def GetConfigurationString(configuration):
     return ' '.join(dsn)
 
 
+def schemaVersion(comment):
+    """
+    The schema version recorded in a table comment, or None
+    """
+    if comment and SCHEMA_VERSION_MARKER in comment:
+        return int(comment.rsplit(SCHEMA_VERSION_MARKER, 1)[1].split(';')[0])
+    return None
+
+
+def booleanOption(value):
+    """
+    Interprets the value of an on/off configuration key
+    """
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def copyValue(value):
+    """
+    Renders a column value in the text format read by COPY ... FROM STDIN
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    elif not isinstance(value, str):
+        value = str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace(
+        '\n', '\\n').replace('\r', '\\r')
+
+
+def regexPattern(term):
+    """
+    The PostgreSQL regular expression matched (with ~) for a REGEXTerm.
+    Like the REGEXTerm's compiled expression (and the REGEXMatching store
+    wrapper), it matches at the beginning of the value.
+    """
+    return u'^(?:%s)' % term
+
+
+class PrefixTerm(unicode):
+    """
+    Matches the terms starting with a prefix, in triples_with_prefix
+    """
+
+
+def prefixRangeClause(column, prefix):
+    """
+    The range condition matching the values of a column that start with a
+    prefix. The ~>=~ and ~<~ operators compare strings byte by byte, so
+    that the text_pattern_ops indexes serve them; the upper bound is the
+    prefix with its last character incremented (UTF-8 preserves the order
+    of code points).
+    """
+    clauses = ["%s ~>=~ " % column + "%s"]
+    params = [prefix.encode('utf-8')]
+    upper = prefix
+    while upper and ord(upper[-1]) >= sys.maxunicode:
+        upper = upper[:-1]
+    if upper:
+        clauses.append("%s ~<~ " % column + "%s")
+        params.append(
+            (upper[:-1] + unichr(ord(upper[-1]) + 1)).encode('utf-8'))
+    return '(' + ' and '.join(clauses) + ')', params
+
+
+def bgpTriples(part):
+    """
+    The triple patterns of a SPARQL algebra part made of basic graph
+    patterns (and joins of them), or None
+    """
+    if part.name == 'BGP':
+        return list(part.triples)
+    elif part.name == 'Join':
+        first, second = bgpTriples(part.p1), bgpTriples(part.p2)
+        if first is not None and second is not None:
+            return first + second
+    return None
+
+
+def termColumns(alias, position):
+    """
+    The value, term type (numbered as in SUBJECT_TERM_TYPES or
+    OBJECT_TERM_TYPES) and optional columns of the subject, predicate or
+    object of the rows of a triples() query, as (name, expression) pairs
+    """
+    termTypes = {'subject': '%s.termComb / 30' % alias,
+                 'predicate': '0',
+                 'object': 'mod(%s.termComb / 3, 5)' % alias}
+    return [('value', '%s.%s' % (alias, position)),
+            ('type', termTypes[position])] + [
+        (column, position == 'object' and '%s.%s' % (alias, column) or
+         'NULL::%s' % columnType)
+        for column, columnType in [('objLanguage', 'text'),
+                                   ('objDatatype', 'text')] +
+        TYPED_VALUE_COLUMN_TYPES]
+
+
+def typedValue(value):
+    """
+    The typed value column (see TYPED_VALUE_COLUMNS) a Python value is
+    compared in, and its SQL text, or (None, None). Timezone-aware
+    datetimes are stored in UTC.
+    """
+    if isinstance(value, bool):
+        return 'objBoolean', value and 'true' or 'false'
+    if isinstance(value, (int, long, Decimal)):
+        return 'objNumeric', str(value)
+    if isinstance(value, float):
+        if value != value or value in (float('inf'), float('-inf')):
+            return None, None
+        return 'objNumeric', repr(value)
+    if isinstance(value, datetime.datetime):
+        if value.utcoffset() is not None:
+            value = (value - value.utcoffset()).replace(tzinfo=None)
+        return 'objTimestamp', value.isoformat()
+    if isinstance(value, datetime.date):
+        return 'objTimestamp', value.isoformat()
+    return None, None
+
+
+def typedLiteralValues(obj):
+    """
+    The typed value columns of a statement's object, filled in if it is a
+    literal of an XSD numeric, date/time or boolean datatype (as far as
+    rdflib converts it to a Python value)
+    """
+    values = dict((column, 'NULL') for column in TYPED_VALUE_COLUMNS)
+    if isinstance(obj, Literal) and obj.datatype is not None:
+        column, value = typedValue(obj.toPython())
+        if column is not None:
+            values[column] = value
+    return [values[column] for column in TYPED_VALUE_COLUMNS]
+
+
 # Though I appreciate that this was made into a function rather than
 # a method since it was universal, sadly different DBs quote values
 # differently. So I have to pull this, and all methods which call it,
 # into the Postgres implementation level.
 
-def unionSELECT(selectComponents, distinct=False, selectType=TRIPLE_SELECT):
+def unionSELECT(selectComponents, distinct=False, selectType=TRIPLE_SELECT,
+                typedValues=False, byteOrder=False):
     """
     Helper function for building union all select statement
     Takes a list of:
     - table name
     - table alias
-    - table type (literal, type, asserted, quoted)
+    - table type (literal, type, asserted, quoted, hot predicate)
     - where clause string
+    - the predicate (hot predicate tables only)
+
+    If typedValues is set, statements are selected with the typed value
+    columns of their object after the usual ones. If byteOrder is set,
+    triples are sorted by their utf-8 encoding rather than with the
+    database's collation.
     """
     selects = []
-    for tableName, tableAlias, whereClause, tableType in selectComponents:
+    for component in selectComponents:
+        tableName, tableAlias, whereClause, tableType = component[:4]
 
         if selectType == COUNT_SELECT:
             selectString = "select count(*)"
             tableSource = " from %s " % tableName
         elif selectType == CONTEXT_SELECT:
-            selectString = "select %s.context" % tableAlias
+            # A union only removes duplicates if there is more than one
+            # select
+            selectString = "select %s%s.context" % (
+                distinct and 'distinct ' or '', tableAlias)
             tableSource = " from %s as %s " % (tableName, tableAlias)
         elif tableType in FULL_TRIPLE_PARTITIONS:
-            selectString = "select *"
+            # The literal partition has more columns than are selected
+            selectString = "select " + ", ".join(
+                ["%s.%s" % (tableAlias, column)
+                 for column in LITERAL_STATEMENT_COLUMNS])
             tableSource = " from %s as %s " % (tableName, tableAlias)
         elif tableType == ASSERTED_TYPE_PARTITION:
             selectString = \
@@ -155,16 +409,91 @@ def unionSELECT(selectComponents, distinct=False, selectType=TRIPLE_SELECT):
             selectString =\
                 """select *, NULL as objLanguage, NULL as objDatatype"""
             tableSource = " from %s as %s " % (tableName, tableAlias)
+        elif tableType == HOT_PREDICATE_PARTITION:
+            selectString = \
+                """select %s.subject as subject,""" % tableAlias + \
+                """'%s' as predicate,""" % component[4] + \
+                """%s.object as object,""" % tableAlias + \
+                """%s.context as context,""" % tableAlias + \
+                """%s.termComb as termComb,""" % tableAlias + \
+                """%s.objLanguage as objLanguage,""" % tableAlias + \
+                """%s.objDatatype as objDatatype""" % tableAlias
+            tableSource = " from %s as %s " % (tableName, tableAlias)
 
+        if typedValues and selectType not in (COUNT_SELECT, CONTEXT_SELECT):
+            if tableType in (ASSERTED_LITERAL_PARTITION,
+                             HOT_PREDICATE_PARTITION):
+                selectString += "".join([
+                    ", %s.%s" % (tableAlias, column)
+                    for column in TYPED_VALUE_COLUMNS])
+            else:
+                selectString += "".join([
+                    ", NULL::%s as %s" % (columnType, column)
+                    for column, columnType in TYPED_VALUE_COLUMN_TYPES])
         selects.append(selectString + tableSource + whereClause)
 
     orderStmt = ''
     if selectType == TRIPLE_SELECT:
         orderStmt = ' order by subject, predicate, object'
     if distinct:
-        return ' union '.join(selects) + orderStmt
+        union = ' union '.join(selects)
     else:
-        return ' union all '.join(selects) + orderStmt
+        union = ' union all '.join(selects)
+    if byteOrder and orderStmt:
+        # A union can only be ordered by its columns
+        return "select * from (%s) as statements order by " % union + \
+            ", ".join(["convert_to(%s, 'UTF8')" % column
+                       for column in ('subject', 'predicate', 'object')])
+    return union + orderStmt
+
+
+if has_psycopg2:
+    class WriteCursor(psycopg2.extensions.cursor):
+        """
+        The default cursor of a StoreConnection, whose statements are taken
+        to write
+        """
+
+        def execute(self, *args, **kwargs):
+            self.connection.written = True
+            return super(WriteCursor, self).execute(*args, **kwargs)
+
+        def executemany(self, *args, **kwargs):
+            self.connection.written = True
+            return super(WriteCursor, self).executemany(*args, **kwargs)
+
+        def callproc(self, *args, **kwargs):
+            self.connection.written = True
+            return super(WriteCursor, self).callproc(*args, **kwargs)
+
+        def copy_from(self, *args, **kwargs):
+            self.connection.written = True
+            return super(WriteCursor, self).copy_from(*args, **kwargs)
+
+        def copy_expert(self, *args, **kwargs):
+            self.connection.written = True
+            return super(WriteCursor, self).copy_expert(*args, **kwargs)
+
+    class StoreConnection(psycopg2.extensions.connection):
+        """
+        A connection which tells whether its transaction may have written
+        anything: the statements of its cursors count as writes, except
+        those of the plain cursors the store reads with (see
+        PostgreSQL._readCursor)
+        """
+
+        def __init__(self, *args, **kwargs):
+            super(StoreConnection, self).__init__(*args, **kwargs)
+            self.cursor_factory = WriteCursor
+            self.written = False
+
+        def commit(self):
+            super(StoreConnection, self).commit()
+            self.written = False
+
+        def rollback(self):
+            super(StoreConnection, self).rollback()
+            self.written = False
 
 
 class PostgreSQL(AbstractSQLStore):
@@ -178,6 +507,9 @@ class PostgreSQL(AbstractSQLStore):
         query speed and scalability as most graphs will always have more
         rdf:type statements than others
     * All Quoted statements
+    * Optionally, asserted statements of each configured hot predicate (in
+        a table without a predicate column), for the same reasons as
+        rdf:type statements
 
     In addition it persists namespace mappings in a seperate table
     """
@@ -187,12 +519,72 @@ class PostgreSQL(AbstractSQLStore):
     regex_matching = NATIVE_REGEX
     autocommit_default = False
     # _Store__node_pickler = None
+    # Writes are sent straight to the database unless a write buffer size
+    # is set, either here or with the write_buffer configuration key
+    write_buffer_size = 0
+    # The age at which the next write flushes the buffer, see
+    # _checkWriteBuffer
+    write_buffer_interval = None
+    # If true, new stores get unique indexes over each partition and
+    # inserts skip statements that are already stored (see UNIQUE_INDICES).
+    # For an existing store db_exists sets it from the catalog.
+    unique_statements = False
+    # None, 'hash' or 'list': declarative partitioning of the statement
+    # tables by context, for new stores
+    partition_by = None
+    hash_partitions = 8
+    # Predicates (besides rdf:type) whose asserted statements get a table
+    # of their own, see the hot_predicates configuration key. For an
+    # existing store db_exists adds those of its hot tables.
+    hot_predicates = ()
+    # If true, the length of the whole store is estimated from pg_class
+    # instead of summing the maintained per-context counts
+    estimate_len = False
+    # Language tags whose literals get a full-text index (untagged literals
+    # get one too), or None for no full-text indexes
+    text_search_languages = None
+    # If true, trigram indexes over subjects and objects are created (the
+    # pg_trgm extension must be available)
+    trigram_indexes = False
+    # If true, the closure of rdfs:subClassOf and rdfs:subPropertyOf is
+    # maintained in a table of its own, and if rdfs_entailment is true too
+    # triples() and contexts() match rdf:type patterns against it
+    rdfs_closure = False
+    rdfs_entailment = False
+    # If true, reads stay on the primary after a commit until a replica
+    # has replayed it
+    read_your_writes = False
+    # If true, triples() sorts by the utf-8 encoding of the terms rather
+    # than with the database's collation
+    byte_order = False
+    # If true, the store's statements are kept in tables shared with the
+    # other stores of the database, see the layout configuration key
+    shared_layout = False
+    # The schema version of the open store (see db_exists), None for stores
+    # created before versions were recorded
+    schema_version = None
 
     def __init__(self, configuration=None, identifier=None):
         if not has_psycopg2:
             raise ImportError("Unable to import psycopg2, store is unusable.")
         self.__open = False
         self._Store__node_pickler = None
+        self._bufferedOp = None
+        self._bufferedWrites = []
+        self._bufferStarted = None
+        self._hasStatistics = None
+        self._snapshot = threading.local()
+        self._storeId = None
+        # The namespace bindings, as prefix -> namespace and namespace ->
+        # prefix maps, None until loaded (see _namespaceBindings)
+        self._namespaceCache = None
+        # (connection, answer of db_exists on it)
+        self._dbExists = None
+        # The configured hot predicates db_exists found no table for
+        self._newHotPredicates = []
+        self._replicas = []
+        self._nextReplica = 0
+        self._replayLSN = None
         super(PostgreSQL, self).__init__(
                 configuration=configuration, identifier=identifier)
 
@@ -206,15 +598,107 @@ class PostgreSQL(AbstractSQLStore):
         store.
         """
         # sys.stderr.write("Entering 'open'\n")
-        self._db = psycopg2.connect(GetConfigurationString(configuration))
         self.configuration = configuration
+        self._hasStatistics = None
+        configDict = ParseConfigurationString(configuration)
+        self._configureLayout(configDict)
+        if 'write_buffer' in configDict:
+            self.write_buffer_size = int(configDict['write_buffer'])
+        if 'write_buffer_interval' in configDict:
+            self.write_buffer_interval = \
+                float(configDict['write_buffer_interval'])
+        if 'unique' in configDict:
+            self.unique_statements = booleanOption(configDict['unique'])
+        if 'partition' in configDict:
+            method = configDict['partition'].split(':', 1)
+            if method[0] not in ('hash', 'list'):
+                raise RuntimeError(
+                    'PostgreSQL partition must be hash, hash:N or list')
+            self.partition_by = method[0]
+            if len(method) > 1:
+                self.hash_partitions = int(method[1])
+        if 'hot_predicates' in configDict:
+            predicates = [URIRef(uri) for uri in
+                          configDict['hot_predicates'].split(',') if uri]
+            for predicate in predicates:
+                # The predicate is written into the SQL of every select
+                # over its table
+                if [ch for ch in '\'"%' if ch in predicate]:
+                    raise RuntimeError(
+                        'Unsupported hot predicate: %s' % predicate)
+            self.hot_predicates = predicates
+        if 'estimate_len' in configDict:
+            self.estimate_len = booleanOption(configDict['estimate_len'])
+        if 'text_search' in configDict:
+            languages = [lang for lang in
+                         configDict['text_search'].split(',') if lang]
+            if languages == ['all']:
+                languages = sorted(TEXT_SEARCH_CONFIGURATIONS)
+            for lang in languages:
+                if lang not in TEXT_SEARCH_CONFIGURATIONS:
+                    raise RuntimeError(
+                        'No text search configuration for language: %s' %
+                        lang)
+            self.text_search_languages = languages
+        if 'trigram' in configDict:
+            self.trigram_indexes = booleanOption(configDict['trigram'])
+        if 'read_your_writes' in configDict:
+            self.read_your_writes = \
+                booleanOption(configDict['read_your_writes'])
+        if 'rdfs_closure' in configDict:
+            self.rdfs_closure = booleanOption(configDict['rdfs_closure'])
+        if 'rdfs_entailment' in configDict:
+            self.rdfs_entailment = \
+                booleanOption(configDict['rdfs_entailment'])
+            self.rdfs_closure = self.rdfs_closure or self.rdfs_entailment
+        if self.rdfs_closure and [predicate for predicate
+                                  in RDFS_CLOSURE_PREDICATES
+                                  if predicate in self.hot_predicates]:
+            # The triggers maintaining the closure watch the asserted table
+            raise RuntimeError(
+                'The rdfs closure predicates cannot be hot predicates')
+        if self.shared_layout:
+            # These options create tables, indexes or triggers of the store
+            # (or of a single store's tables)
+            for option, value in (
+                    ('unique', self.unique_statements),
+                    ('partition', self.partition_by),
+                    ('hot_predicates', self.hot_predicates),
+                    ('estimate_len', self.estimate_len),
+                    ('text_search', self.text_search_languages),
+                    ('trigram', self.trigram_indexes),
+                    ('rdfs_closure', self.rdfs_closure)):
+                if value:
+                    raise RuntimeError(
+                        'The shared layout does not support %s' % option)
+        self._db = self._connect(GetConfigurationString(configuration))
+        self._closeReplicas()
+        for dsn in GetReplicaConfigurationStrings(configuration):
+            replica = self._connect(dsn)
+            # Each read is a transaction of its own, so that a replica
+            # does not hold back the cleanup of its primary
+            replica.autocommit = True
+            self._replicas.append(replica)
         if self._db:
             if create:
                 #sys.stderr.write("Calling init_db\n")
                 self.init_db(configuration=configuration)
 
             if self.db_exists(configuration=configuration):
+                if self.schema_version > SCHEMA_VERSION:
+                    raise RuntimeError(
+                        'The store has schema version %d, newer than %d' % (
+                            self.schema_version, SCHEMA_VERSION))
+                if self.schema_version < SCHEMA_VERSION:
+                    self._upgradeSchema()
+                if self._newHotPredicates:
+                    self._addHotTables()
                 #sys.stderr.write("Returning VALID_STORE\n")
+                if self._replicas:
+                    # Reads go to the primary while its transaction has
+                    # written, which the catalog queries count as
+                    self._db.rollback()
+                self._listenNamespaces()
                 return VALID_STORE
             else:
                 self._db = None
@@ -225,45 +709,264 @@ class PostgreSQL(AbstractSQLStore):
             return NO_STORE
         #sys.stderr.write("'open' returning\n")
 
+    def _configureLayout(self, configDict):
+        """
+        Sets the layout of the store's tables from the layout key of a
+        parsed configuration. In the shared layout the store's tables are
+        the SHARED_STORE_PREFIX views, which show the rows of the store
+        named by the STORE_ID_SETTING of the session (see _connect).
+        """
+        layout = configDict.get('layout', 'separate')
+        if layout not in ('separate', 'shared'):
+            raise RuntimeError('PostgreSQL layout must be separate or shared')
+        self.shared_layout = layout == 'shared'
+        if self._storeId is None:
+            self._storeId = self._internedId
+        self._internedId = self.shared_layout and SHARED_STORE_PREFIX or \
+            self._storeId
+
+    def _connect(self, dsn):
+        """
+        Connects to a database, as a session of this store in the shared
+        layout
+        """
+        if self.shared_layout:
+            dsn += " options='-c %s=%s'" % (STORE_ID_SETTING, self._storeId)
+        return psycopg2.connect(dsn, connection_factory=StoreConnection)
+
     def db_exists(self, configuration=None):
+        """
+        Whether the store's tables exist, looked up by name in a single
+        catalog query whose answer is kept for the connection. The same
+        query reads the schema version the store is marked with (see
+        _markSchemaVersion) into schema_version, whether the store has
+        unique indexes (see UNIQUE_INDICES) into unique_statements, and
+        the predicates of its hot tables (from their comments, see
+        _createHotTables) into hot_predicates, after the configured ones.
+        The configured hot predicates without a table are kept for open
+        (see _addHotTables).
+        """
         #sys.stderr.write("Entering 'db_exists'\n")
         if not self._db:
-            self._db = psycopg2.connect(GetConfigurationString(configuration))
+            self._db = self._connect(GetConfigurationString(configuration))
+        if self._dbExists is not None and self._dbExists[0] is self._db:
+            return self._dbExists[1]
+        tables = [tbl % self._internedId for tbl in table_name_prefixes]
         c = self._db.cursor()
-        c.execute("SELECT relname from pg_class")
-        tbls = [rt[0] for rt in c.fetchall()]
+        c.execute("SELECT " + ", ".join(
+            ["to_regclass('%s') IS NOT NULL" % tableName
+             for tableName in tables]) +
+            ", to_regclass('%s') IS NOT NULL" % (
+                UNIQUE_INDICES[0][1][0][0] % self._internedId) +
+            ", ARRAY(SELECT obj_description(oid, 'pg_class') FROM pg_class " +
+            "WHERE relkind in ('r', 'p') and not relispartition and " +
+            "relname LIKE '%s%%')" % (
+                self._internedId + '_hot_').replace('_', '\\_') +
+            ", obj_description(to_regclass('%s_asserted_statements'), " % (
+                self._internedId) + "'pg_class')")
+        rt = c.fetchone()
         c.close()
-        for tn in [tbl % (self._internedId) for tbl in table_name_prefixes]:
-            if tn not in tbls:
-                # sys.stderr.write("table %s Doesn't exist\n" % (tn))
-                return 0
-        return 1
+        exists = int(all(rt[:-3]))
+        self.schema_version = exists and schemaVersion(rt[-1]) or None
+        self._newHotPredicates = []
+        if exists:
+            self.unique_statements = rt[-3]
+            tablePredicates = [
+                URIRef(comment[len('predicate: '):].decode('utf-8'))
+                for comment in rt[-2]
+                if comment and comment.startswith('predicate: ')]
+            self._newHotPredicates = [
+                predicate for predicate in self.hot_predicates
+                if predicate != RDF.type
+                and predicate not in tablePredicates]
+            self.hot_predicates = list(self.hot_predicates) + [
+                predicate for predicate in tablePredicates
+                if predicate not in self.hot_predicates]
+        if exists and self.shared_layout:
+            exists = self._sharedStoreRegistered()
+        self._dbExists = (self._db, exists)
+        return exists
+
+    def _sharedStoreRegistered(self):
+        """
+        Whether the session's store is in the SHARED_STORES_TABLE, for
+        db_exists in the shared layout. Layouts from before the table
+        was kept have every store.
+        """
+        c = self._db.cursor()
+        c.execute("SELECT to_regclass('%s') IS NOT NULL" % (
+            SHARED_STORES_TABLE))
+        registered = 1
+        if c.fetchone()[0]:
+            c.execute("SELECT count(*) FROM %s WHERE store_id = " % (
+                SHARED_STORES_TABLE) + "current_setting('%s', true)" % (
+                STORE_ID_SETTING))
+            registered = int(c.fetchone()[0] > 0)
+        c.close()
+        return registered
+
+    def _markSchemaVersion(self, cursor):
+        """
+        Records SCHEMA_VERSION (and the store's identifier) in the comments
+        of the store's tables
+        """
+        comment = SCHEMA_VERSION_MARKER + str(SCHEMA_VERSION)
+        kind = 'TABLE'
+        if self.shared_layout:
+            kind = 'VIEW'
+        else:
+            comment = 'identifier: %s; ' % self.identifier + comment
+        for tblName in table_name_prefixes:
+            self.executeSQL(cursor, "COMMENT ON %s %s IS " % (
+                kind, tblName % self._internedId) + "%s", [comment])
+        self.schema_version = SCHEMA_VERSION
+
+    def _upgradeSchema(self):
+        """
+        Brings a store created with an older schema version up to
+        SCHEMA_VERSION, running the steps of each newer version in order
+        in a single transaction. A store from before versions were recorded
+        runs them all. A role that may not run them keeps using the store as
+        it is, and its version is left unchanged.
+        """
+        version = self.schema_version
+        c = self._db.cursor()
+        try:
+            for stepVersion, step in self._schemaUpgrades():
+                if stepVersion > (version or 0):
+                    step(c)
+            self._markSchemaVersion(c)
+            self._db.commit()
+        except psycopg2.Error, errmsg:
+            self._db.rollback()
+            self.schema_version = version
+            self._hasStatistics = None
+            _debug("unable to upgrade the store's schema (%s)" % errmsg)
+        c.close()
+
+    def _schemaUpgrades(self):
+        """
+        The steps bringing a store up to each schema version, as (version,
+        function of a cursor) tuples in the order they run. Each step
+        leaves alone what the store already has. Version 5 adds what the
+        stores marked by earlier upgrades (rather than created by init_db)
+        may still lack.
+        """
+        steps = [
+            (2, lambda c: self._createIndices(c, PATTERN_INDICES,
+                                              HOT_PATTERN_INDICES)),
+            (3, lambda c: self._createIndices(c, KEYSET_INDICES)),
+            (4, self._upgradeRDFSClosure),
+            (5, self._createNamespaceNotify),
+            ]
+        if not self.shared_layout:
+            # The shared layout has had these from the start
+            steps.extend([
+                (5, self._createTypedValueColumns),
+                (5, self._upgradeStatistics),
+                ])
+        return steps
+
+    def _upgradeRDFSClosure(self, cursor):
+        """
+        Replaces the function maintaining the rdfs closure of a store that
+        keeps one, whether or not this open asks for it
+        """
+        cursor.execute("SELECT to_regclass('%s_rdfs_closure')" % (
+            self._internedId))
+        if cursor.fetchone()[0] is not None:
+            cursor.execute(CREATE_RDFS_CLOSURE_FUNCTION %
+                           self._rdfsClosureFunctions())
+
+    def _upgradeStatistics(self, cursor):
+        """
+        Creates the statistics (see _createStatistics) of a store created
+        without them, counting the statements it already holds
+        """
+        statisticsTable = "%s_statistics" % self._internedId
+        cursor.execute("SELECT to_regclass('%s')" % statisticsTable)
+        if cursor.fetchone()[0] is not None:
+            return
+        self._createStatistics(cursor)
+        for tableName in self._statementTables():
+            cursor.execute(
+                "INSERT INTO %s (context, statementTable, statements) " % (
+                    statisticsTable) +
+                "SELECT context, '%s', count(*) FROM %s GROUP BY context" % (
+                    tableName, tableName))
+
+    def _createIndices(self, cursor, indices, hotIndices=()):
+        """
+        Creates the indexes (as in INDICES) of the store's tables and the
+        hot indexes (as in HOT_INDICES) of its hot predicate tables, unless
+        they exist. In the shared layout the indexes are led by store_id.
+        """
+        prefix, leading = self._internedId, ()
+        if self.shared_layout:
+            prefix, leading = SHARED_TABLE_PREFIX, ('store_id', )
+        for tblName, tblIndices in indices:
+            for indexName, columns in tblIndices:
+                cursor.execute("CREATE INDEX IF NOT EXISTS %s on %s (%s)" % (
+                    indexName % prefix, tblName % prefix,
+                    ', '.join(leading + columns)))
+        for predicate, tblName in self._hotPredicateTables():
+            for indexName, method, columns in hotIndices:
+                cursor.execute(
+                    "CREATE INDEX IF NOT EXISTS %s on %s USING %s (%s)" % (
+                        indexName % tblName, tblName, method,
+                        ', '.join(columns)))
 
     def init_db(self, configuration=None):
         # sys.stderr.write("Entering 'init_db'\n")
+        if self.shared_layout:
+            self._initSharedLayout(configuration)
+            return
+        # db_exists reads whether an existing store is unique
+        unique = self.unique_statements
         if not self.db_exists(configuration=configuration):
             # sys.stderr.write("not db_exists, creating tables'\n")
             c = self._db.cursor()
             for x in CREATE_TABLE_STMTS:
-                c.execute(x % (self._internedId))
-            for x in ['asserted_statements', 'literal_statements',
-                      'quoted_statements', 'type_statements',
-                      'namespace_binds']:
-                c.execute(
-                    """COMMENT ON TABLE "{}_{}" IS 'identifier: {}';""".format(
-                    self._internedId, x, self.identifier))
+                if self.partition_by and x in PARTITIONED_TABLE_STMTS:
+                    c.execute(x % (self._internedId) +
+                              " PARTITION BY %s (context)" % self.partition_by)
+                else:
+                    c.execute(x % (self._internedId))
+            if self.partition_by:
+                self._createPartitions(c, [
+                    tblName % self._internedId
+                    for tblName in STATEMENT_TABLES])
+            self._createHotTables(c)
+            self._createTypedValueColumns(c)
+            self._createTextSearchIndices(c)
+            self._createTrigramIndices(c)
+            self._createRDFSClosure(c)
+            self._markSchemaVersion(c)
             for tblName, indices in INDICES:
                 for indexName, columns in indices:
                     c.execute("CREATE INDEX %s on %s (%s)" % (
                         (indexName % self._internedId),
                         (tblName % self._internedId),
                         ', '.join(columns)))
+            self._createIndices(c, PATTERN_INDICES + KEYSET_INDICES)
+            if self.unique_statements:
+                self._createUniqueIndices(c)
+            self._createStatistics(c)
+            self._createNamespaceNotify(c)
+            self._dbExists = (self._db, 1)
         else:
             # sys.stderr.write(
             #    "is 'db_exists, deleting records from tables'\n")
             c = self._db.cursor()
-            for tblname in table_name_prefixes:
-                fullname = tblname % self._internedId
+            self._createHotTables(c)
+            self._createTypedValueColumns(c)
+            self._createTextSearchIndices(c)
+            self._createTrigramIndices(c)
+            self._createRDFSClosure(c)
+            for fullname in [tblname % self._internedId
+                             for tblname in table_name_prefixes] + \
+                    [tblName for predicate, tblName
+                     in self._hotPredicateTables()]:
                 try:
                     c.execute("DELETE FROM %s;" % fullname)
                     # sys.stderr.write("Table: %s cleared\n" % (fullname))
@@ -271,15 +974,584 @@ class PostgreSQL(AbstractSQLStore):
                     sys.stderr.write(
                         "unable to clear table: %s (%s)\n" % (
                         fullname, errmsg))
+            if unique:
+                # The tables are empty now, so the indexes can be added to
+                # a store created without them
+                self._createUniqueIndices(c)
+                self.unique_statements = True
+            # Likewise the statistics start from zero
+            self._createStatistics(c)
+            c.execute("DELETE FROM %s_statistics" % self._internedId)
+            # and the store has been brought up to date
+            self._createIndices(c, PATTERN_INDICES + KEYSET_INDICES,
+                                HOT_PATTERN_INDICES)
+            self._createNamespaceNotify(c)
+            self._markSchemaVersion(c)
         c.close()
         self._db.commit()
 
+    def _initSharedLayout(self, configuration=None):
+        """
+        init_db for the shared layout: the shared tables and the views over
+        them are created in the first store of a database, other stores
+        are created (or emptied) and registered in the SHARED_STORES_TABLE
+        without any DDL
+        """
+        self.db_exists(configuration=configuration)
+        c = self._db.cursor()
+        c.execute("SELECT to_regclass('%s'), to_regclass('%s')" % (
+            table_name_prefixes[0] % SHARED_STORE_PREFIX, SHARED_STORES_TABLE))
+        layout, stores = c.fetchone()
+        if layout is None:
+            for x in CREATE_TABLE_STMTS:
+                if x == CREATE_NS_BINDS_TABLE:
+                    x = CREATE_SHARED_NS_BINDS_TABLE
+                c.execute(x.replace(
+                    'CREATE TABLE', 'CREATE TABLE IF NOT EXISTS', 1) % (
+                    SHARED_TABLE_PREFIX))
+            for tblName in table_name_prefixes:
+                tableName = tblName % SHARED_TABLE_PREFIX
+                c.execute("ALTER TABLE %s ADD COLUMN IF NOT EXISTS " % (
+                    tableName) + "store_id text not NULL DEFAULT " +
+                    "current_setting('%s', true)" % STORE_ID_SETTING)
+                # The view has the columns of the store's own table
+                c.execute(
+                    "SELECT attname FROM pg_attribute WHERE attrelid = " +
+                    "'%s'::regclass AND attnum > 0 " % tableName +
+                    "AND NOT attisdropped AND attname <> 'store_id' " +
+                    "ORDER BY attnum")
+                c.execute(
+                    "CREATE OR REPLACE VIEW %s AS SELECT %s FROM %s " % (
+                        tblName % SHARED_STORE_PREFIX,
+                        ", ".join([column for (column,) in c.fetchall()]),
+                        tableName) +
+                    "WHERE store_id = current_setting('%s', true)" % (
+                        STORE_ID_SETTING))
+            for tblName, indices in INDICES:
+                for indexName, columns in indices:
+                    c.execute("CREATE INDEX IF NOT EXISTS %s on %s (%s)" % (
+                        indexName % SHARED_TABLE_PREFIX,
+                        tblName % SHARED_TABLE_PREFIX,
+                        ', '.join(('store_id', ) + columns)))
+            self._createIndices(c, PATTERN_INDICES + KEYSET_INDICES)
+            self._createNamespaceNotify(c)
+            self._markSchemaVersion(c)
+        else:
+            for tblName in table_name_prefixes:
+                c.execute("DELETE FROM %s" % (tblName % self._internedId))
+        if stores is None:
+            # The stores of a layout from before the table was kept are
+            # those with rows
+            c.execute(CREATE_SHARED_STORES_TABLE)
+            c.execute("INSERT INTO %s " % SHARED_STORES_TABLE + " UNION ".join(
+                ["SELECT store_id FROM %s" % (tblName % SHARED_TABLE_PREFIX)
+                 for tblName in table_name_prefixes]) +
+                " ON CONFLICT DO NOTHING")
+        c.execute("INSERT INTO %s VALUES " % SHARED_STORES_TABLE +
+                  "(current_setting('%s', true)) " % STORE_ID_SETTING +
+                  "ON CONFLICT DO NOTHING")
+        self._dbExists = (self._db, 1)
+        c.close()
+        self._db.commit()
+
+    def _createTypedValueColumns(self, cursor):
+        """
+        Adds the typed value columns to the literal and hot predicate tables
+        of stores created without them, filled in for the literals already
+        there, and their partial indexes. Those of the literal table lead
+        with the predicate.
+        """
+        tables = [("%s_literal_statements" % self._internedId,
+                   ('predicate', ))] + \
+            [(tblName, ()) for predicate, tblName
+             in self._hotPredicateTables()]
+        for tblName, leading in tables:
+            cursor.execute(
+                "SELECT 1 FROM pg_attribute WHERE attrelid = " +
+                "'%s'::regclass AND attname = '%s'" % (
+                    tblName, TYPED_VALUE_COLUMNS[0].lower()))
+            if not cursor.fetchone():
+                cursor.execute("ALTER TABLE %s " % tblName + ", ".join([
+                    "ADD COLUMN IF NOT EXISTS %s %s" % (column, columnType)
+                    for column, columnType in TYPED_VALUE_COLUMN_TYPES]))
+                self._fillTypedValueColumns(cursor, tblName)
+            for column in TYPED_VALUE_COLUMNS:
+                cursor.execute(
+                    "CREATE INDEX IF NOT EXISTS %s_%s_index " % (
+                        tblName, column.lower()) +
+                    "on %s (%s) WHERE %s IS NOT NULL" % (
+                        tblName, ", ".join(leading + (column, )), column))
+
+    def _fillTypedValueColumns(self, cursor, tblName):
+        """
+        Sets the typed value columns of the literals a table holds as add
+        does (see typedLiteralValues). The values of each distinct literal
+        are COPYed into a temporary table and set with a single UPDATE.
+        """
+        cursor.execute(
+            "SELECT DISTINCT object, objDatatype FROM %s " % tblName +
+            "WHERE objDatatype IS NOT NULL")
+        rows = []
+        for obj, datatype in cursor.fetchall():
+            values = typedLiteralValues(Literal(
+                obj.decode('utf-8'),
+                datatype=URIRef(datatype.decode('utf-8'))))
+            if [value for value in values if value != 'NULL']:
+                rows.append([obj, datatype] + [
+                    value != 'NULL' and value or None for value in values])
+        if not rows:
+            return
+        cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS typed_values (object text, " +
+            "objDatatype text, %s) ON COMMIT DROP" % ", ".join([
+                "%s %s" % (column, columnType)
+                for column, columnType in TYPED_VALUE_COLUMN_TYPES]))
+        data = BytesIO()
+        for row in rows:
+            data.write('\t'.join([copyValue(v) for v in row]) + '\n')
+        data.seek(0)
+        cursor.copy_from(data, 'typed_values', columns=(
+            'object', 'objDatatype') + TYPED_VALUE_COLUMNS)
+        cursor.execute(
+            "UPDATE %s AS t SET %s FROM typed_values AS v " % (
+                tblName, ", ".join(["%s = v.%s" % (column, column)
+                                    for column in TYPED_VALUE_COLUMNS])) +
+            "WHERE t.object = v.object AND t.objDatatype = v.objDatatype")
+        cursor.execute("TRUNCATE typed_values")
+
+    def _textSearchTables(self):
+        """
+        The tables holding literals, as (table name, hot predicate or None,
+        condition selecting literals) tuples
+        """
+        return [("%s_literal_statements" % self._internedId, None, None)] + \
+            [(tblName, predicate, "mod(termComb / 3, 5) = 3")
+             for predicate, tblName in self._hotPredicateTables()]
+
+    def _textSearchCondition(self, lang, literalCondition):
+        """
+        The text search configuration of a language tag (None for untagged
+        literals) and the condition on the literals it indexes
+        """
+        if lang is None:
+            conditions = ["objLanguage IS NULL"]
+            config = 'simple'
+        else:
+            conditions = ["objLanguage = '%s'" % lang]
+            config = TEXT_SEARCH_CONFIGURATIONS[lang]
+        if literalCondition:
+            conditions.append(literalCondition)
+        return config, ' and '.join(conditions)
+
+    def _createTextSearchIndices(self, cursor):
+        """
+        Creates a GIN index over the tsvector of the literals of each
+        configured language (and of untagged literals), using the text
+        search configuration of the language
+        """
+        if self.text_search_languages is None:
+            return
+        for tblName, hotPredicate, literalCondition in \
+                self._textSearchTables():
+            for lang in [None] + list(self.text_search_languages):
+                config, condition = self._textSearchCondition(
+                    lang, literalCondition)
+                cursor.execute(
+                    "CREATE INDEX IF NOT EXISTS %s_fts_%s_index " % (
+                        tblName, lang or 'none') +
+                    "on %s USING gin (to_tsvector('%s', object)) " % (
+                        tblName, config) +
+                    "WHERE %s" % condition)
+
+    def _createTrigramIndices(self, cursor):
+        """
+        Creates GIN trigram indexes over the subject and object columns of
+        every statement table, which ~ (REGEXTerm) and LIKE matches can use
+        """
+        if not self.trigram_indexes:
+            return
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        tables = [(tblName % self._internedId, columns)
+                  for tblName, columns in TRIGRAM_INDEXED_COLUMNS] + \
+            [(tblName, ('subject', 'object'))
+             for predicate, tblName in self._hotPredicateTables()]
+        for tblName, columns in tables:
+            for column in columns:
+                cursor.execute(
+                    "CREATE INDEX IF NOT EXISTS %s_%s_trgm_index " % (
+                        tblName, column) +
+                    "on %s USING gin (%s gin_trgm_ops)" % (tblName, column))
+
+    def _createRDFSClosure(self, cursor):
+        """
+        Creates the closure table of rdfs:subClassOf and rdfs:subPropertyOf,
+        the triggers over the asserted table that keep it up to date, and
+        the view of the rdf:type statements it entails. Added statements
+        extend the closure incrementally; removing one walks again the
+        paths from its subject and from the subterms of its subject, the
+        only ones that may have gone through it.
+        """
+        if not self.rdfs_closure:
+            return
+        closureTable = "%s_rdfs_closure" % self._internedId
+        cursor.execute(CREATE_RDFS_CLOSURE_TABLE % closureTable)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS %s_sub_index " % closureTable +
+            "on %s (predicate, sub)" % closureTable)
+        functions = self._rdfsClosureFunctions()
+        cursor.execute(CREATE_RDFS_CLOSURE_REFRESH_FUNCTION % functions)
+        cursor.execute(CREATE_RDFS_CLOSURE_FUNCTION % functions)
+        cursor.execute(CREATE_ENTAILED_TYPE_VIEW % dict(
+            functions, subClassOf=RDFS.subClassOf))
+        tableName = "%s_asserted_statements" % self._internedId
+        for event, transitionTables in STATISTICS_TRIGGERS:
+            trigger = "rdfs_closure_%s" % event.lower()
+            cursor.execute("DROP TRIGGER IF EXISTS %s ON %s" % (
+                trigger, tableName))
+            cursor.execute(
+                "CREATE TRIGGER %s AFTER %s ON %s " % (
+                    trigger, event, tableName) +
+                "REFERENCING %s FOR EACH STATEMENT " % transitionTables +
+                "EXECUTE PROCEDURE %s_maintain_rdfs_closure()" % (
+                    self._internedId))
+        # The store may hold statements from before the closure was kept
+        self._refreshRDFSClosure(cursor)
+
+    def _rdfsClosureFunctions(self):
+        """
+        The names the SQL of the rdfs closure functions is formatted with
+        """
+        return dict(
+            id=self._internedId, closure="%s_rdfs_closure" % self._internedId,
+            predicates=', '.join(["'%s'" % predicate
+                                  for predicate in RDFS_CLOSURE_PREDICATES]))
+
+    def _refreshRDFSClosure(self, cursor):
+        for predicate in RDFS_CLOSURE_PREDICATES:
+            cursor.execute("SELECT %s_refresh_rdfs_closure('%s')" % (
+                self._internedId, predicate))
+
+    def rdfs_subterms(self, term, predicate=RDFS.subClassOf):
+        """
+        The terms that are (directly or not) rdfs:subClassOf term, or
+        rdfs:subPropertyOf term if predicate says so, from the closure
+        maintained in stores opened with rdfs_closure=true. A term is only
+        one of its own subterms if it is on a cycle.
+        """
+        if predicate not in RDFS_CLOSURE_PREDICATES:
+            raise ValueError("No closure is maintained for %s" % predicate)
+        self.flush()
+        c = self._readCursor()
+        self.executeSQL(
+            c, "SELECT sub, subType FROM %s_rdfs_closure " % (
+                self._internedId) + "WHERE predicate = %s AND super = %s",
+            [self.normalizeTerm(predicate), self.normalizeTerm(term)])
+        rt = [createTerm(value, SUBJECT_TERM_TYPES[termType], self)
+              for value, termType in c.fetchall()]
+        c.close()
+        return rt
+
+    def _createStatistics(self, cursor):
+        """
+        Creates the statistics table, which holds the number of statements
+        per context and statement table, and the triggers that keep it up
+        to date. They are statement level triggers over the transition
+        tables, so a COPY or set-based DELETE updates each count once.
+        """
+        statisticsTable = "%s_statistics" % self._internedId
+        cursor.execute(CREATE_STATISTICS_TABLE % statisticsTable)
+        cursor.execute(CREATE_COUNT_FUNCTION % dict(
+            id=self._internedId, statistics=statisticsTable))
+        for tableName in self._statementTables():
+            for event, transitionTables in STATISTICS_TRIGGERS:
+                trigger = "count_%s" % event.lower()
+                cursor.execute("DROP TRIGGER IF EXISTS %s ON %s" % (
+                    trigger, tableName))
+                cursor.execute(
+                    "CREATE TRIGGER %s AFTER %s ON %s " % (
+                        trigger, event, tableName) +
+                    "REFERENCING %s FOR EACH STATEMENT " % transitionTables +
+                    "EXECUTE PROCEDURE %s_count_statements()" % (
+                        self._internedId))
+        self._hasStatistics = True
+
+    def _createNamespaceNotify(self, cursor):
+        """
+        Creates the trigger notifying the changes of the namespace bindings
+        table (the shared table in the shared layout)
+        """
+        tableName = self._namespaceTable()
+        # Dropping the trigger would wait for the stores reading the table
+        cursor.execute(
+            "SELECT 1 FROM pg_trigger WHERE tgname = 'notify_change' " +
+            "AND tgrelid = to_regclass('%s')" % tableName)
+        if cursor.fetchone():
+            return
+        cursor.execute(CREATE_NAMESPACE_NOTIFY_FUNCTION % dict(
+            table=tableName))
+        cursor.execute(
+            "CREATE TRIGGER notify_change AFTER INSERT OR UPDATE OR DELETE " +
+            "OR TRUNCATE ON %s FOR EACH STATEMENT " % tableName +
+            "EXECUTE PROCEDURE %s_notify()" % tableName)
+
+    def _namespaceTable(self):
+        """
+        The table holding the namespace bindings, which is also the channel
+        their changes are notified on
+        """
+        if self.shared_layout:
+            return "%s_namespace_binds" % SHARED_TABLE_PREFIX
+        return "%s_namespace_binds" % self._internedId
+
+    def _statisticsTable(self):
+        """
+        The name of the statistics table, or None for stores created
+        without one
+        """
+        if self._hasStatistics is None:
+            c = self._readCursor()
+            c.execute("SELECT to_regclass('%s_statistics')" % (
+                self._internedId))
+            self._hasStatistics = c.fetchone()[0] is not None
+            c.close()
+        return self._hasStatistics and \
+            "%s_statistics" % self._internedId or None
+
+    def _createPartitions(self, cursor, parents):
+        for parent in parents:
+            if self.partition_by == 'hash':
+                for remainder in range(self.hash_partitions):
+                    cursor.execute(
+                        "CREATE TABLE %s_h%d PARTITION OF %s " % (
+                            parent, remainder, parent) +
+                        "FOR VALUES WITH (MODULUS %d, REMAINDER %d)" % (
+                            self.hash_partitions, remainder))
+            else:
+                # Contexts without a partition of their own
+                cursor.execute("CREATE TABLE %s_default PARTITION OF %s "
+                               "DEFAULT" % (parent, parent))
+
+    def create_context_partition(self, context):
+        """
+        Gives a context its own partition of every statement table, for
+        stores created with partition=list. Statements already in the
+        context are moved out of the default partition. Once a context has
+        its own partitions, context-scoped queries only touch those, and
+        removing the context truncates them instead of deleting rows.
+        """
+        if self.partition_by != 'list':
+            raise RuntimeError(
+                "Context partitions need a store created with partition=list")
+        if self._hasContextPartition(context):
+            return
+        self.flush()
+        c = self._db.cursor()
+        contextId = self.normalizeTerm(context)
+        for parent in self._statementTables():
+            partition = self._contextPartitionName(parent, context)
+            # Filled and then attached, so the default partition only has
+            # to be checked once
+            c.execute("CREATE TABLE %s (LIKE %s)" % (partition, parent))
+            self.executeSQL(
+                c,
+                "INSERT INTO %s SELECT * FROM %s_default " % (
+                    partition, parent) + "WHERE context = %s",
+                [contextId])
+            self.executeSQL(
+                c,
+                "DELETE FROM %s_default WHERE context = " % parent + "%s",
+                [contextId])
+            self.executeSQL(
+                c,
+                "ALTER TABLE %s ATTACH PARTITION %s " % (parent, partition) +
+                "FOR VALUES IN (%s)",
+                [contextId])
+        c.close()
+
+    def _contextPartitionName(self, parent, context):
+        return "%s_%s" % (
+            parent, sha1(self.normalizeTerm(context)).hexdigest()[:10])
+
+    def _hasContextPartition(self, context):
+        if self.partition_by != 'list':
+            return False
+        c = self._db.cursor()
+        self.executeSQL(c, "SELECT to_regclass(%s)", [
+            self._contextPartitionName(
+                STATEMENT_TABLES[0] % self._internedId, context)])
+        exists = c.fetchone()[0] is not None
+        c.close()
+        return exists
+
+    def _createUniqueIndices(self, cursor):
+        for tblName, indices in UNIQUE_INDICES:
+            for indexName, columns in indices:
+                cursor.execute(
+                    "CREATE UNIQUE INDEX IF NOT EXISTS %s on %s (%s)" % (
+                        (indexName % self._internedId),
+                        (tblName % self._internedId),
+                        ', '.join(columns)))
+        for predicate, tblName in self._hotPredicateTables():
+            indexName, columns = HOT_UNIQUE_INDEX
+            cursor.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS %s on %s (%s)" % (
+                    indexName % tblName, tblName, ', '.join(columns)))
+
+    def _hotPredicateTables(self):
+        """
+        The hot predicates (other than rdf:type, which has its own
+        partition) and their tables, as (predicate, table name) tuples
+        """
+        return [(predicate, "%s_hot_%s" % (
+                    self._internedId,
+                    sha1(self.normalizeTerm(predicate)).hexdigest()[:10]))
+                for predicate in self.hot_predicates
+                if predicate != RDF.type]
+
+    def _hotTable(self, predicate):
+        """
+        The table of a (bound) hot predicate, or None
+        """
+        if predicate is None or isinstance(predicate, REGEXTerm):
+            return None
+        return dict(self._hotPredicateTables()).get(predicate)
+
+    def _hotPredicateClauses(self, subject, predicate, obj, context=None):
+        """
+        Yields (predicate, table name, alias, where clause, parameters) for
+        each hot predicate table the (possibly wildcard or REGEXTerm)
+        predicate matches. URIs and literals share the object column, so a
+        bound object is matched on its term type too (see
+        TERM_COMBINATIONS, where 3 is the index of a literal object)
+        """
+        for index, (hotPredicate, tableName) in \
+                enumerate(self._hotPredicateTables()):
+            if isinstance(predicate, REGEXTerm):
+                if not predicate.compiledExpr.match(hotPredicate):
+                    continue
+            elif predicate is not None and predicate != hotPredicate:
+                continue
+            tableAlias = 'hot%d' % index
+            clauseString, params = self.buildClause(
+                tableAlias, subject, None, obj, context)
+            if obj is not None and not isinstance(obj, REGEXTerm) \
+                    or isinstance(obj, PrefixTerm):
+                clauseString = (clauseString and clauseString + ' and '
+                                or 'where ') + \
+                    "mod(%s.termComb / 3, 5) %s 3" % (
+                        tableAlias, isinstance(obj, Literal) and '=' or '<>')
+            yield hotPredicate, tableName, tableAlias, clauseString, params
+
+    def _hotPredicateSelects(self, subject, predicate, obj, context=None):
+        """
+        The unionSELECT components (and their parameters) over the hot
+        predicate tables the predicate matches
+        """
+        selects = []
+        parameters = []
+        for hotPredicate, tableName, tableAlias, clauseString, params in \
+                self._hotPredicateClauses(subject, predicate, obj, context):
+            parameters.extend(params)
+            selects.append((tableName, tableAlias, clauseString,
+                            HOT_PREDICATE_PARTITION, hotPredicate))
+        return selects, parameters
+
+    def _statementTables(self):
+        return [tblName % self._internedId for tblName in STATEMENT_TABLES] + \
+            [tblName for predicate, tblName in self._hotPredicateTables()]
+
+    def _createHotTables(self, cursor):
+        """
+        Creates the tables of hot predicates that don't have one yet, and
+        returns those as (predicate, table name) tuples
+        """
+        created = []
+        for predicate, tblName in self._hotPredicateTables():
+            cursor.execute("SELECT to_regclass('%s')" % tblName)
+            if cursor.fetchone()[0] is not None:
+                continue
+            created.append((predicate, tblName))
+            if self.partition_by:
+                cursor.execute(
+                    CREATE_HOT_STATEMENTS_TABLE % tblName +
+                    " PARTITION BY %s (context)" % self.partition_by)
+                self._createPartitions(cursor, [tblName])
+            else:
+                cursor.execute(CREATE_HOT_STATEMENTS_TABLE % tblName)
+            self.executeSQL(cursor, "COMMENT ON TABLE %s IS " % tblName + "%s",
+                            ['predicate: %s' % self.normalizeTerm(predicate)])
+            for indexName, method, columns in \
+                    HOT_INDICES + HOT_PATTERN_INDICES:
+                cursor.execute("CREATE INDEX %s on %s USING %s (%s)" % (
+                    indexName % tblName, tblName, method, ', '.join(columns)))
+        return created
+
+    def _addHotTables(self):
+        """
+        Creates the tables of the hot predicates an existing store is opened
+        with and has no table for, with the indexes and triggers of its
+        other statement tables, and moves the statements of those
+        predicates into them from the asserted and literal tables, which
+        their lookups no longer read. Raises a RuntimeError if they can't
+        be created, rather than open the store without them.
+        """
+        c = self._db.cursor()
+        try:
+            created = self._createHotTables(c)
+            if created:
+                self._createTypedValueColumns(c)
+                self._createTextSearchIndices(c)
+                self._createTrigramIndices(c)
+                if self.unique_statements:
+                    self._createUniqueIndices(c)
+                c.execute("SELECT to_regclass('%s_statistics')" % (
+                    self._internedId))
+                if c.fetchone()[0] is not None:
+                    # The counts follow the statements moved below
+                    self._createStatistics(c)
+            for predicate, tblName in created:
+                for source, columns in (
+                        ('literal', HOT_STATEMENT_COLUMNS),
+                        ('asserted',
+                         ('subject', 'object', 'context', 'termComb'))):
+                    self.executeSQL(
+                        c, "WITH moved AS (DELETE FROM %s_%s_statements " % (
+                            self._internedId, source) +
+                        "WHERE predicate = %s " +
+                        "RETURNING %s) INSERT INTO %s (%s) " % (
+                            ', '.join(columns), tblName, ', '.join(columns)) +
+                        "SELECT * FROM moved",
+                        [self.normalizeTerm(predicate)])
+            self._db.commit()
+        except psycopg2.Error, errmsg:
+            self._db.rollback()
+            c.close()
+            raise RuntimeError(
+                'Unable to create the tables of the hot predicates %s (%s)' % (
+                    ', '.join(self._newHotPredicates), errmsg))
+        c.close()
+        self._newHotPredicates = []
+
     def destroy(self, configuration):
         """
         Opposite of init_db, takes a config string
         """
+        self._discardWriteBuffer()
         # sys.stderr.write("Entering 'destroy'\n")
+        self._configureLayout(ParseConfigurationString(configuration))
+        self._dbExists = None
+        self._namespaceCache = None
         self.init_db(configuration=configuration)
+        if self.shared_layout:
+            # init_db has deleted the store's rows, the shared tables stay
+            c = self._db.cursor()
+            c.execute("DELETE FROM %s WHERE store_id = " % (
+                SHARED_STORES_TABLE) + "current_setting('%s', true)" % (
+                STORE_ID_SETTING))
+            c.close()
+            self._db.commit()
+            self._dbExists = None
+            return
         # sys.stderr.write("Connecting to db %s\n" % (configuration))
         db = psycopg2.connect(GetConfigurationString(configuration))
         # sys.stderr.write("Opening cursor\n")
@@ -296,8 +1568,32 @@ class PostgreSQL(AbstractSQLStore):
                   "unable to drop table: %s (%s)\n" % (fullname, errmsg))
                 # _debug(
                 #   "unable to drop table: %s (%s)" % (fullname, errmsg))
+        # Hot predicate tables (and their partitions and indexes) are found
+        # in the catalog, whatever predicates the store is configured with
+        self.executeSQL(
+            c,
+            "SELECT relname FROM pg_class WHERE relkind in ('r', 'p') " +
+            "and not relispartition and relname LIKE %s",
+            [(self._internedId + '_hot_').replace('_', '\\_') + '%'])
+        for (fullname,) in c.fetchall():
+            c.execute("DROP TABLE IF EXISTS %s CASCADE" % fullname)
+        c.execute("DROP TABLE IF EXISTS %s_statistics" % self._internedId)
+        c.execute("DROP FUNCTION IF EXISTS %s_count_statements() CASCADE" % (
+            self._internedId))
+        self._hasStatistics = None
+        c.execute("DROP FUNCTION IF EXISTS %s_namespace_binds_notify() " % (
+            self._internedId) + "CASCADE")
+        c.execute("DROP VIEW IF EXISTS %s_entailed_type_statements" % (
+            self._internedId))
+        c.execute("DROP TABLE IF EXISTS %s_rdfs_closure" % self._internedId)
+        c.execute(
+            "DROP FUNCTION IF EXISTS %s_maintain_rdfs_closure() CASCADE" % (
+                self._internedId))
+        c.execute("DROP FUNCTION IF EXISTS %s_refresh_rdfs_closure(text)" % (
+            self._internedId))
         # sys.stderr.write("Dropping indices\n")
-        for tblName, indices in INDICES:
+        for tblName, indices in INDICES + PATTERN_INDICES + KEYSET_INDICES + \
+                UNIQUE_INDICES:
             for indexName, columns in indices:
                 # _debug(
                 #  "Dropping index %s\n" % (indexName % self._internedId))
@@ -313,49 +1609,1546 @@ class PostgreSQL(AbstractSQLStore):
                 #                   indexName % self._internedId))
         # _debug("calling db_commit\n")
         db.commit()
+        self._dbExists = None
         # _debug("calling c.close'\n")
         c.close()
-        # _debug("calling db.close'\n")
-        db.close()
-        # _debug("Leaving 'destroy'\n")
+        # _debug("calling db.close'\n")
+        db.close()
+        # _debug("Leaving 'destroy'\n")
+
+        # _debug("Destroyed Close World Universe %s in PostgreSQL database %s",
+        #        self.identifier, configuration)
+
+    def EscapeQuotes(self, qstr):
+        """
+        Overridden because executeSQL uses PostgreSQL's dollar-quoted strings
+        """
+        if qstr is None:
+            return ''
+        return qstr
+
+    def add(self, (subject, predicate, obj), context=None, quoted=False):
+        """
+        Add a triple to the store of triples. If a write buffer is
+        configured the triple is queued and written out with the next
+        flush(), otherwise it is inserted immediately.
+        """
+        hotTable = not quoted and self._hotTable(predicate)
+        if not self.write_buffer_size and hotTable:
+            addCmd, params = self.buildHotSQLCommand(
+                subject, predicate, obj, context, hotTable)
+            c = self._db.cursor()
+            self.executeSQL(c, addCmd, params)
+            c.close()
+            return
+        if not self.write_buffer_size:
+            return super(PostgreSQL, self).add(
+                (subject, predicate, obj), context, quoted)
+        self._bufferWrite('add', self._partitionRow(
+            subject, predicate, obj, context, quoted))
+
+    def addN(self, quads):
+        """
+        Adds the quads with one COPY per partition rather than one INSERT
+        per statement.
+        """
+        for subject, predicate, obj, context in quads:
+            self._bufferWrite('add', self._partitionRow(
+                subject, predicate, obj, context,
+                isinstance(context, QuotedGraph)), check=False)
+        if not self.write_buffer_size:
+            self.flush()
+        else:
+            self._checkWriteBuffer()
+
+    def remove(self, (subject, predicate, obj), context):
+        """
+        Remove a triple from the store. Removals of a fully specified
+        statement are queued when a write buffer is configured.
+
+        Otherwise the buffer is flushed and the DELETEs against every
+        partition the pattern can match are run as a single statement
+        (one data-modifying CTE per partition). Returns a dict mapping
+        each of those partitions (ASSERTED_NON_TYPE_PARTITION, etc.) to
+        the number of rows deleted from it.
+        """
+        if self.write_buffer_size \
+                and None not in (subject, predicate, obj) \
+                and not [t for t in (subject, predicate, obj)
+                         if isinstance(t, REGEXTerm)]:
+            self._bufferWrite('remove', (subject, predicate, obj, context))
+            return
+        self.flush()
+        if context is not None \
+                and subject is None and predicate is None and obj is None:
+            return self._remove_context(context)
+        quoted_table = "%s_quoted_statements" % self._internedId
+        asserted_table = "%s_asserted_statements" % self._internedId
+        asserted_type_table = "%s_type_statements" % self._internedId
+        literal_table = "%s_literal_statements" % self._internedId
+
+        # The partitions are chosen as in AbstractSQLStore.remove, except
+        # that the statements of a hot predicate are only in its own table
+        deletes = []
+        if not self._hotTable(predicate) \
+                and (not predicate or predicate != RDF.type):
+            if not self.STRONGLY_TYPED_TERMS or isinstance(obj, Literal):
+                deletes.append((literal_table, 'literal',
+                                ASSERTED_LITERAL_PARTITION, False))
+            if not isinstance(obj, Literal):
+                deletes.append((asserted_table, 'asserted',
+                                ASSERTED_NON_TYPE_PARTITION, False))
+        if predicate == RDF.type or not predicate:
+            deletes.append((asserted_type_table, 'typeTable',
+                            ASSERTED_TYPE_PARTITION, True))
+        deletes.append((quoted_table, 'quoted', QUOTED_PARTITION, False))
+
+        statements = []
+        for tableName, cteName, partition, typeTable in deletes:
+            clauseString, params = self.buildClause(
+                tableName, subject, typeTable and RDF.type or predicate, obj,
+                context, typeTable)
+            statements.append((partition, cteName,
+                               "DELETE FROM %s %s" % (tableName, clauseString),
+                               params))
+        # Rows deleted from a hot predicate table are counted under the
+        # predicate
+        for hotPredicate, tableName, tableAlias, clauseString, params in \
+                self._hotPredicateClauses(subject, predicate, obj, context):
+            statements.append((hotPredicate, tableAlias,
+                               "DELETE FROM %s as %s %s" % (
+                                   tableName, tableAlias, clauseString),
+                               params))
+        return self._executeCounted(statements)
+
+    def _remove_context(self, context):
+        """
+        Removes every statement in the given context with one statement
+        that deletes from all partitions. Returns the rows deleted per
+        partition, as remove() does.
+        """
+        assert context is not None
+        self.flush()
+        if self._hasContextPartition(context):
+            return self._truncateContextPartitions(context)
+        statements = []
+        for tableName, cteName, partition, columns in \
+                self._contextPartitions():
+            clauseString, params = self.buildContextClause(context, tableName)
+            statements.append((partition, cteName,
+                               "DELETE FROM %s WHERE %s" % (
+                                   tableName, clauseString),
+                               params))
+        return self._executeCounted(statements)
+
+    def _truncateContextPartitions(self, context):
+        partitions = [
+            (partition, self._contextPartitionName(tableName, context))
+            for tableName, cteName, partition, columns
+            in self._contextPartitions()]
+        c = self._db.cursor()
+        c.execute("SELECT " + ", ".join(
+            ["(SELECT count(*) FROM %s)" % tableName
+             for partition, tableName in partitions]))
+        counts = c.fetchone()
+        c.execute("TRUNCATE " + ", ".join(
+            [tableName for partition, tableName in partitions]))
+        if self._statisticsTable():
+            # TRUNCATE doesn't fire the parent tables' triggers
+            self.executeSQL(
+                c, "DELETE FROM %s WHERE context = " % (
+                    self._statisticsTable()) + "%s",
+                [self.normalizeTerm(context)])
+        c.execute("SELECT to_regclass('%s_rdfs_closure')" % self._internedId)
+        if c.fetchone()[0] is not None:
+            # Nor those maintaining the rdfs closure
+            self._refreshRDFSClosure(c)
+        c.close()
+        return dict(zip([partition for partition, tableName in partitions],
+                        counts))
+
+    def copy_context(self, source, destination):
+        """
+        Copies every statement of the source context into the destination
+        context with INSERT ... SELECT, without the statements leaving the
+        database. Both contexts must be formulae (QuotedGraph) or neither.
+        Returns the rows inserted per partition.
+        """
+        self._checkContextPair(source, destination)
+        self.flush()
+        statements = []
+        for tableName, cteName, partition, columns in \
+                self._contextPartitions():
+            targets, params = self._retargetedColumns(columns, destination)
+            clauseString, contextParams = self.buildContextClause(
+                source, tableName)
+            statements.append((partition, cteName, self._insertCommand(
+                "INSERT INTO %s (%s) SELECT %s FROM %s WHERE %s" % (
+                    tableName, ', '.join(columns), ', '.join(targets),
+                    tableName, clauseString)),
+                params + contextParams))
+        return self._executeCounted(statements)
+
+    def move_context(self, source, destination):
+        """
+        Moves every statement of the source context into the destination
+        context with an UPDATE of the context column. Both contexts must be
+        formulae (QuotedGraph) or neither. Returns the rows moved per
+        partition.
+        """
+        self._checkContextPair(source, destination)
+        if self.unique_statements:
+            # Statements already in the destination would violate the unique
+            # indexes if updated, so copy (skipping those) and remove instead
+            counts = self.copy_context(source, destination)
+            self._remove_context(source)
+            return counts
+        self.flush()
+        statements = []
+        for tableName, cteName, partition, columns in \
+                self._contextPartitions():
+            targets, params = self._retargetedColumns(columns, destination)
+            assignments = ', '.join(['%s = %s' % (column, target) for
+                                     column, target in zip(columns, targets)
+                                     if column in ('context', 'termComb')])
+            clauseString, contextParams = self.buildContextClause(
+                source, tableName)
+            statements.append((partition, cteName,
+                               "UPDATE %s SET %s WHERE %s" % (
+                                   tableName, assignments, clauseString),
+                               params + contextParams))
+        return self._executeCounted(statements)
+
+    def union(self, contexts, target=None):
+        """
+        The statements of any of the contexts, see _contextSetOperation
+        """
+        return self._contextSetOperation('UNION', contexts, target)
+
+    def intersection(self, contexts, target=None):
+        """
+        The statements of all of the contexts, see _contextSetOperation
+        """
+        return self._contextSetOperation('INTERSECT', contexts, target)
+
+    def difference(self, context, other, target=None):
+        """
+        The statements of context that other lacks, see
+        _contextSetOperation
+        """
+        return self._contextSetOperation('EXCEPT', [context, other], target)
+
+    def _contextSetOperation(self, operator, contexts, target=None):
+        """
+        Combines the statements of contexts with a SQL set operation per
+        partition, in the database. Without a target, returns a generator
+        over the resulting (subject, predicate, object) triples. Otherwise
+        the resulting statements are added to target with INSERT ...
+        SELECT (skipping those it already holds), which may be one of
+        contexts, and the rows inserted per partition are returned.
+        """
+        if target is not None:
+            for context in contexts:
+                self._checkContextPair(context, target)
+        self.flush()
+        statements = []
+        selects = []
+        parameters = []
+        for tableName, cteName, partition, columns in \
+                self._contextPartitions():
+            query, params = self._contextContents(
+                tableName, columns, operator, contexts)
+            if target is None:
+                selects.append("SELECT %s FROM (%s) AS s" % (
+                    ', '.join(self._statementExpressions(columns, partition)),
+                    query))
+                parameters.extend(params)
+                continue
+            # The statements already in the target are left out
+            targetQuery, targetParams = self._contextContents(
+                tableName, columns, operator, [target])
+            targets, retargetParams = self._retargetedColumns(columns, target)
+            statements.append((partition, cteName, self._insertCommand(
+                "INSERT INTO %s (%s) SELECT %s FROM ((%s) EXCEPT (%s)) "
+                "AS s" % (tableName, ', '.join(columns), ', '.join(targets),
+                          query, targetQuery)),
+                retargetParams + params + targetParams))
+        if target is not None:
+            return self._executeCounted(statements)
+        return self._contentTriples(
+            ' UNION ALL '.join(selects), parameters, contexts[0])
+
+    def _contextContents(self, tableName, columns, operator, contexts):
+        """
+        The query (and its parameters) combining with operator the rows of
+        each context in a table, without their context. The context's term
+        type is cleared from termComb, so that rows from contexts of
+        different types compare equal.
+        """
+        expressions = [
+            column == 'termComb'
+            and 'termComb - mod(termComb, 3) AS termComb' or column
+            for column in columns if column != 'context']
+        selects = []
+        parameters = []
+        for context in contexts:
+            clauseString, params = self.buildContextClause(context, tableName)
+            selects.append("(SELECT %s FROM %s WHERE %s)" % (
+                ', '.join(expressions), tableName, clauseString))
+            parameters.extend(params)
+        return (' %s ' % operator).join(selects), parameters
+
+    def _statementExpressions(self, columns, partition):
+        """
+        The subject, predicate, object, termComb, objLanguage and
+        objDatatype of the rows of a partition with the given columns
+        """
+        if 'predicate' in columns:
+            predicate = 'predicate'
+        elif partition == ASSERTED_TYPE_PARTITION:
+            predicate = "'%s'::text" % RDF.type
+        else:
+            # A hot predicate table
+            predicate = "'%s'::text" % partition
+        return [
+            'member' in columns and 'member AS subject' or 'subject',
+            predicate + ' AS predicate',
+            'klass' in columns and 'klass AS object' or 'object',
+            'termComb'] + [
+            column in columns and column or 'NULL::text AS %s' % column
+            for column in ('objLanguage', 'objDatatype')]
+
+    def _contentTriples(self, query, parameters, context):
+        """
+        A generator over the triples of the rows of a query selecting
+        _statementExpressions
+        """
+        c = self._readCursor()
+        self.executeSQL(c, query, parameters)
+        rt = c.fetchone()
+        while rt:
+            s, p, o, graph = extractTriple(
+                rt[:3] + (None, ) + rt[3:], self, context)
+            yield s, p, o
+            rt = c.fetchone()
+        c.close()
+
+    def context_hash(self, context, ignore_bnodes=False):
+        """
+        A hash of the statements of a context that does not depend on their
+        order, computed in the database: contexts with the same statements
+        have the same hash, so that graphs can be compared without fetching
+        them. It is the sum of the hashes of the distinct statements (and
+        their number).
+
+        If ignore_bnodes is set, blank nodes all hash alike, so that a
+        different hash shows graphs aren't isomorphic, while the same hash
+        only suggests they may be.
+        """
+        self.flush()
+        selects = []
+        parameters = []
+        for tableName, cteName, partition, columns in \
+                self._contextPartitions():
+            query, params = self._contextContents(
+                tableName, columns, 'UNION', [context])
+            selects.append("SELECT %s FROM (%s) AS s" % (
+                ', '.join(self._statementExpressions(columns, partition)),
+                query))
+            parameters.extend(params)
+        subject, obj = 'subject', 'object'
+        if ignore_bnodes:
+            subject = "CASE WHEN termComb / 30 = %d THEN '' " % (
+                SUBJECT_TERM_TYPES.index('B')) + "ELSE subject END"
+            obj = "CASE WHEN mod(termComb / 3, 5) = %d THEN '' " % (
+                OBJECT_TERM_TYPES.index('B')) + "ELSE object END"
+        c = self._readCursor()
+        self.executeSQL(
+            c, "SELECT md5(coalesce(sum(('x' || substr(md5(ROW(%s, "
+            "predicate, %s, termComb, objLanguage, objDatatype)::text), 1, "
+            "16))::bit(64)::bigint), 0)::text || ':' || count(*)) "
+            "FROM (%s) AS t" % (subject, obj, ' UNION '.join(selects)),
+            parameters)
+        rt = c.fetchone()[0]
+        c.close()
+        return rt
+
+    def update(self, update, initNs, initBindings, queryGraph, **kwargs):
+        """
+        Runs SPARQL Update operations as set-based SQL. Graph.update tries
+        the store first, and evaluates the update itself if this raises
+        NotImplementedError, which it does unless every operation compiles:
+        DELETE/INSERT ... WHERE and DELETE WHERE operations whose WHERE
+        clause is a basic graph pattern, and whose templates have constant
+        predicates, no blank nodes and constant graph names. Statements
+        are only inserted into a graph, not the union of all of them.
+
+        The solutions of each WHERE clause are stored in a temporary table,
+        against which the DELETE ... USING, then INSERT ... SELECT,
+        statements of the templates run, all in the current transaction.
+        Returns the number of statements each operation deleted and
+        inserted, as (deleted, inserted) tuples.
+        """
+        if initBindings or kwargs:
+            raise NotImplementedError()
+        if isinstance(update, basestring):
+            from rdflib.plugins.sparql.parser import parseUpdate
+            from rdflib.plugins.sparql.algebra import translateUpdate
+            update = translateUpdate(parseUpdate(update), initNs=initNs)
+        context = None
+        if queryGraph not in (None, '__UNION__'):
+            context = Graph(self, queryGraph)
+        # Nothing runs unless every operation compiles
+        operations = [self._compileUpdate(operation, context)
+                      for operation in update]
+        self.flush()
+        c = self._db.cursor()
+        counts = []
+        for query, parameters, statements in operations:
+            self.executeSQL(c, "CREATE TEMP TABLE %s ON COMMIT DROP AS " %
+                            UPDATE_SOLUTIONS_TABLE + query, parameters)
+            counted = []
+            for templateStatements in statements:
+                rows = 0
+                for statement, params in templateStatements:
+                    self.executeSQL(c, statement, params)
+                    rows += c.rowcount
+                counted.append(rows)
+            c.execute("DROP TABLE %s" % UPDATE_SOLUTIONS_TABLE)
+            counts.append(tuple(counted))
+        c.close()
+        return counts
+
+    def _compileUpdate(self, operation, context):
+        """
+        The query of the solutions of an update operation (and its
+        parameters), and its DELETE and INSERT statements, see update
+        """
+        if operation.name == 'DeleteWhere' and not operation.quads:
+            where = list(operation.triples)
+            deletes = [(context, where)]
+            inserts = []
+        elif operation.name == 'Modify' and not operation.using:
+            where = bgpTriples(operation.where)
+            if operation.withClause is not None:
+                context = Graph(self, operation.withClause)
+            deletes = self._templateGraphs(operation.delete, context)
+            inserts = self._templateGraphs(operation.insert, context)
+        else:
+            raise NotImplementedError()
+        if where is None:
+            raise NotImplementedError()
+        query, parameters, variables = self._solutionsQuery(where, context)
+        statements = ([], [])
+        for action, templates in enumerate((deletes, inserts)):
+            for graph, triples in templates:
+                if action and graph is None and triples:
+                    raise NotImplementedError()
+                for triple in triples:
+                    statements[action].extend(self._templateStatements(
+                        action and 'insert' or 'delete', triple, graph,
+                        variables))
+        return query, parameters, statements
+
+    def _templateGraphs(self, template, context):
+        """
+        The (graph, triples) pairs of a DELETE or INSERT template
+        """
+        if template is None:
+            return []
+        templates = [(context, template.triples)]
+        for graphName, triples in template.quads.items():
+            if not isinstance(graphName, URIRef):
+                raise NotImplementedError()
+            templates.append((Graph(self, graphName), triples))
+        return templates
+
+    def _solutionsQuery(self, triples, context):
+        """
+        The query of the distinct solutions of a basic graph pattern (and
+        its parameters), joining a triples() query per pattern, and a dict
+        mapping each variable to the number of its columns (see
+        termColumns) in the solutions
+        """
+        froms = []
+        conditions = []
+        columns = []
+        parameters = []
+        variables = {}
+        occurrences = {}
+        for index, triple in enumerate(triples):
+            alias = 't%d' % index
+            pattern = []
+            for position, term in zip(('subject', 'predicate', 'object'),
+                                      triple):
+                if isinstance(term, Path):
+                    raise NotImplementedError()
+                elif not isinstance(term, (Variable, BNode)):
+                    pattern.append(term)
+                    continue
+                pattern.append(None)
+                termExpressions = termColumns(alias, position)
+                if term in variables:
+                    # Values and types are compared with =, which joins
+                    # can use
+                    conditions.extend([
+                        "%s %s %s" % (first, name in ('value', 'type') and
+                                      '=' or 'IS NOT DISTINCT FROM',
+                                      expression)
+                        for (name, first), (other, expression)
+                        in zip(occurrences[term], termExpressions)
+                        if name in ('value', 'type', 'objLanguage',
+                                    'objDatatype')])
+                    continue
+                variables[term] = len(variables)
+                occurrences[term] = termExpressions
+                columns.extend(["%s AS v%d_%s" % (
+                    expression, variables[term], name)
+                    for name, expression in termExpressions])
+            q, params = self._triplesQuery(
+                tuple(pattern), context, TRIPLE_SELECT_NO_ORDER, True)
+            froms.append("(%s) AS %s" % (q, alias))
+            parameters.extend(params)
+        query = "SELECT DISTINCT %s" % (', '.join(columns) or '1 AS solution')
+        if froms:
+            query += " FROM %s WHERE %s" % (
+                ', '.join(froms), ' and '.join(conditions) or 'true')
+        return query, parameters, variables
+
+    def _templateStatements(self, action, (subject, predicate, obj), context,
+                            variables):
+        """
+        The DELETE ... USING or INSERT ... SELECT statements (with their
+        parameters) applying a template triple to each solution
+        """
+        for term in (subject, predicate, obj):
+            # Template blank nodes are new for each solution
+            if isinstance(term, (BNode, Path)) \
+                    or isinstance(term, Variable) and term not in variables:
+                raise NotImplementedError()
+        if not isinstance(predicate, URIRef) \
+                or isinstance(subject, Literal) \
+                or predicate == RDF.type and isinstance(obj, Literal):
+            raise NotImplementedError()
+        literalType = OBJECT_TERM_TYPES.index('L')
+
+        def expression(term, name='value', columnType=None):
+            if isinstance(term, Variable):
+                return "v.v%d_%s" % (variables[term], name), []
+            elif name == 'value':
+                return "%s", [self.normalizeTerm(term)]
+            elif name in ('objLanguage', 'objDatatype'):
+                value = None
+                if isinstance(term, Literal):
+                    value = name == 'objLanguage' and term.language \
+                        or name == 'objDatatype' and term.datatype
+                return "%s::text", [value or 'NULL']
+            value = typedLiteralValues(term)[TYPED_VALUE_COLUMNS.index(name)]
+            return "%s::" + columnType, [value]
+
+        def termType(term, termTypes):
+            if isinstance(term, Variable):
+                return "v.v%d_type" % variables[term]
+            return str(termTypes.index(term2Letter(term)))
+
+        filters = []
+        if isinstance(subject, Variable):
+            filters.append("v.v%d_type <> %d" % (
+                variables[subject], literalType))
+        objectFilter = isinstance(obj, Variable) and \
+            "v.v%d_type %%s %d" % (variables[obj], literalType)
+        hotTable = self._hotTable(predicate)
+        if predicate == RDF.type:
+            routes = [("%s_type_statements" % self._internedId,
+                       TYPE_STATEMENT_COLUMNS, objectFilter and '<>')]
+        elif hotTable:
+            routes = [(hotTable, HOT_STATEMENT_COLUMNS, None)]
+        elif isinstance(obj, Literal):
+            routes = [("%s_literal_statements" % self._internedId,
+                       LITERAL_TABLE_COLUMNS, None)]
+        else:
+            routes = [("%s_asserted_statements" % self._internedId,
+                       STATEMENT_COLUMNS, objectFilter and '<>')]
+            if objectFilter:
+                routes.append(("%s_literal_statements" % self._internedId,
+                               LITERAL_TABLE_COLUMNS, '='))
+        statements = []
+        for tableName, tableColumns, objectOperator in routes:
+            values = {'member': expression(subject),
+                      'subject': expression(subject),
+                      'predicate': expression(predicate),
+                      'klass': expression(obj),
+                      'object': expression(obj)}
+            for name in OPTIONAL_COLUMNS:
+                values[name] = expression(
+                    obj, name, dict(TYPED_VALUE_COLUMN_TYPES).get(name))
+            routeFilters = filters + (
+                objectOperator and [objectFilter % objectOperator] or [])
+            conditions = []
+            params = []
+            for column in tableColumns:
+                if column in ('context', 'termComb') \
+                        or column in TYPED_VALUE_COLUMNS:
+                    continue
+                sql, columnParams = values[column]
+                conditions.append("x.%s %s %s" % (
+                    column, column in OPTIONAL_COLUMNS and
+                    'IS NOT DISTINCT FROM' or '=', sql))
+                params.extend(columnParams)
+            if context is not None:
+                conditions.append("x.context = %s")
+                params.append(self.normalizeTerm(context.identifier))
+            if action == 'delete':
+                statements.append((
+                    "DELETE FROM %s AS x USING %s AS v WHERE %s" % (
+                        tableName, UPDATE_SOLUTIONS_TABLE,
+                        ' and '.join(conditions + routeFilters)), params))
+                continue
+            values['context'] = (
+                "%s", [self.normalizeTerm(context.identifier)])
+            values['termComb'] = ("%s * 30 + %s * 3 + %d" % (
+                termType(subject, SUBJECT_TERM_TYPES),
+                termType(obj, OBJECT_TERM_TYPES),
+                CONTEXT_TERM_TYPES[normalizeGraph(context)[-1]]), [])
+            selectParams = []
+            for column in tableColumns:
+                selectParams.extend(values[column][1])
+            statements.append((self._insertCommand(
+                "INSERT INTO %s (%s) SELECT DISTINCT %s FROM %s AS v " % (
+                    tableName, ', '.join(tableColumns),
+                    ', '.join([values[column][0]
+                               for column in tableColumns]),
+                    UPDATE_SOLUTIONS_TABLE) +
+                "WHERE %s NOT EXISTS (SELECT 1 FROM %s AS x WHERE %s)" % (
+                    ''.join([condition + ' and '
+                             for condition in routeFilters]),
+                    tableName, ' and '.join(conditions))),
+                selectParams + params))
+        return statements
+
+    def _checkContextPair(self, source, destination):
+        if isinstance(source, QuotedGraph) != \
+                isinstance(destination, QuotedGraph):
+            raise ValueError(
+                "Statements can't be moved between a formula and a graph")
+
+    def _contextPartitions(self):
+        """
+        The partitions holding statements of a context, as (table name, CTE
+        name, partition, column names) tuples. The partition of a hot
+        predicate table is the predicate
+        """
+        return [
+            ("%s_asserted_statements" % self._internedId, 'asserted',
+             ASSERTED_NON_TYPE_PARTITION, STATEMENT_COLUMNS),
+            ("%s_type_statements" % self._internedId, 'typeTable',
+             ASSERTED_TYPE_PARTITION, TYPE_STATEMENT_COLUMNS),
+            ("%s_literal_statements" % self._internedId, 'literal',
+             ASSERTED_LITERAL_PARTITION, LITERAL_TABLE_COLUMNS),
+            ("%s_quoted_statements" % self._internedId, 'quoted',
+             QUOTED_PARTITION, LITERAL_STATEMENT_COLUMNS),
+        ] + [
+            (tableName, 'hot%d' % index, predicate, HOT_STATEMENT_COLUMNS)
+            for index, (predicate, tableName)
+            in enumerate(self._hotPredicateTables())]
+
+    def _retargetedColumns(self, columns, context):
+        """
+        Column expressions that place a row in the given context. The last
+        letter of a term combination is the context's term type, so
+        termComb is recomputed for it (see TERM_COMBINATIONS)
+        """
+        contextTerm = CONTEXT_TERM_TYPES[normalizeGraph(context)[-1]]
+        targets = []
+        params = []
+        for column in columns:
+            if column == 'context':
+                targets.append('%s')
+                params.append(self.normalizeTerm(context))
+            elif column == 'termComb':
+                targets.append(
+                    'termComb - mod(termComb, 3) + %d' % contextTerm)
+            else:
+                targets.append(column)
+        return targets, params
+
+    def _executeCounted(self, statements):
+        """
+        Runs data-modifying statements, given as (partition, name, SQL,
+        parameters) tuples, as CTEs of a single statement and returns a
+        dict mapping each partition to the number of rows it affected.
+        """
+        ctes = []
+        parameters = []
+        for partition, cteName, statement, params in statements:
+            ctes.append("%s as (%s RETURNING 1)" % (cteName, statement))
+            parameters.extend(params)
+        q = "with " + ", ".join(ctes) + " select " + ", ".join(
+            ["(select count(*) from %s)" % cteName
+             for partition, cteName, statement, params in statements])
+        c = self._db.cursor()
+        self.executeSQL(c, self._normalizeSQLCmd(q), parameters)
+        counts = c.fetchone()
+        c.close()
+        return dict(zip([partition for partition, cteName, statement, params
+                         in statements], counts))
+
+    def removeN(self, quads):
+        """
+        Removes many statements at once: the quads are COPYed into a
+        temporary table and removed with one DELETE ... USING per partition
+        instead of one remove() per statement. A context of None removes a
+        statement from every context. Quads with wildcard or REGEXTerm
+        terms are passed on to remove() one by one.
+
+        Returns the number of rows deleted by the set-based removal.
+        """
+        self.flush()
+        statements = []
+        for subject, predicate, obj, context in quads:
+            if None in (subject, predicate, obj) \
+                    or [t for t in (subject, predicate, obj)
+                        if isinstance(t, REGEXTerm)]:
+                self.remove((subject, predicate, obj), context)
+            else:
+                statements.append((subject, predicate, obj, context))
+        c = self._db.cursor()
+        deleted = self._removeStatements(c, statements)
+        c.close()
+        return deleted
+
+    def flush(self):
+        """
+        Writes out buffered adds (one COPY per partition) or removes (one
+        DELETE ... USING per partition, see removeN).
+        """
+        if not self._bufferedWrites:
+            return
+        op, writes = self._bufferedOp, self._bufferedWrites
+        self._discardWriteBuffer()
+        c = self._db.cursor()
+        if op == 'add':
+            partitions = {}
+            for tableName, columns, row in writes:
+                partitions.setdefault((tableName, columns), []).append(row)
+            for (tableName, columns), rows in partitions.items():
+                self._copyRows(c, tableName, columns, rows)
+        else:
+            self._removeStatements(c, writes)
+        c.close()
+
+    def commit(self):
+        """
+        Flushes the write buffer before committing
+        """
+        self.flush()
+        written = self._replicas and self.read_your_writes and \
+            self._db.written
+        self._db.commit()
+        if written:
+            c = self._db.cursor()
+            c.execute("SELECT pg_current_wal_lsn()::text")
+            self._replayLSN = c.fetchone()[0]
+            c.close()
+            self._db.rollback()
+        self._namespaceNotifies()
+
+    def rollback(self):
+        """
+        Buffered writes belong to the transaction being rolled back, so
+        they are discarded
+        """
+        self._discardWriteBuffer()
+        # The bindings made in the transaction are rolled back too
+        self._namespaceCache = None
+        self._db.rollback()
+        self._namespaceNotifies()
+
+    @contextmanager
+    def snapshot(self):
+        """
+        Reads made by the current thread inside a ``with store.snapshot():``
+        block (triples(), contexts(), len() and the other query methods)
+        all see the same consistent state of the store. They run in a
+        REPEATABLE READ READ ONLY DEFERRABLE transaction on a connection
+        of their own, so a long iteration neither holds the transaction of
+        the store's connection open nor waits for its commit(). Writes
+        still go to the store's connection, and are not seen by the
+        snapshot.
+
+        .. sourcecode:: python
+
+            with store.snapshot():
+                total = len(store)
+                for triple, contexts in store.triples((None, None, None)):
+                    ...
+
+        Nested snapshot() blocks share the outermost snapshot.
+        """
+        if getattr(self._snapshot, 'db', None) is not None:
+            yield self
+            return
+        dsns = GetReplicaConfigurationStrings(self.configuration) or \
+            [GetConfigurationString(self.configuration)]
+        self._nextReplica += 1
+        db = self._connect(dsns[self._nextReplica % len(dsns)])
+        try:
+            db.set_session(isolation_level='REPEATABLE READ',
+                           readonly=True, deferrable=True)
+            self._snapshot.db = db
+            try:
+                yield self
+            finally:
+                self._snapshot.db = None
+                db.rollback()
+        finally:
+            db.close()
+
+    def _readCursor(self):
+        """
+        A cursor for a read: on the connection of the current snapshot()
+        if any, else on the next replica in turn. Reads go to the primary
+        while its transaction has written (see StoreConnection), as the
+        replicas would not see the writes, and, with read_your_writes,
+        while no replica has replayed the last commit. Reads themselves
+        don't count as writes, so a read from the primary does not keep
+        the next ones there.
+        """
+        db = getattr(self._snapshot, 'db', None)
+        if db is None:
+            db = self._db
+            if self._replicas and not db.written:
+                db = self._replica() or db
+        return db.cursor(cursor_factory=psycopg2.extensions.cursor)
+
+    def _replica(self):
+        """
+        The next replica in turn, skipping the ones that have not replayed
+        the last commit yet when read_your_writes is set
+        """
+        for attempt in range(len(self._replicas)):
+            self._nextReplica += 1
+            replica = self._replicas[self._nextReplica % len(self._replicas)]
+            if not self.read_your_writes or self._replayLSN is None:
+                return replica
+            c = replica.cursor()
+            c.execute("SELECT pg_last_wal_replay_lsn() >= %s::pg_lsn",
+                      [self._replayLSN])
+            replayed = c.fetchone()[0]
+            c.close()
+            if replayed:
+                return replica
+        return None
+
+    def _closeReplicas(self):
+        for replica in self._replicas:
+            try:
+                replica.close()
+            except psycopg2.Error:
+                pass
+        self._replicas = []
+        self._replayLSN = None
+
+    def _listenNamespaces(self):
+        """
+        Loads the namespace bindings, and listens for changes to them made
+        by other connections (see _createNamespaceNotify)
+        """
+        c = self._db.cursor()
+        c.execute('LISTEN "%s"' % self._namespaceTable())
+        c.close()
+        # LISTEN takes effect on commit, and open() has nothing else to
+        # commit. The bindings are then read as any other read (from a
+        # replica if there are some), without holding a transaction open.
+        self._db.commit()
+        self._namespaceCache = None
+        self._namespaceBindings()
+        self._db.commit()
+
+    def _namespaceBindings(self):
+        """
+        The (prefix -> namespace, namespace -> prefix) maps of the namespace
+        bindings, read once and kept until another connection changes the
+        bindings. PostgreSQL notifies the changes between transactions, so
+        they are seen once the store's transaction has ended.
+        """
+        if self._db.get_transaction_status() == \
+                psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            # Else they are read by the next commit() or rollback()
+            self._namespaceNotifies()
+        if self._namespaceCache is None:
+            c = self._readCursor()
+            c.execute("SELECT prefix, uri FROM %s_namespace_binds " % (
+                self._internedId) + "ORDER BY prefix")
+            namespaces = {}
+            prefixes = {}
+            for prefix, uri in c.fetchall():
+                prefix = prefix.decode('utf-8')
+                uri = uri and URIRef(uri.decode('utf-8'))
+                namespaces[prefix] = uri
+                prefixes.setdefault(uri, prefix)
+            c.close()
+            self._namespaceCache = (namespaces, prefixes)
+        return self._namespaceCache
+
+    def _namespaceNotifies(self):
+        """
+        Reads the notifications that arrived between transactions, and
+        drops the namespace bindings if another connection changed them
+        """
+        self._db.poll()
+        if [notify for notify in self._db.notifies
+                if notify.pid != self._db.get_backend_pid()]:
+            self._namespaceCache = None
+        del self._db.notifies[:]
+
+    def bind(self, prefix, namespace):
+        """
+        Binds prefix to namespace, unless it is bound already
+        """
+        namespaces, prefixes = self._namespaceBindings()
+        if prefix in namespaces:
+            return
+        c = self._db.cursor()
+        self.executeSQL(
+            c, "INSERT INTO %s_namespace_binds (prefix, uri) " % (
+                self._internedId) + "VALUES (%s, %s) ON CONFLICT DO NOTHING",
+            [prefix, namespace])
+        if c.rowcount:
+            namespaces[prefix] = URIRef(namespace)
+            prefixes.setdefault(URIRef(namespace), prefix)
+        else:
+            # Bound by another connection, whose notification is yet to
+            # come
+            self._namespaceCache = None
+        c.close()
+
+    def prefix(self, namespace):
+        return self._namespaceBindings()[1].get(URIRef(namespace))
+
+    def namespace(self, prefix):
+        return self._namespaceBindings()[0].get(prefix)
+
+    def namespaces(self):
+        for prefix, uri in self._namespaceBindings()[0].items():
+            yield prefix, uri
+
+    def close(self, commit_pending_transaction=False):
+        if commit_pending_transaction:
+            self.flush()
+        else:
+            self._discardWriteBuffer()
+        self._closeReplicas()
+        super(PostgreSQL, self).close(
+            commit_pending_transaction=commit_pending_transaction)
+
+    def _bufferWrite(self, op, write, check=True):
+        if self._bufferedOp != op:
+            # Writes are applied in order, so switching between adds and
+            # removes flushes whatever was buffered before
+            self.flush()
+            self._bufferedOp = op
+            self._bufferStarted = time.time()
+        self._bufferedWrites.append(write)
+        if check:
+            self._checkWriteBuffer()
+
+    def _checkWriteBuffer(self):
+        """
+        Flushes the buffer once it holds write_buffer_size writes, or the
+        first of them is write_buffer_interval seconds old. This is only
+        checked as writes are buffered: the reads of the store flush the
+        buffer anyway, and other connections don't see the writes before
+        commit(), which flushes it too.
+        """
+        if len(self._bufferedWrites) >= self.write_buffer_size \
+                or self.write_buffer_interval is not None \
+                and time.time() - self._bufferStarted >= \
+                    self.write_buffer_interval:
+            self.flush()
+
+    def _discardWriteBuffer(self):
+        self._bufferedOp = None
+        self._bufferedWrites = []
+        self._bufferStarted = None
+
+    def _partitionRow(self, subject, predicate, obj, context, quoted=False):
+        """
+        Returns the table, column names and column values an asserted or
+        quoted statement is stored as (see AbstractSQLStore.add)
+        """
+        hotTable = not quoted and self._hotTable(predicate)
+        if hotTable:
+            addCmd, params = self.buildHotSQLCommand(
+                subject, predicate, obj, context, hotTable)
+            tableName = hotTable
+            columns = HOT_STATEMENT_COLUMNS
+        elif quoted or predicate != RDF.type:
+            if isinstance(obj, Literal):
+                addCmd, params = self.buildLiteralTripleSQLCommand(
+                    subject, predicate, obj, context, self._internedId)
+                tableName = "%s_literal_statements" % self._internedId
+                columns = LITERAL_TABLE_COLUMNS
+            elif quoted:
+                addCmd, params = self.buildTripleSQLCommand(
+                    subject, predicate, obj, context, self._internedId, True)
+                tableName = "%s_quoted_statements" % self._internedId
+                columns = LITERAL_STATEMENT_COLUMNS
+            else:
+                addCmd, params = self.buildTripleSQLCommand(
+                    subject, predicate, obj, context, self._internedId,
+                    False)
+                tableName = "%s_asserted_statements" % self._internedId
+                columns = STATEMENT_COLUMNS
+        else:
+            addCmd, params = self.buildTypeSQLCommand(
+                subject, obj, context, self._internedId)
+            tableName = "%s_type_statements" % self._internedId
+            columns = TYPE_STATEMENT_COLUMNS
+        for index, column in enumerate(columns):
+            # Missing optional values are passed to executeSQL as 'NULL'
+            if column in OPTIONAL_COLUMNS and params[index] == 'NULL':
+                params[index] = None
+        return tableName, columns, params
+
+    def _copyRows(self, cursor, tableName, columns, rows):
+        data = BytesIO()
+        for row in rows:
+            data.write('\t'.join([copyValue(v) for v in row]) + '\n')
+        data.seek(0)
+        if not self.unique_statements and not self.shared_layout:
+            cursor.copy_from(data, tableName, columns=columns)
+            return
+        # COPY can't skip rows that violate the unique indexes (nor write
+        # into the views of the shared layout), so the rows are staged in a
+        # temporary table and inserted from there
+        stagingTable = "staged_%s" % tableName
+        cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS %s (LIKE %s) ON COMMIT DROP" % (
+                stagingTable, tableName))
+        cursor.copy_from(data, stagingTable, columns=columns)
+        cursor.execute(
+            "INSERT INTO %s (%s) SELECT %s FROM %s ON CONFLICT DO NOTHING" % (
+                tableName, ', '.join(columns), ', '.join(columns),
+                stagingTable))
+        cursor.execute("TRUNCATE %s" % stagingTable)
+
+    def _removeStatements(self, cursor, statements):
+        """
+        Deletes fully specified statements by COPYing them into a temporary
+        table and joining each partition against it. A context of None
+        matches every context, and a Literal without a language or datatype
+        matches regardless of those, as in AbstractSQLStore.remove
+        """
+        # The staged statements of a hot predicate are numbered after
+        # HOT_PREDICATE_PARTITION, apart for literal and other objects
+        hotTables = self._hotPredicateTables()
+        hotPartitions = dict(
+            (predicate, HOT_PREDICATE_PARTITION + 2 * index)
+            for index, (predicate, tableName) in enumerate(hotTables))
+        rows = []
+        for subject, predicate, obj, context in statements:
+            if predicate in hotPartitions \
+                    and not isinstance(context, QuotedGraph):
+                partition = hotPartitions[predicate] + \
+                    isinstance(obj, Literal)
+            elif isinstance(obj, Literal):
+                partition = ASSERTED_LITERAL_PARTITION
+            elif isinstance(context, QuotedGraph):
+                partition = QUOTED_PARTITION
+            elif predicate == RDF.type:
+                partition = ASSERTED_TYPE_PARTITION
+            else:
+                partition = ASSERTED_NON_TYPE_PARTITION
+            rows.append((
+                partition,
+                self.normalizeTerm(subject),
+                self.normalizeTerm(predicate),
+                self.normalizeTerm(obj),
+                self.normalizeTerm(context),
+                isinstance(obj, Literal) and obj.language or None,
+                isinstance(obj, Literal) and obj.datatype or None))
+        if not rows:
+            return 0
+        stagingTable = "removed_%s" % self._internedId
+        self.executeSQL(
+            cursor, CREATE_REMOVED_STATEMENTS_TABLE % stagingTable)
+        data = BytesIO()
+        for row in rows:
+            data.write('\t'.join([copyValue(v) for v in row]) + '\n')
+        data.seek(0)
+        cursor.copy_from(data, stagingTable)
+        self.executeSQL(cursor, "ANALYZE %s" % stagingTable)
+
+        statementMatch = "t.subject = r.subject and " + \
+            "t.predicate = r.predicate and t.object = r.object"
+        literalMatch = statementMatch + \
+            " and (r.objLanguage is null or t.objLanguage = r.objLanguage)" + \
+            " and (r.objDatatype is null or t.objDatatype = r.objDatatype)"
+        partitions = [
+            ("%s_asserted_statements" % self._internedId,
+             ASSERTED_NON_TYPE_PARTITION, statementMatch),
+            ("%s_type_statements" % self._internedId,
+             ASSERTED_TYPE_PARTITION,
+             "t.member = r.subject and t.klass = r.object"),
+            ("%s_literal_statements" % self._internedId,
+             ASSERTED_LITERAL_PARTITION, literalMatch),
+            ("%s_quoted_statements" % self._internedId,
+             QUOTED_PARTITION, literalMatch),
+        ]
+        hotMatch = "t.subject = r.subject and t.object = r.object" + \
+            " and (r.objLanguage is null or t.objLanguage = r.objLanguage)" + \
+            " and (r.objDatatype is null or t.objDatatype = r.objDatatype)" + \
+            " and mod(t.termComb / 3, 5) %s 3"
+        for predicate, tableName in hotTables:
+            partitions.append((tableName, hotPartitions[predicate],
+                               hotMatch % '<>'))
+            partitions.append((tableName, hotPartitions[predicate] + 1,
+                               hotMatch % '='))
+        removedPartitions = set([row[0] for row in rows])
+        deleted = 0
+        for tableName, partition, match in partitions:
+            if partition not in removedPartitions:
+                continue
+            q = "DELETE FROM %s as t USING %s as r " % (
+                    tableName, stagingTable) + \
+                "WHERE r.partition = %d and %s and " % (partition, match) + \
+                "(r.context is null or t.context = r.context)"
+            self.executeSQL(cursor, self._normalizeSQLCmd(q))
+            deleted += cursor.rowcount
+        self.executeSQL(cursor, "TRUNCATE %s" % stagingTable)
+        return deleted
+
+    def triples(self, (subject, predicate, obj), context=None):
+        """
+        A generator over all the triples matching pattern. Pattern can
+        be any objects for comparing against nodes in the store, for
+        example, RegExLiteral, Date? DateRange?
+
+        .. sourcecode:: text
+
+            quoted table:                <id>_quoted_statements
+            asserted rdf:type table:     <id>_type_statements
+            asserted non rdf:type table: <id>_asserted_statements
+            hot predicate tables:        <id>_hot_<predicate hash>
+
+            triple columns: subject, predicate, object, context, termComb,
+                            objLanguage, objDatatype
+            class membership columns: member, klass, context termComb
+            hot predicate columns: subject, object, context, termComb,
+                                   objLanguage, objDatatype
+
+        FIXME:  These union all selects *may* be further optimized by joins
+
+        """
+        self.flush()
+        c = self._readCursor()
+        q, parameters = self._triplesQuery((subject, predicate, obj), context)
+        self.executeSQL(c, q, parameters)
+        for triple in self._fetchTriples(c, context):
+            yield triple
+        c.close()
+
+    def _fetchTriples(self, c, context):
+        """
+        Yields the statements of a triples() query result (which is ordered
+        by subject, predicate and object) with the contexts of each
+        """
+        rt = c.fetchone()
+        while rt:
+            s, p, o, (graphKlass, idKlass, graphId) = \
+                extractTriple(rt, self, context)
+            currentContext = graphKlass(self, idKlass(graphId))
+            contexts = [currentContext]
+            rt = next = c.fetchone()
+            sameTriple = next and \
+                extractTriple(next, self, context)[:3] == (s, p, o)
+            while sameTriple:
+                s2, p2, o2, (graphKlass, idKlass, graphId) = \
+                    extractTriple(next, self, context)
+                c2 = graphKlass(self, idKlass(graphId))
+                contexts.append(c2)
+                rt = next = c.fetchone()
+                sameTriple = next and \
+                    extractTriple(next, self, context)[:3] == (s, p, o)
+            yield (s, p, o), (c for c in contexts)
+
+    def triples_in_range(self, predicate, low, high, context=None):
+        """
+        A generator over the triples whose object is a numeric, date/time or
+        boolean literal between low and high (inclusive), as triples() does.
+        The typed value columns are compared, using their indexes, rather
+        than the lexical forms of the literals.
+
+        low and high are Python values or typed Literals, either of which
+        may be None for an open range. The predicate may be None or a
+        REGEXTerm to look at the literals of several predicates.
+        """
+        column = None
+        bounds = []
+        for bound, operator in ((low, '>='), (high, '<=')):
+            if bound is None:
+                continue
+            if isinstance(bound, Literal):
+                bound = bound.toPython()
+            boundColumn, value = typedValue(bound)
+            if boundColumn is None or column not in (None, boundColumn):
+                raise ValueError("Unsupported range: %r, %r" % (low, high))
+            column = boundColumn
+            bounds.append((operator, value))
+        if column is None:
+            raise ValueError("A range needs a low or a high bound")
+
+        def rangeClause(tableAlias, clauseString):
+            return (clauseString and clauseString + ' and ' or 'where ') + \
+                ' and '.join(["%s.%s %s " % (tableAlias, column, operator) +
+                              "%s" for operator, value in bounds])
+
+        values = [value for operator, value in bounds]
+        selects = []
+        parameters = []
+        if not self._hotTable(predicate):
+            clauseString, params = self.buildClause(
+                'literal', None, predicate, None, context)
+            parameters.extend(params + values)
+            selects.append(("%s_literal_statements" % self._internedId,
+                            'literal', rangeClause('literal', clauseString),
+                            ASSERTED_LITERAL_PARTITION))
+        for hotPredicate, tableName, tableAlias, clauseString, params in \
+                self._hotPredicateClauses(None, predicate, None, context):
+            parameters.extend(params + values)
+            selects.append((tableName, tableAlias,
+                            rangeClause(tableAlias, clauseString),
+                            HOT_PREDICATE_PARTITION, hotPredicate))
+        self.flush()
+        c = self._readCursor()
+        self.executeSQL(
+            c, self._normalizeSQLCmd(unionSELECT(selects)), parameters)
+        for triple in self._fetchTriples(c, context):
+            yield triple
+        c.close()
+
+    def text_search(self, query, predicate=None, lang=None, limit=10,
+                    context=None):
+        """
+        Full-text search over literal objects, returning up to limit
+        (s, p, o, context) tuples, best ranked first.
+
+        The query is parsed with websearch_to_tsquery ("quoted phrases",
+        OR, -excluded) and matched against the literals of each language
+        with that language's text search configuration, so that the GIN
+        indexes created for text_search languages are used. lang restricts
+        the search to one language tag ('' for untagged literals); by
+        default untagged literals and those of the configured languages are
+        searched.
+        """
+        if lang is None:
+            languages = [None] + list(self.text_search_languages or ())
+        elif lang == '':
+            languages = [None]
+        elif lang in TEXT_SEARCH_CONFIGURATIONS:
+            languages = [lang]
+        else:
+            raise ValueError(
+                "No text search configuration for language: %s" % lang)
+        selects = []
+        parameters = []
+        for tblName, hotPredicate, literalCondition in \
+                self._textSearchTables():
+            if hotPredicate is None:
+                if self._hotTable(predicate):
+                    continue
+                predicateColumn = 'predicate'
+                clauseString, params = self.buildClause(
+                    tblName, None, predicate, None, context)
+            else:
+                if predicate is not None and predicate != hotPredicate and \
+                        not (isinstance(predicate, REGEXTerm) and
+                             predicate.compiledExpr.match(hotPredicate)):
+                    continue
+                predicateColumn = "'%s'" % hotPredicate
+                clauseString, params = self.buildClause(
+                    tblName, None, None, None, context)
+            for language in languages:
+                config, condition = self._textSearchCondition(
+                    language, literalCondition)
+                matched = "to_tsvector('%s', object)" % config
+                tsquery = "websearch_to_tsquery('%s', " % config + "%s)"
+                selects.append(
+                    "select subject, %s, object, context, " % (
+                        predicateColumn) +
+                    "termComb, objLanguage, objDatatype, " +
+                    "ts_rank(%s, %s) as rank " % (matched, tsquery) +
+                    "from %s where %s and " % (tblName, condition) +
+                    "%s @@ %s" % (matched, tsquery) +
+                    (clauseString and " and " + clauseString[len('where '):]
+                     or ''))
+                parameters.extend([query, query] + params)
+        if not selects:
+            return []
+        q = " union all ".join(selects) + " order by rank desc"
+        if limit is not None:
+            q += " limit %d" % limit
+        self.flush()
+        c = self._readCursor()
+        self.executeSQL(c, self._normalizeSQLCmd(q), parameters)
+        results = []
+        for rt in c.fetchall():
+            s, p, o, (graphKlass, idKlass, graphId) = \
+                extractTriple(rt[:7], self, context)
+            results.append((s, p, o, graphKlass(self, idKlass(graphId))))
+        c.close()
+        return results
 
-        # _debug("Destroyed Close World Universe %s in PostgreSQL database %s",
-        #        self.identifier, configuration)
+    def triples_page(self, triple, context=None, after=None, limit=100):
+        """
+        A page of the triples matching a pattern, in (subject, predicate,
+        object) order, for paging through large results. Returns a list
+        of at most limit ((subject, predicate, object), contexts) pairs
+        (fewer when statements are in several contexts) and the token of
+        the next page, or None after the last one.
 
-    def EscapeQuotes(self, qstr):
+        Pages are found by key rather than by offset: the token holds the
+        key of the last triple of the previous page, and the next page
+        starts after it, so a later page costs no more than the first.
         """
-        Overridden because executeSQL uses PostgreSQL's dollar-quoted strings
+        key = None
+        if after is not None:
+            try:
+                key = [value.encode('utf-8') for value
+                       in json.loads(base64.urlsafe_b64decode(str(after)))]
+            except (TypeError, ValueError, AttributeError):
+                raise ValueError("Invalid page token: %r" % after)
+            if len(key) != len(PAGE_KEY_COLUMNS):
+                raise ValueError("Invalid page token: %r" % after)
+        q, parameters = self._pageQuery(
+            triple, context, '>', key, limit=limit)
+        self.flush()
+        c = self._readCursor()
+        self.executeSQL(c, q, parameters)
+        rows = c.rowcount
+        page = [(statement, list(contexts)) for statement, contexts
+                in self._fetchTriples(c, context)]
+        if rows < limit or not page:
+            c.close()
+            return page, None
+        # The limit may have left out some contexts of the last triple,
+        # which are looked up by its whole key (triples() would match a
+        # literal with any language or datatype)
+        last = page[-1][0]
+        key = self._pageKey(last)
+        q, parameters = self._pageQuery(last, context, '=', key)
+        self.executeSQL(c, q, parameters)
+        page[-1] = (last, [graph for statement, contexts
+                           in self._fetchTriples(c, context)
+                           for graph in contexts])
+        c.close()
+        return page, base64.urlsafe_b64encode(json.dumps(
+            [value.decode('utf-8') for value in key]))
+
+    def _pageQuery(self, triple, context=None, operator=None, key=None,
+                   limit=None):
         """
-        if qstr is None:
-            return ''
-        return qstr
+        The query (and its parameters) of triples_page: the triples
+        matching a pattern in key order (see PAGE_KEY_COLUMNS), those whose
+        key compares with operator ('>' or '=') to a key if given. The
+        KEYSET_INDICES serve the order and the comparison.
+        """
+        q, parameters = self._triplesQuery(
+            triple, context, TRIPLE_SELECT_NO_ORDER)
+        q = "SELECT * FROM (%s) AS page" % q
+        if key is not None:
+            q += " WHERE (%s) %s (%s)" % (
+                ', '.join(PAGE_KEY_COLUMNS), operator,
+                ', '.join(["%s"] * len(key)))
+            parameters = parameters + key
+        q += " ORDER BY %s" % ', '.join(PAGE_KEY_COLUMNS)
+        if limit is not None:
+            q += " LIMIT %d" % limit
+        return q, parameters
 
-    # copied and pasted primarily to use the local unionSELECT instead
-    # of the one provided by AbstractSQLStore
-    def triples(self, (subject, predicate, obj), context=None):
+    def _pageKey(self, triple):
         """
-        A generator over all the triples matching pattern. Pattern can
-        be any objects for comparing against nodes in the store, for
-        example, RegExLiteral, Date? DateRange?
+        The values of PAGE_KEY_COLUMNS for a triple, as UTF-8 strings
+        """
+        s, p, o = triple
+        key = [self.normalizeTerm(s), self.normalizeTerm(p),
+               self.normalizeTerm(o)] + [
+            isinstance(o, Literal) and value or ''
+            for value in (getattr(o, 'language', None),
+                          getattr(o, 'datatype', None))]
+        return [isinstance(value, unicode) and value.encode('utf-8') or
+                str(value) for value in key]
 
-        .. sourcecode:: text
+    def transitive_objects(self, subject, predicate, context=None,
+                           max_depth=None):
+        """
+        A generator over subject and the nodes reachable from it by
+        following predicate, as Graph.transitive_objects, computed by
+        transitive_closure in one query
+        """
+        yield subject
+        for node in self.transitive_closure(
+                subject, predicate, context=context, max_depth=max_depth):
+            if node != subject:
+                yield node
 
-            quoted table:                <id>_quoted_statements
-            asserted rdf:type table:     <id>_type_statements
-            asserted non rdf:type table: <id>_asserted_statements
+    def transitive_subjects(self, predicate, obj, context=None,
+                            max_depth=None):
+        """
+        A generator over obj and the nodes it is reachable from by following
+        predicate, as Graph.transitive_subjects, computed by
+        transitive_closure in one query
+        """
+        yield obj
+        for node in self.transitive_closure(
+                obj, predicate, inverse=True, context=context,
+                max_depth=max_depth):
+            if node != obj:
+                yield node
 
-            triple columns: subject, predicate, object, context, termComb,
-                            objLanguage, objDatatype
-            class membership columns: member, klass, context termComb
+    def transitive_closure(self, node, predicate, inverse=False,
+                           context=None, max_depth=None):
+        """
+        The nodes reachable from node by following predicate one or more
+        times (or backwards, if inverse is set), in at most max_depth steps
+        if it is given. node itself is only included if it is on a cycle.
 
-        FIXME:  These union all selects *may* be further optimized by joins
+        The closure is computed by a single WITH RECURSIVE query over the
+        partition holding predicate. Without a depth limit the recursion
+        uses UNION, which discards the nodes already visited, so cycles
+        end it.
+        """
+        if max_depth is not None and max_depth < 1 \
+                or isinstance(node, Literal) and not inverse:
+            return []
+        if inverse:
+            nodeColumn, joinColumn, nodeType = \
+                'subject', 'object', 'e.termComb / 30'
+            nodeTypes = SUBJECT_TERM_TYPES
+            literalColumns = 'NULL::text, NULL::text'
+            literals = isinstance(node, Literal)
+        else:
+            nodeColumn, joinColumn, nodeType = \
+                'object', 'subject', 'mod(e.termComb / 3, 5)'
+            nodeTypes = OBJECT_TERM_TYPES
+            literalColumns = 'e.objLanguage, e.objDatatype'
+            literals = True
+        depthColumns = ['', '', '', '']
+        if max_depth is not None:
+            depthColumns = [', depth', ', 1', ', w.depth + 1',
+                            ' and w.depth < %d' % max_depth]
+        anchorEdges, anchorParameters = self._transitiveEdges(
+            predicate, context, literals)
+        edges, parameters = self._transitiveEdges(
+            predicate, context, not inverse)
+        q = ("WITH RECURSIVE walk(node, nodeType, objLanguage, "
+             "objDatatype%s) AS (" % depthColumns[0] +
+             "SELECT e.%s, %s, %s%s FROM (%s) AS e WHERE e.%s = " % (
+                 nodeColumn, nodeType, literalColumns, depthColumns[1],
+                 anchorEdges, joinColumn) + "%s " +
+             "UNION SELECT e.%s, %s, %s%s FROM walk AS w JOIN (%s) AS e "
+             "ON e.%s = w.node WHERE w.nodeType <> %d%s) " % (
+                 nodeColumn, nodeType, literalColumns, depthColumns[2],
+                 edges, joinColumn, OBJECT_TERM_TYPES.index('L'),
+                 depthColumns[3]) +
+             "SELECT DISTINCT node, nodeType, objLanguage, objDatatype "
+             "FROM walk")
+        self.flush()
+        c = self._readCursor()
+        self.executeSQL(c, q, anchorParameters +
+                        [self.normalizeTerm(node)] + parameters)
+        rt = [createTerm(value, nodeTypes[termType], self, language,
+                         datatype)
+              for value, termType, language, datatype in c.fetchall()]
+        c.close()
+        return rt
+
+    def _transitiveEdges(self, predicate, context=None, literals=True):
+        """
+        The select (and its parameters) of the statements of predicate as
+        (subject, object, termComb, objLanguage, objDatatype) rows, for
+        transitive_closure. Statements with a literal object are left out
+        unless literals is set.
+        """
+        conditions = ''
+        parameters = []
+        if context is not None:
+            conditions = ' and context = %s'
+            parameters = [self.normalizeTerm(context.identifier)]
+        noLiterals = 'mod(termComb / 3, 5) <> %d' % (
+            OBJECT_TERM_TYPES.index('L'))
+        hotTable = self._hotTable(predicate)
+        if predicate == RDF.type:
+            return ("select member as subject, klass as object, termComb, "
+                    "NULL::text as objLanguage, NULL::text as objDatatype "
+                    "from %s_type_statements where true" % self._internedId +
+                    conditions, parameters)
+        elif hotTable:
+            return ("select subject, object, termComb, objLanguage, "
+                    "objDatatype from %s where %s" % (
+                        hotTable, literals and 'true' or noLiterals) +
+                    conditions, parameters)
+        selects = ["select subject, object, termComb, NULL::text as "
+                   "objLanguage, NULL::text as objDatatype from "
+                   "%s_asserted_statements where predicate = " %
+                   self._internedId + "%s" + conditions]
+        if literals:
+            selects.append("select subject, object, termComb, objLanguage, "
+                           "objDatatype from %s_literal_statements " %
+                           self._internedId + "where predicate = %s" +
+                           conditions)
+        return (' union all '.join(selects),
+                ([self.normalizeTerm(predicate)] + parameters) *
+                len(selects))
+
+    def triples_with_prefix(self, position, prefix, triple=(None, None, None),
+                            context=None):
+        """
+        A generator over the triples whose subject, object or context (as
+        position says) starts with prefix, e.g. all statements about the
+        resources of a namespace, as triples() does. The prefix becomes a
+        range condition (see prefixRangeClause) served by the
+        text_pattern_ops indexes. An object prefix matches URIs and blank
+        nodes, not literals. The terms of triple, and the context, narrow
+        the match further.
+        """
+        subject, predicate, obj = triple
+        queryContext = context
+        if position == 'subject':
+            subject = PrefixTerm(prefix)
+        elif position == 'object':
+            obj = PrefixTerm(prefix)
+        elif position == 'context' and context is None:
+            queryContext = PrefixTerm(prefix)
+        else:
+            raise ValueError("Unsupported prefix position: %s" % position)
+        self.flush()
+        c = self._readCursor()
+        q, parameters = self._triplesQuery(
+            (subject, predicate, obj), queryContext)
+        self.executeSQL(c, q, parameters)
+        for triple in self._fetchTriples(c, context):
+            yield triple
+        c.close()
 
+    def _triplesQuery(self, (subject, predicate, obj), context=None,
+                      selectType=TRIPLE_SELECT, typedValues=False):
+        """
+        Builds the query triples() runs for a pattern, returning the query
+        and its parameters. selectType and typedValues are passed on to
+        unionSELECT.
         """
         quoted_table = "%s_quoted_statements" % self._internedId
         asserted_table = "%s_asserted_statements" % self._internedId
         asserted_type_table = "%s_type_statements" % self._internedId
         literal_table = "%s_literal_statements" % self._internedId
-        c = self._db.cursor()
+        if self.rdfs_entailment and predicate == RDF.type:
+            # rdf:type statements entailed by the rdfs closure included.
+            # Only for rdf:type itself: wildcard and REGEXTerm predicates
+            # match the stored statements, as len() counts them.
+            asserted_type_table = \
+                "%s_entailed_type_statements" % self._internedId
 
         parameters = []
 
@@ -381,11 +3174,12 @@ class PostgreSQL(AbstractSQLStore):
             # partition if (obj is Literal or None) and asserted non rdf:type
             # partition (if obj is URIRef or None)
             selects = []
-            if not self.STRONGLY_TYPED_TERMS \
-                    or isinstance(obj, Literal) \
-                    or not obj \
+            if (not self.STRONGLY_TYPED_TERMS
+                    or isinstance(obj, Literal)
+                    or not obj
                     or (self.STRONGLY_TYPED_TERMS
-                        and isinstance(obj, REGEXTerm)):
+                        and isinstance(obj, REGEXTerm))) \
+                    and not isinstance(obj, PrefixTerm):
                 clauseString, params = self.buildClause(
                     'literal', subject, predicate, obj, context)
                 parameters.extend(params)
@@ -421,16 +3215,24 @@ class PostgreSQL(AbstractSQLStore):
                 )
             )
 
+        elif self._hotTable(predicate):
+            # select from the hot predicate's table and quoted partition (if
+            # a context is specified)
+            selects, params = self._hotPredicateSelects(
+                subject, predicate, obj, context)
+            parameters.extend(params)
+
         elif predicate:
             # select from asserted non rdf:type partition (optionally), quoted
             # partition (if context is speciied), and literal partition
             # (optionally)
             selects = []
-            if not self.STRONGLY_TYPED_TERMS \
-                    or isinstance(obj, Literal) \
-                    or not obj \
+            if (not self.STRONGLY_TYPED_TERMS
+                    or isinstance(obj, Literal)
+                    or not obj
                     or (self.STRONGLY_TYPED_TERMS
-                        and isinstance(obj, REGEXTerm)):
+                        and isinstance(obj, REGEXTerm))) \
+                    and not isinstance(obj, PrefixTerm):
                 clauseString, params = self.buildClause(
                     'literal', subject, predicate, obj, context)
                 parameters.extend(params)
@@ -454,6 +3256,13 @@ class PostgreSQL(AbstractSQLStore):
                                ASSERTED_NON_TYPE_PARTITION
                                ))
 
+        if isinstance(predicate, REGEXTerm) or not predicate:
+            # and from the tables of the hot predicates it matches
+            hotSelects, params = self._hotPredicateSelects(
+                subject, predicate, obj, context)
+            parameters.extend(params)
+            selects.extend(hotSelects)
+
         if context is not None:
             clauseString, params = self.buildClause(
                 'quoted', subject, predicate, obj, context)
@@ -467,88 +3276,83 @@ class PostgreSQL(AbstractSQLStore):
                 )
             )
 
-        q = self._normalizeSQLCmd(unionSELECT(selects))
-        self.executeSQL(c, q, parameters)
-        rt = c.fetchone()
-        while rt:
-            s, p, o, (graphKlass, idKlass, graphId) = \
-                extractTriple(rt, self, context)
-            currentContext = graphKlass(self, idKlass(graphId))
-            contexts = [currentContext]
-            rt = next = c.fetchone()
-            sameTriple = next and \
-                extractTriple(next, self, context)[:3] == (s, p, o)
-            while sameTriple:
-                s2, p2, o2, (graphKlass, idKlass, graphId) = \
-                    extractTriple(next, self, context)
-                c2 = graphKlass(self, idKlass(graphId))
-                contexts.append(c2)
-                rt = next = c.fetchone()
-                sameTriple = next and \
-                    extractTriple(next, self, context)[:3] == (s, p, o)
-            yield (s, p, o), (c for c in contexts)
+        return self._normalizeSQLCmd(unionSELECT(
+            selects, selectType=selectType, typedValues=typedValues,
+            byteOrder=self.byte_order)), parameters
 
-    def __repr__(self):
-        """
-        Copied and pasted primarily to use the local unionSELECT instead
-        of the one provided by AbstractSQLStore
+    def estimate(self, (subject, predicate, obj), context=None):
         """
-        try:
-            c = self._db.cursor()
-        except AttributeError:
-            return "<Parititioned PostgreSQL N3 Store>"
-        quoted_table = "%s_quoted_statements" % self._internedId
-        asserted_table = "%s_asserted_statements" % self._internedId
-        asserted_type_table = "%s_type_statements" % self._internedId
-        literal_table = "%s_literal_statements" % self._internedId
-
-        selects = [
-            (
-                asserted_type_table,
-                'typeTable',
-                '',
-                ASSERTED_TYPE_PARTITION
-            ),
-            (
-                quoted_table,
-                'quoted',
-                '',
-                QUOTED_PARTITION
-            ),
-            (
-                asserted_table,
-                'asserted',
-                '',
-                ASSERTED_NON_TYPE_PARTITION
-            ),
-            (
-                literal_table,
-                'literal',
-                '',
-                ASSERTED_LITERAL_PARTITION
-            ),
-        ]
-        q = unionSELECT(selects, distinct=False, selectType=COUNT_SELECT)
-        self.executeSQL(c, self._normalizeSQLCmd(q))
-        rt = c.fetchall()
-        typeLen, quotedLen, assertedLen, literalLen = \
-            [rtTuple[0] for rtTuple in rt]
+        Estimates the number of statements matching a triple pattern
+        without fetching them, e.g. to evaluate the most selective
+        patterns of a query first (see rdflib_postgresql.sparql).
 
-        # return "<Partitioned PostgreSQL N3 Store: %s contexts, %s " + \
-        #        "classification assertions, %s quoted statements, %s " + \
-        #        "property/value assertions, and %s other assertions>" % \
-        #                 (len([c for c in self.contexts()]),
-        #                  typeLen, quotedLen, literalLen, assertedLen)
+        Every pattern, the unbound one included, is answered with the
+        number of rows the planner expects the (unordered) triples() query
+        to return, so that the estimates of patterns over hot predicate
+        tables and over the other tables compare. The planner bases this
+        on the column statistics (most common values and histograms of
+        subjects, predicates, classes, etc.) that ANALYZE maintains.
+        """
+        self.flush()
+        q, parameters = self._triplesQuery(
+            (subject, predicate, obj), context, TRIPLE_SELECT_NO_ORDER)
+        c = self._readCursor()
+        self.executeSQL(c, "EXPLAIN (FORMAT JSON) " + q, parameters)
+        plan = c.fetchone()[0]
+        c.close()
+        if isinstance(plan, basestring):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
 
+    def __repr__(self):
+        """
+        Doesn't query the database, so that it stays cheap on large stores
+        """
         return "<Parititioned PostgreSQL N3 Store>"
 
     def __len__(self, context=None):
         """
-        Number of statements in the store.
-        Copied and pasted primarily to use the local unionSELECT instead
-        of the one provided by AbstractSQLStore
+        Number of statements in the store, read from the statistics table
+        the statement tables' triggers maintain. With estimate_len set the
+        number of statements in the whole store is instead estimated from
+        the planner statistics (pg_class.reltuples).
         """
-        c = self._db.cursor()
+        self.flush()
+        statisticsTable = self._statisticsTable()
+        if statisticsTable is None:
+            # Created before statement counts were maintained
+            return self._countStatements(context)
+        c = self._readCursor()
+        quoted_table = "%s_quoted_statements" % self._internedId
+        if context is None and self.estimate_len:
+            c.execute(
+                "SELECT coalesce(sum(greatest(c.reltuples, 0)), 0) " +
+                "FROM pg_class as c WHERE c.oid in (" +
+                " union all ".join([
+                    "SELECT relid FROM pg_partition_tree('%s') " % tableName +
+                    "WHERE isleaf"
+                    for tableName in self._statementTables()
+                    if tableName != quoted_table]) + ")")
+        elif context is None:
+            c.execute("SELECT coalesce(sum(statements), 0) FROM %s " % (
+                statisticsTable) + "WHERE statementTable <> '%s'" % (
+                quoted_table))
+        else:
+            self.executeSQL(
+                c, "SELECT coalesce(sum(statements), 0) FROM %s " % (
+                    statisticsTable) + "WHERE context = %s",
+                [self.normalizeTerm(context.identifier)])
+        count = c.fetchone()[0]
+        c.close()
+        return int(count)
+
+    def _countStatements(self, context=None):
+        """
+        Counts the statements in the store with count(*) over every
+        partition. Copied and pasted primarily to use the local
+        unionSELECT instead of the one provided by AbstractSQLStore
+        """
+        c = self._readCursor()
         quoted_table = "%s_quoted_statements" % self._internedId
         asserted_table = "%s_asserted_statements" % self._internedId
         asserted_type_table = "%s_type_statements" % self._internedId
@@ -604,6 +3408,7 @@ class PostgreSQL(AbstractSQLStore):
                     ASSERTED_LITERAL_PARTITION
                 ),
             ]
+            selects.extend(self._hotCountSelects(context, parameters))
             q = unionSELECT(selects, distinct=True, selectType=COUNT_SELECT)
         else:
             selects = [
@@ -626,6 +3431,7 @@ class PostgreSQL(AbstractSQLStore):
                     ASSERTED_LITERAL_PARTITION
                 ),
             ]
+            selects.extend(self._hotCountSelects(context, parameters))
             q = unionSELECT(selects, distinct=False, selectType=COUNT_SELECT)
 
         # sys.stderr.write("__len__")
@@ -636,6 +3442,19 @@ class PostgreSQL(AbstractSQLStore):
         # sys.stderr.write("\n%s\n" % str([r[0] for r in rt]))
         return reduce(lambda x, y: x + y, [rtTuple[0] for rtTuple in rt])
 
+    def _hotCountSelects(self, context, parameters):
+        selects = []
+        for predicate, tableName in self._hotPredicateTables():
+            clauseParts = self.buildContextClause(context, tableName)
+            hotContext = None
+            if clauseParts:
+                hotContext, params = clauseParts
+                parameters.extend([p for p in params if p])
+            selects.append((tableName, tableName,
+                            hotContext and 'where ' + hotContext or '',
+                            HOT_PREDICATE_PARTITION, predicate))
+        return selects
+
     def contexts(self, triple=None):
         """
         This is taken from AbstractSQLStore, and modified, specifically
@@ -652,7 +3471,8 @@ class PostgreSQL(AbstractSQLStore):
         It's reasonable that the AbstractSQLStore implementation is closer
         to the original design, but this conforms to working implementations.
         """
-        c = self._db.cursor()
+        self.flush()
+        c = self._readCursor()
         asserted_table = "%s_asserted_statements" % self._internedId
         asserted_type_table = "%s_type_statements" % self._internedId
         literal_table = "%s_literal_statements" % self._internedId
@@ -662,6 +3482,10 @@ class PostgreSQL(AbstractSQLStore):
         if triple is not None:
             subject, predicate, obj = triple
             if predicate == RDF.type:
+                if self.rdfs_entailment:
+                    # as triples() does
+                    asserted_type_table = \
+                        "%s_entailed_type_statements" % self._internedId
                 # select from asserted rdf:type partition
                 clauseString, params = self.buildClause(
                     'typeTable', subject, RDF.type, obj, Any, True)
@@ -718,6 +3542,12 @@ class PostgreSQL(AbstractSQLStore):
                       ASSERTED_NON_TYPE_PARTITION
                     ))
 
+            elif self._hotTable(predicate):
+                # select from the hot predicate's table
+                selects, params = self._hotPredicateSelects(
+                    subject, predicate, obj)
+                parameters.extend(params)
+
             elif predicate:
                 # select from asserted non rdf:type partition (optionally)
                 # and literal partition (optionally)
@@ -749,6 +3579,12 @@ class PostgreSQL(AbstractSQLStore):
                       ASSERTED_NON_TYPE_PARTITION
                 ))
 
+            if isinstance(predicate, REGEXTerm) or not predicate:
+                hotSelects, params = self._hotPredicateSelects(
+                    subject, predicate, obj)
+                parameters.extend(params)
+                selects.extend(hotSelects)
+
             q = unionSELECT(selects, distinct=True, selectType=CONTEXT_SELECT)
         else:
             selects = [
@@ -770,6 +3606,10 @@ class PostgreSQL(AbstractSQLStore):
                   '',
                   ASSERTED_LITERAL_PARTITION
                 ),
+            ] + [
+                (tableName, 'hot%d' % index, '', HOT_PREDICATE_PARTITION)
+                for index, (predicate, tableName)
+                in enumerate(self._hotPredicateTables())
             ]
             q = unionSELECT(selects, distinct=True, selectType=CONTEXT_SELECT)
 
@@ -779,6 +3619,96 @@ class PostgreSQL(AbstractSQLStore):
             yield Graph(self, URIRef(contextId))
         c.close()
 
+    def describe(self, subjects, depth=1, context=None):
+        """
+        Fetches every outgoing triple of a batch of subjects with a single
+        query, instead of one triples((s, None, None)) call per subject.
+
+        If depth is greater than 1, blank-node objects are followed
+        recursively (a concise bounded description) for up to depth hops;
+        depth=None follows them until no new blank nodes are reached.
+        Triples reached through a blank node are grouped under the subject
+        they were reached from.
+
+        Returns a dict mapping each subject to a list of (s, p, o) triples.
+        """
+        subjects = list(subjects)
+        if not subjects:
+            return {}
+        quoted_table = "%s_quoted_statements" % self._internedId
+        asserted_table = "%s_asserted_statements" % self._internedId
+        asserted_type_table = "%s_type_statements" % self._internedId
+        literal_table = "%s_literal_statements" % self._internedId
+        tables = [
+            (literal_table, 'literal', ASSERTED_LITERAL_PARTITION),
+            (asserted_table, 'asserted', ASSERTED_NON_TYPE_PARTITION),
+            (asserted_type_table, 'typeTable', ASSERTED_TYPE_PARTITION),
+        ]
+        if context is not None:
+            tables.append((quoted_table, 'quoted', QUOTED_PARTITION))
+
+        def describeSELECT(subject):
+            # One branch per partition, restricted to the given subjects (if
+            # any) and context
+            selects, parameters = self._hotPredicateSelects(
+                subject, None, None, context)
+            for tableName, tableAlias, tableType in tables:
+                clauseString, params = self.buildClause(
+                    tableAlias, subject, None, None, context,
+                    tableType == ASSERTED_TYPE_PARTITION)
+                parameters.extend(params)
+                selects.append(
+                    (tableName, tableAlias, clauseString, tableType))
+            return unionSELECT(
+                selects, selectType=TRIPLE_SELECT_NO_ORDER), parameters
+
+        rootSelect, parameters = describeSELECT(subjects)
+        if depth == 1:
+            q = "select subject as root, * from (%s) as described " % \
+                rootSelect
+        else:
+            # Object term of a statement is a BNode (see TERM_COMBINATIONS)
+            bnodeObject = "mod(d.termComb / 3, 5) = 2"
+            stepSelect, params = describeSELECT(None)
+            parameters.extend(params)
+            if depth is None:
+                # Without a depth column the union discards repeated rows,
+                # which stops the recursion on blank node cycles
+                q = "with recursive described as (" + \
+                    "select s.subject as root, s.* from (%s) as s " % \
+                        rootSelect + \
+                    "union select d.root, s.* from (%s) as s, " % \
+                        stepSelect + \
+                    "described as d where s.subject = d.object and " + \
+                    "%s) " % bnodeObject + \
+                    "select * from described "
+            else:
+                q = "with recursive described as (" + \
+                    "select s.subject as root, s.*, 1 as depth " + \
+                    "from (%s) as s " % rootSelect + \
+                    "union select d.root, s.*, d.depth + 1 " + \
+                    "from (%s) as s, described as d " % stepSelect + \
+                    "where s.subject = d.object and " + \
+                    "%s and d.depth < %d) " % (bnodeObject, depth) + \
+                    "select * from described "
+        q += "order by root, subject, predicate, object"
+
+        roots = dict((self.normalizeTerm(s), s) for s in subjects)
+        description = dict((s, []) for s in subjects)
+        seen = set()
+        self.flush()
+        c = self._readCursor()
+        self.executeSQL(c, self._normalizeSQLCmd(q), parameters)
+        for rt in c.fetchall():
+            root = roots[rt[0]]
+            s, p, o, dummy = extractTriple(rt[1:8], self, context)
+            # A statement asserted in several contexts is described once
+            if (root, s, p, o) not in seen:
+                seen.add((root, s, p, o))
+                description[root].append((s, p, o))
+        c.close()
+        return description
+
     # overridden for quote-character reasons
     def executeSQL(self, cursor, qStr, params=None, paramList=False):
         """
@@ -815,18 +3745,21 @@ class PostgreSQL(AbstractSQLStore):
         """
         New method abstracting much cut/paste code from AbstractSQLStore.
         """
-        if isinstance(value, REGEXTerm):
-            return " REGEXP (%s, " + " %s)" % (tableName and '%s.%s' %
-                                (tableName, generic) or generic), [value]
+        if isinstance(value, PrefixTerm):
+            return prefixRangeClause(tableName and '%s.%s' %
+                                     (tableName, generic) or generic, value)
+        elif isinstance(value, REGEXTerm):
+            return "%s ~ " % (tableName and '%s.%s' %
+                              (tableName, generic) or generic) + \
+                "%s", [regexPattern(value)]
         elif isinstance(value, list):
             clauseStrings = []
             paramStrings = []
             for s in value:
                 if isinstance(s, REGEXTerm):
-                    clauseStrings.append(" REGEXP (%s, " + " %s)" %
-                            (tableName and '%s.%s' %
-                                (tableName, generic) or generic) + " %s")
-                    paramStrings.append(self.normalizeTerm(s))
+                    clauseStrings.append("%s ~ " % (tableName and '%s.%s' %
+                                    (tableName, generic) or generic) + "%s")
+                    paramStrings.append(regexPattern(s))
                 elif isinstance(s, (QuotedGraph, Graph)):
                     clauseStrings.append("%s=" % (tableName and '%s.%s' %
                                     (tableName, generic) or generic) + "%s")
@@ -862,6 +3795,67 @@ class PostgreSQL(AbstractSQLStore):
                 cmd = unicode(cmd, 'ascii')
             return cmd.encode('utf-8')
 
+    def buildTypeSQLCommand(self, member, klass, context, storeId):
+        cmd, params = super(PostgreSQL, self).buildTypeSQLCommand(
+            member, klass, context, storeId)
+        return self._insertCommand(cmd), params
+
+    def buildLiteralTripleSQLCommand(
+            self, subject, predicate, obj, context, storeId):
+        """
+        Builds an insert command for literal triples, including the typed
+        value columns
+        """
+        cmd, params = super(PostgreSQL, self).buildLiteralTripleSQLCommand(
+            subject, predicate, obj, context, storeId)
+        cmd = "INSERT INTO %s_literal_statements " % storeId + \
+            "(%s) VALUES (%s)" % (
+                ",".join(LITERAL_TABLE_COLUMNS),
+                ", ".join(["%s"] * len(LITERAL_TABLE_COLUMNS)))
+        return self._insertCommand(cmd), params + typedLiteralValues(obj)
+
+    def buildTripleSQLCommand(
+            self, subject, predicate, obj, context, storeId, quoted):
+        cmd, params = super(PostgreSQL, self).buildTripleSQLCommand(
+            subject, predicate, obj, context, storeId, quoted)
+        return self._insertCommand(cmd), params
+
+    def buildHotSQLCommand(
+            self, subject, predicate, obj, context, tableName):
+        """
+        Builds an insert command for the table of a hot predicate
+        """
+        triplePattern = int(
+            statement2TermCombination(subject, predicate, obj, context))
+        command = "INSERT INTO %s " % tableName + "(%s) VALUES (%s)" % (
+            ",".join(HOT_STATEMENT_COLUMNS),
+            ", ".join(["%s"] * len(HOT_STATEMENT_COLUMNS)))
+        return self._insertCommand(command), [
+            self.normalizeTerm(subject),
+            self.normalizeTerm(obj),
+            self.normalizeTerm(context.identifier),
+            triplePattern,
+            isinstance(obj, Literal) and obj.language or 'NULL',
+            isinstance(obj, Literal) and obj.datatype or 'NULL',
+            ] + typedLiteralValues(obj)
+
+    def _insertCommand(self, cmd):
+        """
+        With unique statement indexes an insert of a statement that is
+        already stored does nothing, rather than raising an error
+        """
+        if self.unique_statements:
+            return cmd + " ON CONFLICT DO NOTHING"
+        return cmd
+
+    def normalizeTerm(self, term):
+        """
+        Passes PrefixTerms through, as AbstractSQLStore does REGEXTerms
+        """
+        if isinstance(term, PrefixTerm):
+            return term
+        return super(PostgreSQL, self).normalizeTerm(term)
+
     def buildSubjClause(self, subject, tableName):
         return self.buildGenericClause("subject", subject, tableName)
 
@@ -872,6 +3866,8 @@ class PostgreSQL(AbstractSQLStore):
         return self.buildGenericClause("object", obj, tableName)
 
     def buildContextClause(self, context, tableName):
+        if isinstance(context, PrefixTerm):
+            return self.buildGenericClause("context", context, tableName)
         context = context is not None \
                             and self.normalizeTerm(context.identifier) \
                             or context
@@ -907,7 +3903,10 @@ CREATE TABLE %s_literal_statements (
     context       text not NULL,
     termComb      smallint not NULL,
     objLanguage   varchar(3),
-    objDatatype   text)"""
+    objDatatype   text,
+    objNumeric    numeric,
+    objTimestamp  timestamp,
+    objBoolean    boolean)"""
 
 CREATE_QUOTED_STATEMENTS_TABLE = """\
 CREATE TABLE %s_quoted_statements (
@@ -919,6 +3918,196 @@ CREATE TABLE %s_quoted_statements (
     objLanguage   varchar(3),
     objDatatype   text)"""
 
+# The predicate of a hot predicate table is implied by the table (see the
+# hot_predicates configuration key)
+CREATE_HOT_STATEMENTS_TABLE = """\
+CREATE TABLE %s (
+    subject       text not NULL,
+    object        text,
+    context       text not NULL,
+    termComb      smallint not NULL,
+    objLanguage   varchar(3),
+    objDatatype   text,
+    objNumeric    numeric,
+    objTimestamp  timestamp,
+    objBoolean    boolean)"""
+
+# Tells the listening stores (see PostgreSQL._namespaceBindings) that the
+# namespace bindings of a table have changed; the channel is the table
+CREATE_NAMESPACE_NOTIFY_FUNCTION = """\
+CREATE OR REPLACE FUNCTION %(table)s_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('%(table)s', '');
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql"""
+
+# Number of statements per context in each statement table (including
+# hot predicate tables), maintained by triggers
+CREATE_STATISTICS_TABLE = """\
+CREATE TABLE IF NOT EXISTS %s (
+    context        text not NULL,
+    statementTable text not NULL,
+    statements     bigint not NULL,
+    PRIMARY KEY (context, statementTable))"""
+
+CREATE_COUNT_FUNCTION = """\
+CREATE OR REPLACE FUNCTION %(id)s_count_statements() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE %(statistics)s AS s SET statements = s.statements - d.n
+        FROM (SELECT context, count(*) AS n FROM old_rows
+              GROUP BY context) AS d
+        WHERE s.context = d.context AND s.statementTable = TG_TABLE_NAME;
+        DELETE FROM %(statistics)s WHERE statements = 0;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO %(statistics)s (context, statementTable, statements)
+        SELECT context, TG_TABLE_NAME, count(*) FROM new_rows
+        GROUP BY context
+        ON CONFLICT (context, statementTable) DO UPDATE
+        SET statements = %(statistics)s.statements + excluded.statements;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql"""
+
+# A trigger with transition tables can only be fired by one kind of event
+STATISTICS_TRIGGERS = [
+    ('INSERT', 'NEW TABLE AS new_rows'),
+    ('UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+    ('DELETE', 'OLD TABLE AS old_rows'),
+]
+
+# Predicates whose transitive closure is kept in stores opened with
+# rdfs_closure=true
+RDFS_CLOSURE_PREDICATES = [RDFS.subClassOf, RDFS.subPropertyOf]
+
+# sub is directly or not a subclass (or subproperty) of super; their term
+# types are numbered as in SUBJECT_TERM_TYPES and OBJECT_TERM_TYPES
+CREATE_RDFS_CLOSURE_TABLE = """\
+CREATE TABLE IF NOT EXISTS %s (
+    predicate     text not NULL,
+    sub           text not NULL,
+    subType       smallint not NULL,
+    super         text not NULL,
+    superType     smallint not NULL,
+    PRIMARY KEY (predicate, super, sub))"""
+
+CREATE_RDFS_CLOSURE_REFRESH_FUNCTION = """\
+CREATE OR REPLACE FUNCTION %(id)s_refresh_rdfs_closure(p text)
+RETURNS void AS $$
+BEGIN
+    DELETE FROM %(closure)s WHERE predicate = p;
+    INSERT INTO %(closure)s (predicate, sub, subType, super, superType)
+    WITH RECURSIVE closure(sub, subType, super, superType) AS (
+        SELECT subject, termComb / 30, object, mod(termComb / 3, 5)
+        FROM %(id)s_asserted_statements WHERE predicate = p
+        UNION
+        SELECT c.sub, c.subType, e.object, mod(e.termComb / 3, 5)
+        FROM closure AS c JOIN %(id)s_asserted_statements AS e
+        ON e.subject = c.super AND e.predicate = p)
+    SELECT p, sub, subType, super, superType FROM closure
+    ON CONFLICT DO NOTHING;
+END
+$$ LANGUAGE plpgsql"""
+
+CREATE_RDFS_CLOSURE_FUNCTION = """\
+CREATE OR REPLACE FUNCTION %(id)s_maintain_rdfs_closure() RETURNS trigger
+AS $$
+DECLARE
+    edge record;
+    affected text[];
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        -- Only the paths from the subjects of the removed edges, and from
+        -- their subterms, can have gone through them: those are walked
+        -- again over the remaining edges
+        FOR edge IN SELECT predicate, array_agg(DISTINCT subject) AS subjects
+                    FROM old_rows WHERE predicate IN (%(predicates)s)
+                    GROUP BY predicate LOOP
+            affected := ARRAY(
+                SELECT unnest(edge.subjects)
+                UNION SELECT sub FROM %(closure)s
+                WHERE predicate = edge.predicate
+                AND super = ANY(edge.subjects));
+            DELETE FROM %(closure)s
+            WHERE predicate = edge.predicate AND sub = ANY(affected);
+            INSERT INTO %(closure)s (predicate, sub, subType, super,
+                                     superType)
+            WITH RECURSIVE closure(sub, subType, super, superType) AS (
+                SELECT subject, termComb / 30, object, mod(termComb / 3, 5)
+                FROM %(id)s_asserted_statements
+                WHERE predicate = edge.predicate AND subject = ANY(affected)
+                UNION
+                SELECT c.sub, c.subType, e.object, mod(e.termComb / 3, 5)
+                FROM closure AS c JOIN %(id)s_asserted_statements AS e
+                ON e.subject = c.super AND e.predicate = edge.predicate)
+            SELECT edge.predicate, sub, subType, super, superType
+            FROM closure
+            ON CONFLICT DO NOTHING;
+        END LOOP;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        FOR edge IN SELECT DISTINCT predicate, subject, termComb / 30 AS
+                    subjectType, object, mod(termComb / 3, 5) AS objectType
+                    FROM new_rows WHERE predicate IN (%(predicates)s) LOOP
+            INSERT INTO %(closure)s (predicate, sub, subType, super,
+                                     superType)
+            SELECT edge.predicate, d.sub, d.subType, a.super, a.superType
+            FROM (SELECT edge.subject AS sub, edge.subjectType AS subType
+                  UNION SELECT sub, subType FROM %(closure)s
+                  WHERE predicate = edge.predicate AND super = edge.subject)
+                 AS d,
+                 (SELECT edge.object AS super, edge.objectType AS superType
+                  UNION SELECT super, superType FROM %(closure)s
+                  WHERE predicate = edge.predicate AND sub = edge.object)
+                 AS a
+            ON CONFLICT DO NOTHING;
+        END LOOP;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql"""
+
+# The rdf:type statements, and those entailed by the members of subclasses
+# (with the term type of the superclass in termComb)
+CREATE_ENTAILED_TYPE_VIEW = """\
+CREATE OR REPLACE VIEW %(id)s_entailed_type_statements AS
+SELECT member, klass, context, termComb FROM %(id)s_type_statements
+UNION
+SELECT t.member, c.super, t.context,
+       t.termComb + (c.superType - mod(t.termComb / 3, 5)) * 3
+FROM %(id)s_type_statements AS t JOIN %(closure)s AS c
+ON c.predicate = '%(subClassOf)s' AND c.sub = t.klass"""
+
+# Columns with a trigram index in stores opened with trigram=true
+TRIGRAM_INDEXED_COLUMNS = [
+    ('%s_asserted_statements', ('subject', 'object')),
+    ('%s_type_statements', ('member', 'klass')),
+    ('%s_literal_statements', ('subject', 'object')),
+    ('%s_quoted_statements', ('subject', 'object')),
+]
+
+# The built-in text search configurations, by language tag
+TEXT_SEARCH_CONFIGURATIONS = {
+    'da': 'danish',
+    'de': 'german',
+    'en': 'english',
+    'es': 'spanish',
+    'fi': 'finnish',
+    'fr': 'french',
+    'hu': 'hungarian',
+    'it': 'italian',
+    'nl': 'dutch',
+    'no': 'norwegian',
+    'pt': 'portuguese',
+    'ro': 'romanian',
+    'ru': 'russian',
+    'sv': 'swedish',
+    'tr': 'turkish',
+}
+
 CREATE_NS_BINDS_TABLE = """\
 CREATE TABLE %s_namespace_binds (
     prefix        varchar(20) UNIQUE not NULL,
@@ -926,6 +4115,78 @@ CREATE TABLE %s_namespace_binds (
     PRIMARY KEY (prefix))"""
 
 
+# The tables of the shared layout hold the statements of every store, each
+# row with the store's (interned) id, and the session's store sees its own
+# rows through views named like the tables of a separate store
+SHARED_TABLE_PREFIX = 'rdflib_shared'
+SHARED_STORE_PREFIX = 'rdflib_store'
+STORE_ID_SETTING = 'rdflib.store_id'
+
+CREATE_SHARED_NS_BINDS_TABLE = """\
+CREATE TABLE %%s_namespace_binds (
+    prefix        varchar(20) not NULL,
+    uri           text,
+    store_id      text not NULL
+                  DEFAULT current_setting('%s', true),
+    PRIMARY KEY (store_id, prefix))""" % STORE_ID_SETTING
+
+# The stores created in the shared layout, which (unlike the views) only
+# exist for those
+SHARED_STORES_TABLE = SHARED_TABLE_PREFIX + '_stores'
+CREATE_SHARED_STORES_TABLE = """\
+CREATE TABLE IF NOT EXISTS %s (
+    store_id      text not NULL,
+    PRIMARY KEY (store_id))""" % SHARED_STORES_TABLE
+
+# Statements passed to removeN, staged for DELETE ... USING
+CREATE_REMOVED_STATEMENTS_TABLE = """\
+CREATE TEMP TABLE IF NOT EXISTS %s (
+    partition     smallint not NULL,
+    subject       text not NULL,
+    predicate     text not NULL,
+    object        text,
+    context       text,
+    objLanguage   text,
+    objDatatype   text) ON COMMIT DROP"""
+
+# The solutions of the WHERE clause of an update, see PostgreSQL.update
+UPDATE_SOLUTIONS_TABLE = 'update_solutions'
+
+# Position of the context's term type among the last letters of the
+# TERM_COMBINATIONS strings
+CONTEXT_TERM_TYPES = {'U': 0, 'B': 1, 'F': 2}
+
+# The term types of subjects and objects, by their position in the
+# TERM_COMBINATIONS order (termComb / 30 and mod(termComb / 3, 5))
+SUBJECT_TERM_TYPES = 'UVBFs'
+OBJECT_TERM_TYPES = 'UVBLF'
+
+# Tables that are partitioned by context in stores created with partition=
+STATEMENT_TABLES = [
+    '%s_asserted_statements',
+    '%s_type_statements',
+    '%s_literal_statements',
+    '%s_quoted_statements',
+]
+PARTITIONED_TABLE_STMTS = [
+    CREATE_ASSERTED_STATEMENTS_TABLE,
+    CREATE_ASSERTED_TYPE_STATEMENTS_TABLE,
+    CREATE_LITERAL_STATEMENTS_TABLE,
+    CREATE_QUOTED_STATEMENTS_TABLE,
+]
+
+STATEMENT_COLUMNS = ('subject', 'predicate', 'object', 'context', 'termComb')
+LITERAL_STATEMENT_COLUMNS = STATEMENT_COLUMNS + ('objLanguage', 'objDatatype')
+TYPE_STATEMENT_COLUMNS = ('member', 'klass', 'context', 'termComb')
+# Values of numeric, date/time and boolean literals, for range lookups
+TYPED_VALUE_COLUMNS = ('objNumeric', 'objTimestamp', 'objBoolean')
+TYPED_VALUE_COLUMN_TYPES = zip(
+    TYPED_VALUE_COLUMNS, ('numeric', 'timestamp', 'boolean'))
+LITERAL_TABLE_COLUMNS = LITERAL_STATEMENT_COLUMNS + TYPED_VALUE_COLUMNS
+HOT_STATEMENT_COLUMNS = ('subject', 'object', 'context', 'termComb',
+                         'objLanguage', 'objDatatype') + TYPED_VALUE_COLUMNS
+OPTIONAL_COLUMNS = ('objLanguage', 'objDatatype') + TYPED_VALUE_COLUMNS
+
 CREATE_TABLE_STMTS = [
     CREATE_ASSERTED_STATEMENTS_TABLE,
     CREATE_ASSERTED_TYPE_STATEMENTS_TABLE,
@@ -978,3 +4239,130 @@ INDICES = [
             ("%s_uri_index", ('uri', )),
             ],
         )]
+
+# The indexes serving the prefix ranges of triples_with_prefix (see
+# prefixRangeClause). Under a collation other than C a text_pattern_ops index
+# can serve neither ORDER BY nor row comparisons, so these come on top of the
+# default btree indexes of INDICES. Literal objects never match a prefix.
+PATTERN_INDICES = [
+    (
+        "%s_asserted_statements",
+        [
+            ("%s_A_s_pattern_index", ('subject text_pattern_ops', )),
+            ("%s_A_o_pattern_index", ('object text_pattern_ops', )),
+            ("%s_A_c_pattern_index", ('context text_pattern_ops', )),
+            ],
+        ),
+    (
+        "%s_type_statements",
+        [
+            ("%s_member_pattern_index", ('member text_pattern_ops', )),
+            ("%s_klass_pattern_index", ('klass text_pattern_ops', )),
+            ("%s_c_pattern_index", ('context text_pattern_ops', )),
+            ],
+        ),
+    (
+        "%s_literal_statements",
+        [
+            ("%s_L_s_pattern_index", ('subject text_pattern_ops', )),
+            ("%s_L_c_pattern_index", ('context text_pattern_ops', )),
+            ],
+        ),
+    (
+        "%s_quoted_statements",
+        [
+            ("%s_Q_s_pattern_index", ('subject text_pattern_ops', )),
+            ("%s_Q_o_pattern_index", ('object text_pattern_ops', )),
+            ("%s_Q_c_pattern_index", ('context text_pattern_ops', )),
+            ],
+        )]
+
+# The key triples_page orders the statements by and pages on
+PAGE_KEY_COLUMNS = ['subject', 'predicate', 'object',
+                    "coalesce(objLanguage, '')",
+                    "coalesce(objDatatype, '')"]
+
+# The indexes in the order of PAGE_KEY_COLUMNS, which serve both the order
+# and the key comparison of triples_page. Literal and quoted objects can be
+# longer than a btree entry allows, so those stop at the predicate; the
+# subject index of a hot predicate table serves it likewise.
+KEYSET_INDICES = [
+    (
+        "%s_asserted_statements",
+        [
+            ("%s_A_key_index", ('subject', 'predicate', 'object')),
+            ],
+        ),
+    (
+        "%s_type_statements",
+        [
+            ("%s_T_key_index", ('member', 'klass')),
+            ],
+        ),
+    (
+        "%s_literal_statements",
+        [
+            ("%s_L_key_index", ('subject', 'predicate')),
+            ],
+        ),
+    (
+        "%s_quoted_statements",
+        [
+            ("%s_Q_key_index", ('subject', 'predicate')),
+            ],
+        )]
+
+# Created for stores opened with unique=true. Literal objects can be longer
+# than a btree entry allows, so those are keyed on their md5 hash; NULL never
+# equals NULL, so the nullable columns are coalesced
+UNIQUE_INDICES = [
+    (
+        "%s_asserted_statements",
+        [
+            ("%s_A_unique_index",
+             ('subject', 'predicate', 'object', 'context', 'termComb')),
+            ],
+        ),
+    (
+        "%s_type_statements",
+        [
+            ("%s_T_unique_index",
+             ('member', 'klass', 'context', 'termComb')),
+            ],
+        ),
+    (
+        "%s_literal_statements",
+        [
+            ("%s_L_unique_index",
+             ('subject', 'predicate', "coalesce(md5(object), '')", 'context',
+              'termComb', "coalesce(objLanguage, '')",
+              "coalesce(objDatatype, '')")),
+            ],
+        ),
+    (
+        "%s_quoted_statements",
+        [
+            ("%s_Q_unique_index",
+             ('subject', 'predicate', "coalesce(md5(object), '')", 'context',
+              'termComb', "coalesce(objLanguage, '')",
+              "coalesce(objDatatype, '')")),
+            ],
+        )]
+
+# Indexes of each hot predicate table, as (name, method, columns); the name
+# is formatted with the table name. Objects may be literals too long for a
+# btree entry, so they get a hash index
+HOT_INDICES = [
+    ("%s_s_index", 'btree', ('subject', )),
+    ("%s_o_index", 'hash', ('object', )),
+    ("%s_c_index", 'btree', ('context', )),
+    ]
+# The PATTERN_INDICES of a hot predicate table
+HOT_PATTERN_INDICES = [
+    ("%s_s_pattern_index", 'btree', ('subject text_pattern_ops', )),
+    ("%s_c_pattern_index", 'btree', ('context text_pattern_ops', )),
+    ]
+HOT_UNIQUE_INDEX = (
+    "%s_unique_index",
+    ('subject', "coalesce(md5(object), '')", 'context', 'termComb',
+     "coalesce(objLanguage, '')", "coalesce(objDatatype, '')"))
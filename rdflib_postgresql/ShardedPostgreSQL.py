@@ -0,0 +1,314 @@
+"""
+A store spreading its statements over several PostgreSQL databases.
+
+Each shard is a PostgreSQL store of its own, with the store's identifier,
+in one of the databases listed by the ``shards`` key of the configuration
+(host[:port][/dbname] endpoints which take their other connection
+parameters, and store options, from the configuration). ``shard_by``
+chooses what a statement is placed by: the hash of its context (the
+default) or of its subject.
+
+.. sourcecode:: python
+
+    graph = ConjunctiveGraph('ShardedPostgreSQL')
+    graph.open("user=postgresql dbname=rdf "
+               "shards=db1/rdf,db2/rdf,db3/rdf shard_by=context")
+
+A pattern naming the term statements are placed by is matched on its
+shard alone, other patterns are matched on every shard in parallel and
+the (ordered) results merged. len() and contexts() add up the shards.
+
+commit() and rollback() are applied to each shard in turn, there is no
+transaction spanning the shards: a commit that fails on a shard leaves the
+shards committed before it committed, and those after it uncommitted, so
+that the store is no longer consistent across shards.
+"""
+import hashlib
+import heapq
+import itertools
+import sys
+import threading
+from Queue import Queue, Empty
+
+from rdflib.graph import Graph
+from rdflib.store import Store, NO_STORE, VALID_STORE
+from rdflib.term import Node
+
+from rdflib_postgresql.PostgreSQL import (
+    PostgreSQL,
+    ParseConfigurationString,
+    GetEndpointConfigurationStrings)
+
+
+def termKey(term):
+    """
+    The utf-8 encoding of a term as stored, by which the shards order
+    their triples (see PostgreSQL.byte_order)
+    """
+    if isinstance(term, Graph):
+        term = term.identifier
+    return unicode(term).encode('utf-8')
+
+
+def tripleKey(triple):
+    return tuple([termKey(term) for term in triple])
+
+
+def parallel(functions, queueSize=1000):
+    """
+    Runs each function in a thread of its own, returning an iterator over
+    the items of the iterable each returns. The items are queued as soon as
+    they are produced, up to queueSize items ahead of the caller, and
+    exceptions are raised in the caller. Closing an iterator (or reading it
+    to the end) stops its thread and waits for it.
+    """
+    done = object()
+    workers = []
+
+    def produce(function, queue, stop):
+        try:
+            for item in function():
+                if stop.is_set():
+                    break
+                queue.put((item, None))
+        except Exception:
+            queue.put((done, sys.exc_info()))
+        else:
+            queue.put((done, None))
+
+    for function in functions:
+        queue = Queue(queueSize)
+        stop = threading.Event()
+        thread = threading.Thread(target=produce,
+                                  args=(function, queue, stop))
+        thread.daemon = True
+        thread.start()
+        workers.append((thread, queue, stop))
+
+    def consume(thread, queue, stop):
+        try:
+            while True:
+                item, error = queue.get()
+                if error is not None:
+                    raise error[0], error[1], error[2]
+                if item is done:
+                    return
+                yield item
+        finally:
+            # The thread may be waiting for room in the queue
+            stop.set()
+            while thread.is_alive():
+                try:
+                    queue.get(timeout=0.1)
+                except Empty:
+                    pass
+            thread.join()
+    return [consume(*worker) for worker in workers]
+
+
+class ShardedPostgreSQL(Store):
+    """
+    A context and formula aware store over shards which are PostgreSQL
+    stores, see the module documentation
+    """
+    context_aware = True
+    formula_aware = True
+    transaction_aware = True
+    regex_matching = PostgreSQL.regex_matching
+    # 'context' or 'subject', see the shard_by configuration key
+    shard_by = 'context'
+
+    def __init__(self, configuration=None, identifier=None):
+        self.identifier = identifier
+        self.shards = []
+        super(ShardedPostgreSQL, self).__init__(
+            configuration=configuration, identifier=identifier)
+
+    def _shardConfigurations(self, configuration):
+        configDict = ParseConfigurationString(configuration)
+        if 'replicas' in configDict:
+            raise RuntimeError('Sharded stores do not support replicas')
+        shardBy = configDict.get('shard_by', self.shard_by)
+        if shardBy not in ('context', 'subject'):
+            raise RuntimeError(
+                'PostgreSQL shard_by must be context or subject')
+        configurations = [
+            ' '.join([part for part in shardConfiguration.split(' ')
+                      if not part.startswith('shard_by=')])
+            for shardConfiguration
+            in GetEndpointConfigurationStrings(configuration, 'shards')]
+        if not configurations:
+            raise RuntimeError('No shards configured')
+        return shardBy, configurations
+
+    def open(self, configuration, create=True):
+        """
+        Opens (or creates) the store on every shard, see PostgreSQL.open
+        """
+        self.shard_by, configurations = \
+            self._shardConfigurations(configuration)
+        self.configuration = configuration
+        shards = []
+        for shardConfiguration in configurations:
+            shard = PostgreSQL(identifier=self.identifier)
+            # Shards sort their triples as tripleKey does so that they can
+            # be merged
+            shard.byte_order = True
+            if shard.open(shardConfiguration, create=create) != VALID_STORE:
+                for opened in shards:
+                    opened.close()
+                return NO_STORE
+            shards.append(shard)
+        self.shards = shards
+        return VALID_STORE
+
+    def close(self, commit_pending_transaction=False):
+        for shard in self.shards:
+            shard.close(commit_pending_transaction=commit_pending_transaction)
+        self.shards = []
+
+    def destroy(self, configuration):
+        shardBy, configurations = self._shardConfigurations(configuration)
+        shards = self.shards
+        if len(shards) != len(configurations):
+            shards = [PostgreSQL(identifier=self.identifier)
+                      for shardConfiguration in configurations]
+        # The open shards are destroyed through their own connections,
+        # whose transactions would otherwise block the drops
+        for shard, shardConfiguration in zip(shards, configurations):
+            shard.destroy(shardConfiguration)
+
+    def commit(self):
+        """
+        Commits each shard in turn. This is not atomic: if a shard fails to
+        commit, the shards before it stay committed and the others are left
+        with their transactions open (see the module documentation).
+        """
+        for shard in self.shards:
+            shard.commit()
+
+    def rollback(self):
+        for shard in self.shards:
+            shard.rollback()
+
+    def shard(self, term):
+        """
+        The shard of the statements placed by term
+        """
+        digest = hashlib.md5(termKey(term)).hexdigest()
+        return self.shards[int(digest[:8], 16) % len(self.shards)]
+
+    def _placement(self, subject, context):
+        """
+        The shard a statement with subject in context is stored in
+        """
+        if self.shard_by == 'context':
+            return self.shard(context)
+        return self.shard(subject)
+
+    def _shards(self, subject, context):
+        """
+        The shards holding the statements matching subject (which may be
+        None or a REGEXTerm) in context (which may be None)
+        """
+        if self.shard_by == 'context':
+            if context is not None:
+                return [self.shard(context)]
+        elif isinstance(subject, Node):
+            return [self.shard(subject)]
+        return self.shards
+
+    def _graph(self, graph):
+        # The shards' graphs are given back as graphs of this store
+        return graph.__class__(self, graph.identifier)
+
+    def add(self, (subject, predicate, obj), context, quoted=False):
+        shard = self._placement(subject, context)
+        shard.add((subject, predicate, obj), context, quoted)
+
+    def addN(self, quads):
+        shardQuads = {}
+        for subject, predicate, obj, context in quads:
+            shard = self._placement(subject, context)
+            shardQuads.setdefault(shard, []).append(
+                (subject, predicate, obj, context))
+        for shard, quads in shardQuads.items():
+            shard.addN(quads)
+
+    def remove(self, (subject, predicate, obj), context=None):
+        """
+        Removes the matching statements from the shards holding them, and
+        returns the rows deleted per partition summed over those shards
+        (see PostgreSQL.remove), or None if every shard buffered the
+        removal
+        """
+        counts = None
+        for shard in self._shards(subject, context):
+            shardCounts = shard.remove((subject, predicate, obj), context)
+            if shardCounts is not None:
+                counts = counts or {}
+                for partition, count in shardCounts.items():
+                    counts[partition] = counts.get(partition, 0) + count
+        return counts
+
+    def triples(self, (subject, predicate, obj), context=None):
+        """
+        A generator over the triples matching pattern (see
+        PostgreSQL.triples), in (subject, predicate, object) order when
+        several shards are queried
+        """
+        shards = self._shards(subject, context)
+        if len(shards) == 1:
+            for triple, contexts in shards[0].triples(
+                    (subject, predicate, obj), context):
+                yield triple, (self._graph(graph) for graph in contexts)
+            return
+
+        def shardTriples(index, shard):
+            return lambda: (
+                (tripleKey(triple), index, triple, list(contexts))
+                for triple, contexts
+                in shard.triples((subject, predicate, obj), context))
+        merged = heapq.merge(*parallel(
+            [shardTriples(index, shard)
+             for index, shard in enumerate(shards)]))
+        # Distinct triples can have the same key (literals differing only
+        # in language or datatype), and a triple can be in contexts of
+        # several shards
+        for key, group in itertools.groupby(merged, lambda item: item[0]):
+            triples = []
+            tripleContexts = {}
+            for key, index, triple, contexts in group:
+                if triple not in tripleContexts:
+                    triples.append(triple)
+                    tripleContexts[triple] = []
+                tripleContexts[triple].extend(contexts)
+            for triple in triples:
+                yield triple, (self._graph(graph)
+                               for graph in tripleContexts[triple])
+
+    def __len__(self, context=None):
+        return sum([shard.__len__(context)
+                    for shard in self._shards(None, context)])
+
+    def contexts(self, triple=None):
+        subject = triple and triple[0] or None
+        seen = set()
+        for shard in self._shards(subject, None):
+            for graph in shard.contexts(triple):
+                if graph.identifier not in seen:
+                    seen.add(graph.identifier)
+                    yield self._graph(graph)
+
+    def bind(self, prefix, namespace):
+        for shard in self.shards:
+            shard.bind(prefix, namespace)
+
+    def prefix(self, namespace):
+        return self.shards[0].prefix(namespace)
+
+    def namespace(self, prefix):
+        return self.shards[0].namespace(prefix)
+
+    def namespaces(self):
+        return self.shards[0].namespaces()
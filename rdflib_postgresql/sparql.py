@@ -0,0 +1,193 @@
+"""
+SPARQL evaluation hooks for the PostgreSQL store.
+
+rdflib evaluates the triple patterns of a basic graph pattern one at a
+time, ordered only by how many of their terms are bound. Once
+:func:`register` has been called, the patterns of a BGP evaluated over a
+PostgreSQL store are ordered by their estimated number of matches instead
+(see PostgreSQL.estimate), so that a selective pattern is not evaluated
+after a broad scan. A BGP is evaluated again for each solution of the parts
+it joins with, so the estimates are kept for the rest of the query by the
+shape of their patterns. Property paths such as ``skos:broader+`` or
+``rdfs:subClassOf*`` with a bound end are evaluated by a single recursive
+query (see PostgreSQL.transitive_closure) rather than one lookup per node:
+
+.. sourcecode:: python
+
+    from rdflib_postgresql import sparql
+    sparql.register()
+    graph.query(...)
+
+"""
+import weakref
+
+from rdflib.graph import ConjunctiveGraph
+from rdflib.plugins.sparql import CUSTOM_EVALS
+from rdflib.plugins.sparql.evaluate import evalBGP
+from rdflib.paths import MulPath, Path
+from rdflib.term import BNode, URIRef, Variable
+from rdflib_postgresql.PostgreSQL import PostgreSQL
+
+
+# The estimates of the queries being evaluated, by query prologue, as
+# (bnodes of the evaluation, {pattern shape: estimate}), see queryEstimates
+_estimates = weakref.WeakKeyDictionary()
+
+# Stands for a variable bound by the solution a BGP is evaluated for, in
+# pattern shapes
+BOUND = object()
+
+
+def register():
+    """
+    Enables the evaluation hooks of this module
+    """
+    CUSTOM_EVALS[__name__] = evalPart
+
+
+def unregister():
+    CUSTOM_EVALS.pop(__name__, None)
+
+
+def unbound(term):
+    if isinstance(term, (Variable, BNode)):
+        return None
+    return term
+
+
+def variables(triple):
+    return set([term for term in triple
+                if isinstance(term, (Variable, BNode))])
+
+
+def graphContext(graph):
+    """
+    The context a graph's patterns are matched in: a ConjunctiveGraph
+    queries the union of all contexts
+    """
+    return not isinstance(graph, ConjunctiveGraph) and graph or None
+
+
+class TransitivePath(MulPath):
+    """
+    A ``p+`` or ``p*`` path over a single predicate, evaluated by the
+    store when one of its ends is bound
+    """
+
+    def __init__(self, path):
+        MulPath.__init__(self, path.path, path.mod)
+
+    def eval(self, graph, subj=None, obj=None, first=True):
+        store = graph.store
+        if not first or not isinstance(store, PostgreSQL) \
+                or subj is None and obj is None:
+            for pair in MulPath.eval(self, graph, subj, obj, first):
+                yield pair
+            return
+        inverse = subj is None
+        node = subj
+        if inverse:
+            node = obj
+        nodes = store.transitive_closure(
+            node, self.path, inverse, graphContext(graph))
+        if self.zero and node not in nodes:
+            nodes.insert(0, node)
+        for other in nodes:
+            if inverse:
+                yield other, obj
+            elif obj is None or other == obj:
+                yield subj, other
+
+
+def storePath(predicate):
+    """
+    predicate, or the TransitivePath evaluating it if it is a
+    ``p+``/``p*`` path over a single predicate
+    """
+    if isinstance(predicate, MulPath) and predicate.more \
+            and isinstance(predicate.path, URIRef):
+        return TransitivePath(predicate)
+    return predicate
+
+
+def queryEstimates(ctx):
+    """
+    The estimates cache of the query evaluation ctx belongs to. Evaluations
+    of a prepared query share its prologue, but not their bnodes.
+    """
+    prologue = getattr(ctx, 'prologue', None)
+    if prologue is None:
+        return {}
+    bnodes, cache = _estimates.get(prologue, (None, None))
+    if bnodes is not ctx.bnodes:
+        bnodes, cache = ctx.bnodes, {}
+        _estimates[prologue] = (bnodes, cache)
+    return cache
+
+
+def estimate(store, triple, context=None, lookup=unbound, cache=None):
+    """
+    The store's estimate for a triple pattern, from cache if given. The
+    estimates are cached by the shape of the pattern: its terms, with
+    the variables bound by lookup standing for any value.
+    """
+    pattern = tuple([lookup(term) for term in triple])
+    if cache is None:
+        return store.estimate(pattern, context)
+    shape = (context is not None and context.identifier or None, ) + tuple(
+        [value is not None and isinstance(term, (Variable, BNode)) and
+         BOUND or value for term, value in zip(triple, pattern)])
+    if shape not in cache:
+        cache[shape] = store.estimate(pattern, context)
+    return cache[shape]
+
+
+def reorderTriples(store, triples, context=None, lookup=unbound,
+                   cache=None):
+    """
+    Orders the triple patterns of a BGP so that the most selective ones
+    are evaluated first. lookup maps a term to the value it is bound to, or
+    None; cache keeps the estimates (see estimate). Each step picks the
+    pattern with the smallest estimate among the ones sharing a variable
+    with the patterns already picked (if any), so that no cross product is
+    introduced while a join is possible.
+    """
+    remaining = [
+        (estimate(store, triple, context, lookup, cache), index, triple)
+        for index, triple in enumerate(triples)]
+    ordered = []
+    seen = set()
+    while remaining:
+        connected = [candidate for candidate in remaining
+                     if seen & variables(candidate[2])] or remaining
+        best = min(connected)
+        remaining.remove(best)
+        ordered.append(best[2])
+        seen.update(variables(best[2]))
+    return ordered
+
+
+def evalPart(ctx, part):
+    """
+    Evaluates a BGP over a PostgreSQL store with its patterns reordered
+    by reorderTriples and its transitive paths evaluated by the store.
+    Anything else is left to rdflib.
+    """
+    graph = ctx.graph
+    if part.name != 'BGP' \
+            or not isinstance(getattr(graph, 'store', None), PostgreSQL):
+        raise NotImplementedError()
+    triples = [(s, storePath(p), o) for s, p, o in part.triples]
+    if len(triples) < 2:
+        if not triples or not isinstance(triples[0][1], TransitivePath):
+            raise NotImplementedError()
+        return evalBGP(ctx, triples)
+
+    def lookup(term):
+        # Paths are estimated as unbound predicates
+        if isinstance(term, Path):
+            return None
+        return ctx[term]
+    return evalBGP(ctx, reorderTriples(
+        graph.store, triples, graphContext(graph), lookup,
+        queryEstimates(ctx)))
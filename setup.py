@@ -91,6 +91,8 @@ config = dict(
     entry_points = {
         'rdf.plugins.store': [
             'PostgreSQL = rdflib_postgresql.PostgreSQL:PostgreSQL',
+            'ShardedPostgreSQL = '
+            'rdflib_postgresql.ShardedPostgreSQL:ShardedPostgreSQL',
         ],
     }
 )
@@ -7,4 +7,6 @@ sys.path.insert(0, '/var/lib/tomcat6/webapps/hudson/jobs/rdfextras')
 plugin.register(
         'PostgreSQL', store.Store,
         'rdflib_postgresql.PostgreSQL', 'PostgreSQL')
-
+plugin.register(
+        'ShardedPostgreSQL', store.Store,
+        'rdflib_postgresql.ShardedPostgreSQL', 'ShardedPostgreSQL')
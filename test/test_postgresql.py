@@ -1,16 +1,45 @@
 import unittest
 import os
+import re
+import datetime
 from nose.exc import SkipTest
 import graph_case
 import context_case
 from n3_2_case import testN3Store
-from rdflib.graph import Graph
+from rdflib.graph import ConjunctiveGraph, Graph
+from rdflib.store import NO_STORE, VALID_STORE, Store
+from rdfextras.store.AbstractSQLStore import (
+    ASSERTED_LITERAL_PARTITION,
+    ASSERTED_NON_TYPE_PARTITION,
+    ASSERTED_TYPE_PARTITION,
+    QUOTED_PARTITION,
+    )
+from rdflib import BNode, Literal, RDF, RDFS, URIRef, plugin
+from rdfextras.store.REGEXMatching import REGEXTerm
 
 # CONNSTR default is Travis-CI config
 configString = os.environ.get(
     'CONNSTR',
     "user=postgresql host=127.0.0.1 dbname=rdflibpostgresql_test")
 
+# The tables of a store as init_db created them before schema versions were
+# recorded
+BASELINE_TABLES = [
+    "CREATE TABLE %s_asserted_statements (subject text not NULL, "
+    "predicate text not NULL, object text not NULL, context text not NULL, "
+    "termComb smallint not NULL)",
+    "CREATE TABLE %s_type_statements (member text not NULL, "
+    "klass text not NULL, context text not NULL, termComb smallint not NULL)",
+    "CREATE TABLE %s_quoted_statements (subject text not NULL, "
+    "predicate text not NULL, object text, context text not NULL, "
+    "termComb smallint not NULL, objLanguage varchar(3), objDatatype text)",
+    "CREATE TABLE %s_namespace_binds (prefix varchar(20) UNIQUE not NULL, "
+    "uri text, PRIMARY KEY (prefix))",
+    "CREATE TABLE %s_literal_statements (subject text not NULL, "
+    "predicate text not NULL, object text, context text not NULL, "
+    "termComb smallint not NULL, objLanguage varchar(3), objDatatype text)",
+]
+
 
 class PostgreSQLGraphTestCase(graph_case.GraphTestCase):
     store_name = "PostgreSQL"
@@ -46,6 +75,1660 @@ class PostgreSQLStoreTests(unittest.TestCase):
     def test_PostgreSQL_testN3_store(self):
         testN3Store('PostgreSQL', configString)
 
+
+class PostgreSQLStoreTestCase(unittest.TestCase):
+    """
+    Opens a new store at path as self.graph for each test, with the
+    statements populate adds, and destroys it afterwards
+    """
+    storetest = True
+    store_name = "PostgreSQL"
+    path = configString
+    create = True
+    graphClass = ConjunctiveGraph
+
+    def setUp(self):
+        self.graph = self.graphClass(store=self.store_name)
+        self.graph.destroy(self.path)
+        self.graph.open(self.path, create=self.create)
+        self.populate()
+        self.graph.commit()
+
+    def tearDown(self):
+        self.graph.destroy(self.path)
+        self.graph.close()
+
+    def populate(self):
+        pass
+
+    def createBaselineStore(self, literals=()):
+        """
+        Replaces the store with the BASELINE_TABLES, holding the literal
+        statements (as triples) in context-1
+        """
+        import psycopg2
+        from rdfextras.store.AbstractSQLStore import \
+            statement2TermCombination
+        from rdflib_postgresql.PostgreSQL import GetConfigurationString
+        store = self.graph.store
+        self.graph.destroy(self.path)
+        context = Graph(store, URIRef(u'context-1'))
+        db = psycopg2.connect(GetConfigurationString(self.path))
+        c = db.cursor()
+        for statement in BASELINE_TABLES:
+            c.execute(statement % store._internedId)
+        for subject, predicate, obj in literals:
+            c.execute(
+                "INSERT INTO %s_literal_statements " % store._internedId +
+                "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                (unicode(subject), unicode(predicate), unicode(obj),
+                 unicode(context.identifier),
+                 int(statement2TermCombination(
+                     subject, predicate, obj, context)),
+                 obj.language, obj.datatype and unicode(obj.datatype)))
+        db.commit()
+        db.close()
+
+
+class PostgreSQLDescribeTests(PostgreSQLStoreTestCase):
+    graphClass = Graph
+    alice = URIRef(u'alice')
+    bob = URIRef(u'bob')
+    knows = URIRef(u'knows')
+    name = URIRef(u'name')
+    address = URIRef(u'address')
+    city = URIRef(u'city')
+    person = URIRef(u'Person')
+
+    def populate(self):
+        self.home = BNode()
+        self.graph.add((self.alice, RDF.type, self.person))
+        self.graph.add((self.alice, self.name, Literal(u'Alice')))
+        self.graph.add((self.alice, self.knows, self.bob))
+        self.graph.add((self.alice, self.address, self.home))
+        self.graph.add((self.home, self.city, Literal(u'Paris')))
+        self.graph.add((self.bob, self.name, Literal(u'Bob')))
+
+    def testDescribeGroupsBySubject(self):
+        description = self.graph.store.describe([self.alice, self.bob])
+        self.assertEqual(set(description), set([self.alice, self.bob]))
+        self.assertEqual(set(description[self.alice]), set([
+            (self.alice, RDF.type, self.person),
+            (self.alice, self.name, Literal(u'Alice')),
+            (self.alice, self.knows, self.bob),
+            (self.alice, self.address, self.home)]))
+        self.assertEqual(description[self.bob],
+                         [(self.bob, self.name, Literal(u'Bob'))])
+
+    def testDescribeFollowsBlankNodes(self):
+        for depth in (2, None):
+            description = self.graph.store.describe(
+                [self.alice], depth=depth, context=self.graph)
+            self.assertEqual(len(description[self.alice]), 5)
+            assert (self.home, self.city, Literal(u'Paris')) \
+                in description[self.alice]
+
+
+class PostgreSQLWriteBufferTests(PostgreSQLStoreTestCase):
+    graphClass = Graph
+    path = configString + " write_buffer=100"
+    michel = URIRef(u'michel')
+    likes = URIRef(u'likes')
+    name = URIRef(u'name')
+    person = URIRef(u'Person')
+
+    def storedRows(self):
+        store = self.graph.store
+        c = store._db.cursor()
+        c.execute("select count(*) from %s_asserted_statements" %
+                  store._internedId)
+        count = c.fetchone()[0]
+        c.close()
+        return count
+
+    def addStuff(self):
+        for i in range(10):
+            self.graph.add((self.michel, self.likes, URIRef(u'food%d' % i)))
+        self.graph.add((self.michel, self.name, Literal(u'Michel')))
+        self.graph.add((self.michel, self.name, Literal(u'Michel', 'fr')))
+        self.graph.add((self.michel, RDF.type, self.person))
+
+    def testAddsAreBuffered(self):
+        self.addStuff()
+        self.assertEqual(self.storedRows(), 0)
+        # reads flush the buffer first
+        self.assertEqual(len(self.graph), 13)
+        self.assertEqual(self.storedRows(), 10)
+
+    def testBufferSizeTriggersFlush(self):
+        self.graph.store.write_buffer_size = 4
+        for i in range(10):
+            self.graph.add((self.michel, self.likes, URIRef(u'food%d' % i)))
+        self.assertEqual(self.storedRows(), 8)
+
+    def testRemovesAreBuffered(self):
+        self.addStuff()
+        self.graph.commit()
+        self.graph.remove((self.michel, self.likes, URIRef(u'food1')))
+        self.graph.remove((self.michel, self.name, Literal(u'Michel')))
+        self.graph.remove((self.michel, RDF.type, self.person))
+        self.assertEqual(self.storedRows(), 10)
+        self.graph.commit()
+        self.assertEqual(self.storedRows(), 9)
+        self.assertEqual(len(self.graph), 9)
+
+    def testRollbackDiscardsBuffer(self):
+        self.addStuff()
+        self.graph.rollback()
+        self.assertEqual(len(self.graph), 0)
+
+    def testAddN(self):
+        self.graph.store.write_buffer_size = 0
+        self.graph.addN([
+            (self.michel, self.likes, URIRef(u'food%d' % i), self.graph)
+            for i in range(10)] + [
+            (self.michel, self.name, Literal(u'tab\tand\nnewline'),
+             self.graph)])
+        self.assertEqual(self.storedRows(), 10)
+        self.assertEqual(list(self.graph.objects(self.michel, self.name)),
+                         [Literal(u'tab\tand\nnewline')])
+
+
+class PostgreSQLUniqueStatementTests(PostgreSQLStoreTestCase):
+    graphClass = Graph
+    path = configString + " unique=true"
+    michel = URIRef(u'michel')
+    likes = URIRef(u'likes')
+    name = URIRef(u'name')
+    pizza = URIRef(u'pizza')
+    person = URIRef(u'Person')
+
+    def addStuff(self):
+        self.graph.add((self.michel, self.likes, self.pizza))
+        self.graph.add((self.michel, RDF.type, self.person))
+        self.graph.add((self.michel, self.name, Literal(u'Michel')))
+        self.graph.add((self.michel, self.name, Literal(u'Michel', 'fr')))
+
+    def storedRows(self):
+        store = self.graph.store
+        c = store._db.cursor()
+        count = 0
+        for table in ('asserted', 'type', 'literal'):
+            c.execute("select count(*) from %s_%s_statements" % (
+                store._internedId, table))
+            count += c.fetchone()[0]
+        c.close()
+        return count
+
+    def testDuplicateAddsAreIgnored(self):
+        self.addStuff()
+        self.addStuff()
+        self.graph.commit()
+        self.assertEqual(self.storedRows(), 4)
+
+    def testDuplicateCopiesAreIgnored(self):
+        self.addStuff()
+        self.graph.store.write_buffer_size = 100
+        self.addStuff()
+        self.addStuff()
+        self.graph.commit()
+        self.assertEqual(self.storedRows(), 4)
+
+    def testReopenedWithoutOption(self):
+        self.addStuff()
+        self.graph.commit()
+        self.graph.close()
+        self.graph = Graph(store=self.store_name,
+                           identifier=self.graph.identifier)
+        self.graph.open(configString, create=False)
+        self.assertTrue(self.graph.store.unique_statements)
+        self.addStuff()
+        self.graph.commit()
+        self.assertEqual(self.storedRows(), 4)
+
+
+class PostgreSQLRemoveNTests(PostgreSQLStoreTestCase):
+    michel = URIRef(u'michel')
+    likes = URIRef(u'likes')
+    name = URIRef(u'name')
+    person = URIRef(u'Person')
+
+    def populate(self):
+        self.c1 = Graph(self.graph.store, URIRef(u'context-1'))
+        self.c2 = Graph(self.graph.store, URIRef(u'context-2'))
+        for context in (self.c1, self.c2):
+            for i in range(10):
+                context.add((self.michel, self.likes, URIRef(u'food%d' % i)))
+            context.add((self.michel, self.name, Literal(u'Michel')))
+            context.add((self.michel, self.name, Literal(u'Michel', 'fr')))
+            context.add((self.michel, RDF.type, self.person))
+
+    def testRemoveN(self):
+        quads = [(self.michel, self.likes, URIRef(u'food%d' % i), self.c1)
+                 for i in range(5)]
+        quads.append((self.michel, self.name, Literal(u'Michel', 'fr'),
+                      self.c1))
+        quads.append((self.michel, RDF.type, self.person, self.c1))
+        self.assertEqual(self.graph.store.removeN(quads), 7)
+        self.assertEqual(len(list(self.c1.triples((None, None, None)))), 6)
+        self.assertEqual(len(list(self.c2.triples((None, None, None)))), 13)
+
+    def testRemoveNFromAllContexts(self):
+        quads = [(self.michel, self.likes, URIRef(u'food%d' % i), None)
+                 for i in range(10)]
+        # A plain literal matches the literal in every language
+        quads.append((self.michel, self.name, Literal(u'Michel'), None))
+        self.assertEqual(self.graph.store.removeN(quads), 24)
+        self.assertEqual(
+            list(self.graph.triples((None, None, None))),
+            [(self.michel, RDF.type, self.person)])
+
+    def testWildcardRemoveCounts(self):
+        counts = self.graph.store.remove((self.michel, None, None), self.c1)
+        self.assertEqual(counts, {
+            ASSERTED_NON_TYPE_PARTITION: 10,
+            ASSERTED_LITERAL_PARTITION: 2,
+            ASSERTED_TYPE_PARTITION: 1,
+            QUOTED_PARTITION: 0})
+        counts = self.graph.store.remove((None, None, None), None)
+        self.assertEqual(sum(counts.values()), 13)
+        self.assertEqual(len(list(self.graph.triples((None, None, None)))),
+                         0)
+
+
+class PostgreSQLContextCopyTests(PostgreSQLStoreTestCase):
+    michel = URIRef(u'michel')
+    likes = URIRef(u'likes')
+    name = URIRef(u'name')
+    person = URIRef(u'Person')
+
+    def populate(self):
+        self.c1 = Graph(self.graph.store, URIRef(u'context-1'))
+        self.c2 = Graph(self.graph.store, BNode())
+        self.c1.add((self.michel, self.likes, URIRef(u'pizza')))
+        self.c1.add((self.michel, self.name, Literal(u'Michel')))
+        self.c1.add((self.michel, RDF.type, self.person))
+
+    def statements(self, context):
+        return set(context.triples((None, None, None)))
+
+    def testRemoveContext(self):
+        self.graph.remove_context(self.c1)
+        self.assertEqual(self.statements(self.c1), set())
+
+    def testCopyContext(self):
+        counts = self.graph.store.copy_context(self.c1, self.c2)
+        self.assertEqual(sum(counts.values()), 3)
+        self.assertEqual(self.statements(self.c2), self.statements(self.c1))
+        # The copied term combinations name a BNode context
+        for triple, contexts in self.graph.store.triples(
+                (None, None, None), self.c2):
+            for context in contexts:
+                self.assertEqual(context.identifier, self.c2.identifier)
+                assert isinstance(context.identifier, BNode)
+
+    def testMoveContext(self):
+        expected = self.statements(self.c1)
+        counts = self.graph.store.move_context(self.c1, self.c2)
+        self.assertEqual(sum(counts.values()), 3)
+        self.assertEqual(self.statements(self.c1), set())
+        self.assertEqual(self.statements(self.c2), expected)
+
+
+class PostgreSQLHashPartitionTests(PostgreSQLStoreTestCase):
+    path = configString + " partition=hash:4"
+    michel = URIRef(u'michel')
+    likes = URIRef(u'likes')
+    name = URIRef(u'name')
+    person = URIRef(u'Person')
+
+    def populate(self):
+        self.contexts = [Graph(self.graph.store, URIRef(u'context-%d' % i))
+                         for i in range(5)]
+        for context in self.contexts:
+            context.add((self.michel, self.likes, URIRef(u'pizza')))
+            context.add((self.michel, self.name, Literal(u'Michel')))
+            context.add((self.michel, RDF.type, self.person))
+
+    def partitions(self, tableName):
+        store = self.graph.store
+        c = store._db.cursor()
+        c.execute("select count(*) from pg_inherits where inhparent = "
+                  "'%s_%s'::regclass" % (store._internedId, tableName))
+        count = c.fetchone()[0]
+        c.close()
+        return count
+
+    def testPartitionedStore(self):
+        self.assertEqual(self.partitions('asserted_statements'), 4)
+        self.assertEqual(self.partitions('literal_statements'), 4)
+        self.assertEqual(len(list(self.contexts[2].triples(
+            (None, None, None)))), 3)
+        self.graph.remove_context(self.contexts[2])
+        self.assertEqual(len(list(self.contexts[2].triples(
+            (None, None, None)))), 0)
+        self.assertEqual(len(list(self.graph.contexts())), 4)
+
+
+class PostgreSQLListPartitionTests(PostgreSQLHashPartitionTests):
+    path = configString + " partition=list"
+
+    def testPartitionedStore(self):
+        store = self.graph.store
+        self.assertEqual(self.partitions('asserted_statements'), 1)
+        store.create_context_partition(self.contexts[2])
+        self.graph.commit()
+        self.assertEqual(self.partitions('asserted_statements'), 2)
+        self.assertEqual(self.partitions('type_statements'), 2)
+        self.assertEqual(len(list(self.contexts[2].triples(
+            (None, None, None)))), 3)
+        counts = store.remove((None, None, None), self.contexts[2])
+        self.assertEqual(sum(counts.values()), 3)
+        self.assertEqual(len(list(self.contexts[2].triples(
+            (None, None, None)))), 0)
+        self.assertEqual(len(list(self.contexts[3].triples(
+            (None, None, None)))), 3)
+
+
+class PostgreSQLHotPredicateContextTestCase(PostgreSQLContextTestCase):
+    path = configString + " hot_predicates=likes,hates"
+
+
+class PostgreSQLHotPredicateTests(PostgreSQLStoreTestCase):
+    path = configString + " hot_predicates=name"
+    michel = URIRef(u'michel')
+    likes = URIRef(u'likes')
+    name = URIRef(u'name')
+    c1 = URIRef(u'context-1')
+
+    def populate(self):
+        self.context = Graph(self.graph.store, self.c1)
+        self.context.add((self.michel, self.name, Literal(u'Michel')))
+        self.context.add((self.michel, self.name, Literal(u'Michel', 'fr')))
+        self.context.add((self.michel, self.name, URIRef(u'Michel')))
+        self.context.add((self.michel, self.likes, URIRef(u'pizza')))
+
+    def rows(self, tableName):
+        store = self.graph.store
+        c = store._db.cursor()
+        c.execute("select count(*) from %s" % tableName)
+        count = c.fetchone()[0]
+        c.close()
+        return count
+
+    def testHotTable(self):
+        store = self.graph.store
+        (predicate, tableName), = store._hotPredicateTables()
+        self.assertEqual(predicate, self.name)
+        self.assertEqual(self.rows(tableName), 3)
+        self.assertEqual(
+            self.rows("%s_literal_statements" % store._internedId), 0)
+        self.assertEqual(len(store), 4)
+
+    def testTriples(self):
+        triples = self.graph.triples
+        self.assertEqual(len(list(triples((None, self.name, None)))), 3)
+        self.assertEqual(len(list(triples(
+            (None, self.name, Literal(u'Michel', 'fr'))))), 1)
+        self.assertEqual(len(list(triples(
+            (None, self.name, URIRef(u'Michel'))))), 1)
+        self.assertEqual(len(list(triples((self.michel, None, None)))), 4)
+        self.assertEqual(len(list(self.graph.store.contexts(
+            (None, self.name, None)))), 1)
+
+    def testRemove(self):
+        counts = self.graph.store.remove(
+            (None, self.name, URIRef(u'Michel')), self.context)
+        self.assertEqual(counts[self.name], 1)
+        self.graph.store.removeN(
+            [(self.michel, self.name, Literal(u'Michel'), self.context)])
+        self.assertEqual(len(list(self.graph.triples(
+            (None, self.name, None)))), 0)
+        self.assertEqual(len(self.graph.store), 1)
+
+    def testReopenedWithoutOption(self):
+        self.graph.close()
+        self.graph = ConjunctiveGraph(store=self.store_name)
+        self.graph.open(configString, create=False)
+        store = self.graph.store
+        self.assertEqual(list(store.hot_predicates), [self.name])
+        self.assertEqual(len(list(self.graph.triples(
+            (None, self.name, None)))), 3)
+        self.assertEqual(len(store), 4)
+        self.graph.remove((None, self.name, None))
+        self.assertEqual(len(store), 1)
+
+    def testReopenedWithNewPredicates(self):
+        self.context.add((self.michel, RDFS.label, Literal(u'Michel')))
+        self.graph.commit()
+        self.graph.close()
+        self.graph = ConjunctiveGraph(store=self.store_name)
+        self.graph.open(self.path + ",likes,%s" % RDFS.label, create=False)
+        store = self.graph.store
+        self.assertEqual(len(store._hotPredicateTables()), 3)
+        for predicate, tableName in store._hotPredicateTables():
+            self.assertEqual(self.rows(tableName),
+                             predicate == self.name and 3 or 1)
+        for tableName in ('asserted', 'literal'):
+            self.assertEqual(self.rows("%s_%s_statements" % (
+                store._internedId, tableName)), 0)
+        self.assertEqual(list(self.graph.triples(
+            (None, RDFS.label, None))),
+            [(self.michel, RDFS.label, Literal(u'Michel'))])
+        self.assertEqual(len(list(self.graph.triples(
+            (None, self.likes, None)))), 1)
+        self.assertEqual(len(store), 5)
+
+
+class PostgreSQLStatisticsTests(PostgreSQLStoreTestCase):
+    path = configString + " partition=list"
+    michel = URIRef(u'michel')
+    likes = URIRef(u'likes')
+    name = URIRef(u'name')
+    person = URIRef(u'Person')
+
+    def populate(self):
+        self.contexts = [Graph(self.graph.store, URIRef(u'context-%d' % i))
+                         for i in range(3)]
+        for context in self.contexts:
+            context.add((self.michel, self.likes, URIRef(u'pizza')))
+            context.add((self.michel, self.name, Literal(u'Michel')))
+            context.add((self.michel, RDF.type, self.person))
+
+    def testLen(self):
+        store = self.graph.store
+        self.assertEqual(len(store), 9)
+        self.assertEqual(len(self.contexts[0]), 3)
+        self.assertEqual(store._countStatements(), 9)
+        store.addN([(self.michel, self.likes, URIRef(u'cheese'),
+                     self.contexts[0])])
+        store.remove((None, RDF.type, None), self.contexts[1])
+        self.assertEqual(len(self.contexts[0]), 4)
+        self.assertEqual(len(self.contexts[1]), 2)
+        self.assertEqual(len(store), 9)
+
+    def testContextOperations(self):
+        store = self.graph.store
+        store.move_context(self.contexts[1], self.contexts[0])
+        self.assertEqual(len(self.contexts[0]), 6)
+        self.assertEqual(len(self.contexts[1]), 0)
+        store.create_context_partition(self.contexts[2])
+        store.remove((None, None, None), self.contexts[2])
+        self.assertEqual(len(self.contexts[2]), 0)
+        self.assertEqual(len(store), 6)
+
+    def testEstimate(self):
+        store = self.graph.store
+        c = store._db.cursor()
+        c.execute("ANALYZE")
+        c.close()
+        store.estimate_len = True
+        self.assertEqual(len(store), 9)
+
+
+class PostgreSQLEstimateTests(PostgreSQLStoreTestCase):
+    title = URIRef(u'title')
+    journal = URIRef(u'Journal')
+    article = URIRef(u'Article')
+
+    def populate(self):
+        context = Graph(self.graph.store, URIRef(u'context-1'))
+        for i in range(200):
+            article = URIRef(u'article-%d' % i)
+            context.add((article, RDF.type, self.article))
+            context.add((article, self.title, Literal(u'Article %d' % i)))
+        context.add((URIRef(u'journal-1'), RDF.type, self.journal))
+        context.add((URIRef(u'journal-1'), self.title,
+                     Literal(u'Journal 1 (1940)')))
+
+    def setUp(self):
+        super(PostgreSQLEstimateTests, self).setUp()
+        c = self.graph.store._db.cursor()
+        c.execute("ANALYZE")
+        c.close()
+
+    def tearDown(self):
+        from rdflib_postgresql import sparql
+        sparql.unregister()
+        super(PostgreSQLEstimateTests, self).tearDown()
+
+    def testEstimate(self):
+        store = self.graph.store
+        # The planner's estimate, like those of the other patterns
+        estimate = store.estimate((None, None, None))
+        self.assertTrue(abs(estimate - len(store)) <= 2, estimate)
+        self.assertTrue(
+            store.estimate((None, RDF.type, self.article)) < estimate)
+        self.assertTrue(
+            store.estimate((None, RDF.type, self.journal)) <
+            store.estimate((None, RDF.type, self.article)))
+
+    def testReorderTriples(self):
+        from rdflib.term import Variable
+        from rdflib_postgresql.sparql import reorderTriples
+        journal, title = Variable('journal'), Variable('title')
+        triples = [(journal, RDF.type, self.article),
+                   (journal, self.title, title),
+                   (journal, self.title, Literal(u'Journal 1 (1940)'))]
+        self.assertEqual(reorderTriples(self.graph.store, triples),
+                         [triples[2], triples[0], triples[1]])
+
+    def testQuery(self):
+        from rdflib_postgresql import sparql
+        query = """SELECT ?journal WHERE {
+            ?journal a <Journal> .
+            ?journal <title> "Journal 1 (1940)" }"""
+        expected = list(self.graph.query(query))
+        sparql.register()
+        self.assertEqual(list(self.graph.query(query)), expected)
+        self.assertEqual(len(expected), 1)
+
+    def testEstimatesCachedPerQuery(self):
+        from rdflib_postgresql import sparql
+        store = self.graph.store
+        patterns = []
+        estimate = store.estimate
+
+        def countingEstimate(triple, context=None):
+            patterns.append(triple)
+            return estimate(triple, context)
+        store.estimate = countingEstimate
+        query = """SELECT ?article ?title WHERE {
+            ?article a <Article>
+            OPTIONAL { ?article <title> ?title . ?article a <Article> } }"""
+        expected = len(list(self.graph.query(query)))
+        sparql.register()
+        self.assertEqual(len(list(self.graph.query(query))), expected)
+        # The optional BGP is evaluated once per article, and estimated
+        # once per pattern
+        self.assertEqual(len(patterns), 2)
+        self.assertEqual(len(list(self.graph.query(query))), expected)
+        self.assertEqual(len(patterns), 4)
+
+
+class PostgreSQLTypedLiteralTests(PostgreSQLStoreTestCase):
+    path = configString + " hot_predicates=published"
+    year = URIRef(u'year')
+    published = URIRef(u'published')
+
+    def populate(self):
+        for i, year in enumerate((1930, 1945, 1950, 1999, 2010)):
+            article = URIRef(u'article-%d' % i)
+            self.graph.add((article, self.year, Literal(year)))
+            self.graph.add((article, self.published, Literal(
+                datetime.date(year, 6, 1))))
+        self.graph.add((URIRef(u'article-5'), self.year, Literal(u'1960')))
+
+    def testNumericRange(self):
+        store = self.graph.store
+        years = sorted([o.toPython() for (s, p, o), cg in
+                        store.triples_in_range(self.year, 1945, 1999)])
+        self.assertEqual(years, [1945, 1950, 1999])
+        years = [o.toPython() for (s, p, o), cg in
+                 store.triples_in_range(self.year, Literal(2000), None)]
+        self.assertEqual(years, [2010])
+
+    def testDateRange(self):
+        store = self.graph.store
+        dates = list(store.triples_in_range(
+            None, datetime.date(1940, 1, 1), datetime.datetime(1951, 1, 1)))
+        self.assertEqual(len(dates), 2)
+        self.assertRaises(ValueError, list, store.triples_in_range(
+            self.year, datetime.date(1940, 1, 1), 1950))
+
+    def testStoreFromBeforeTypedValues(self):
+        self.createBaselineStore([
+            (URIRef(u'article-9'), self.year, Literal(1975)),
+            (URIRef(u'article-9'), RDFS.label, Literal(u'1975'))])
+        reopened = ConjunctiveGraph(store=self.store_name)
+        reopened.open(configString, create=False)
+        reopened.add((URIRef(u'article-10'), self.year, Literal(1977)))
+        reopened.add((URIRef(u'article-10'), RDFS.label, Literal(u'new')))
+        years = sorted([o.toPython() for (s, p, o), cg in
+                        reopened.store.triples_in_range(None, 1970, 1980)])
+        self.assertEqual(years, [1975, 1977])
+        reopened.close()
+
+
+class PostgreSQLTextSearchTests(PostgreSQLStoreTestCase):
+    path = configString + " text_search=en,fr hot_predicates=title"
+    label = URIRef(u'label')
+    title = URIRef(u'title')
+
+    def populate(self):
+        graph = self.graph
+        graph.add((URIRef(u'cat'), self.label,
+                   Literal(u'The cat runs after the cats', lang='en')))
+        graph.add((URIRef(u'dog'), self.label,
+                   Literal(u'The dog is running', lang='en')))
+        graph.add((URIRef(u'chat'), self.label,
+                   Literal(u'Les chats courent', lang='fr')))
+        graph.add((URIRef(u'book'), self.title, Literal(u'Running cats')))
+        graph.commit()
+
+    def testTextSearch(self):
+        store = self.graph.store
+        results = store.text_search(u'running cats', lang='en')
+        self.assertEqual([s for s, p, o, c in results], [URIRef(u'cat')])
+        results = store.text_search(u'run')
+        self.assertEqual(sorted([s for s, p, o, c in results]),
+                         [URIRef(u'cat'), URIRef(u'dog')])
+        results = store.text_search(u'chat', lang='fr')
+        self.assertEqual([s for s, p, o, c in results], [URIRef(u'chat')])
+        results = store.text_search(u'cats', predicate=self.title)
+        self.assertEqual([(s, p) for s, p, o, c in results],
+                         [(URIRef(u'book'), self.title)])
+        self.assertEqual(
+            len(store.text_search(u'cats', predicate=self.label)), 1)
+
+
+class PostgreSQLRegexTests(PostgreSQLStoreTestCase):
+    name = URIRef(u'name')
+    knows = URIRef(u'knows')
+
+    def populate(self):
+        for i in range(3):
+            person = URIRef(u'http://localhost/persons/p%d' % i)
+            self.graph.add((person, self.name, Literal(u'Person %d' % i)))
+            self.graph.add((person, self.knows,
+                            URIRef(u'http://localhost/persons/p0')))
+        self.graph.add((URIRef(u'http://localhost/misc/persons/x'),
+                        self.name, Literal(u'Not a person')))
+
+    def testRegexTriples(self):
+        triples = self.graph.store.triples
+        persons = REGEXTerm(u'http://localhost/persons/')
+        self.assertEqual(len(list(triples((persons, None, None)))), 6)
+        self.assertEqual(len(list(triples(
+            (None, self.name, REGEXTerm(u'Person [12]$'))))), 2)
+        self.assertEqual(len(list(triples(
+            (None, REGEXTerm(u'kno'), persons)))), 3)
+
+    def testRegexRemove(self):
+        store = self.graph.store
+        store.remove((REGEXTerm(u'.*/p[12]$'), None, None), None)
+        self.assertEqual(len(store), 3)
+
+
+class PostgreSQLTrigramRegexTests(PostgreSQLRegexTests):
+    path = configString + " trigram=true"
+
+    def setUp(self):
+        import psycopg2
+        from rdflib_postgresql.PostgreSQL import GetConfigurationString
+        db = psycopg2.connect(GetConfigurationString(self.path))
+        c = db.cursor()
+        c.execute("select 1 from pg_available_extensions "
+                  "where name = 'pg_trgm'")
+        available = c.fetchone()
+        db.close()
+        if not available:
+            raise SkipTest("pg_trgm is not available")
+        super(PostgreSQLTrigramRegexTests, self).setUp()
+
+
+class PostgreSQLPrefixTests(PostgreSQLStoreTestCase):
+    name = URIRef(u'name')
+    knows = URIRef(u'knows')
+    persons = u'http://localhost/persons/'
+
+    def populate(self):
+        self.people = Graph(self.graph.store,
+                            URIRef(u'http://localhost/persons/graph'))
+        self.other = Graph(self.graph.store,
+                           URIRef(u'http://localhost/misc/graph'))
+        for i in range(3):
+            person = URIRef(u'http://localhost/persons/p%d' % i)
+            self.people.add((person, self.name, Literal(u'Person %d' % i)))
+            self.people.add((person, self.knows,
+                             URIRef(u'http://localhost/persons/p0')))
+            self.people.add((person, RDF.type, URIRef(u'Person')))
+        self.other.add((URIRef(u'http://localhost/misc/x'), self.knows,
+                        URIRef(u'http://localhost/persons/p1')))
+        self.other.add((URIRef(u'http://localhost/personsx'), self.name,
+                        Literal(u'http://localhost/persons/')))
+
+    def testSubjectPrefix(self):
+        triples = self.graph.store.triples_with_prefix
+        self.assertEqual(len(list(triples('subject', self.persons))), 9)
+        self.assertEqual(len(list(triples(
+            'subject', self.persons, (None, self.name, None)))), 3)
+        self.assertEqual(len(list(triples(
+            'subject', self.persons, context=self.other))), 0)
+        self.assertEqual(len(list(triples(
+            'subject', u'http://localhost/'))), 11)
+
+    def testObjectPrefix(self):
+        triples = self.graph.store.triples_with_prefix
+        # Literals never match an object prefix
+        self.assertEqual(len(list(triples('object', self.persons))), 4)
+        self.assertEqual(len(list(triples(
+            'object', self.persons, context=self.people))), 3)
+
+    def testContextPrefix(self):
+        triples = self.graph.store.triples_with_prefix
+        found = [(triple, list(contexts)) for triple, contexts
+                 in triples('context', self.persons)]
+        self.assertEqual(len(found), 9)
+        self.assertEqual(
+            set([c.identifier for _, contexts in found for c in contexts]),
+            set([self.people.identifier]))
+        self.assertRaises(ValueError, list, triples('predicate', u'kn'))
+
+
+class PostgreSQLTransitiveTests(PostgreSQLStoreTestCase):
+    broader = URIRef(u'broader')
+
+    def populate(self):
+        self.context = Graph(self.graph.store, URIRef(u'context-1'))
+        self.a, self.b, self.c, self.d = [
+            URIRef(u'concept-%s' % x) for x in 'abcd']
+        # a -> b -> c -> a is a cycle, c -> d -> "top" leaves it
+        for s, o in [(self.a, self.b), (self.b, self.c), (self.c, self.a),
+                     (self.c, self.d), (self.d, Literal(u'top'))]:
+            self.context.add((s, self.broader, o))
+        Graph(self.graph.store, URIRef(u'context-2')).add(
+            (self.d, self.broader, URIRef(u'concept-e')))
+
+    def tearDown(self):
+        from rdflib_postgresql import sparql
+        sparql.unregister()
+        super(PostgreSQLTransitiveTests, self).tearDown()
+
+    def testTransitiveObjects(self):
+        store = self.graph.store
+        objects = list(store.transitive_objects(self.a, self.broader))
+        self.assertEqual(objects[0], self.a)
+        self.assertEqual(set(objects), set([
+            self.a, self.b, self.c, self.d, URIRef(u'concept-e'),
+            Literal(u'top')]))
+        self.assertEqual(len(objects), 6)
+        self.assertEqual(set(store.transitive_objects(
+            self.a, self.broader, max_depth=2)), set([self.a, self.b,
+                                                      self.c]))
+        self.assertEqual(len(list(store.transitive_objects(
+            self.a, self.broader, context=self.context))), 5)
+
+    def testTransitiveSubjects(self):
+        store = self.graph.store
+        self.assertEqual(set(store.transitive_subjects(
+            self.broader, Literal(u'top'))), set([
+                Literal(u'top'), self.a, self.b, self.c, self.d]))
+        self.assertEqual(set(store.transitive_subjects(
+            self.broader, self.d, max_depth=1)), set([self.d, self.c]))
+
+    def testTransitiveClosure(self):
+        store = self.graph.store
+        # Nodes on a cycle reach themselves, the others do not
+        self.assertTrue(self.a in store.transitive_closure(
+            self.a, self.broader))
+        self.assertFalse(self.d in store.transitive_closure(
+            self.d, self.broader))
+        self.assertEqual(store.transitive_closure(
+            Literal(u'top'), self.broader), [])
+
+    def testTypeClosure(self):
+        store = self.graph.store
+        self.context.add((self.a, RDF.type, self.b))
+        self.context.add((self.b, RDF.type, self.c))
+        self.assertEqual(set(store.transitive_closure(self.a, RDF.type)),
+                         set([self.b, self.c]))
+
+    def testPropertyPaths(self):
+        from rdflib_postgresql import sparql
+        queries = [
+            "SELECT ?x WHERE { <concept-a> <broader>+ ?x }",
+            "SELECT ?x WHERE { ?x <broader>* <concept-d> }",
+            "SELECT ?x WHERE { <concept-d> <broader>+ ?x . "
+            "?x <broader> ?y }",
+            "ASK { <concept-a> <broader>* <concept-e> }",
+        ]
+        expected = [set(self.graph.query(query)) for query in queries]
+        sparql.register()
+        self.assertEqual([set(self.graph.query(query))
+                          for query in queries], expected)
+        self.assertEqual(len(expected[0]), 6)
+
+
+class PostgreSQLRDFSClosureTests(PostgreSQLStoreTestCase):
+    path = configString + " rdfs_entailment=true"
+    document = URIRef(u'Document')
+    article = URIRef(u'Article')
+    letter = URIRef(u'Letter')
+
+    def populate(self):
+        self.context = Graph(self.graph.store, URIRef(u'context-1'))
+        self.context.add((self.article, RDFS.subClassOf, self.document))
+        self.context.add((self.letter, RDFS.subClassOf, self.article))
+        self.context.add((self.document, RDFS.subClassOf, URIRef(u'Thing')))
+        for member, klass in [(u'd1', self.document), (u'a1', self.article),
+                              (u'l1', self.letter)]:
+            self.context.add((URIRef(member), RDF.type, klass))
+
+    def instances(self, klass):
+        triples = list(self.graph.store.triples((None, RDF.type, klass)))
+        self.assertEqual(set([o for (s, p, o), contexts in triples]),
+                         triples and set([klass]) or set())
+        return set([s for (s, p, o), contexts in triples])
+
+    def testSubterms(self):
+        store = self.graph.store
+        self.assertEqual(set(store.rdfs_subterms(self.document)),
+                         set([self.article, self.letter]))
+        self.assertEqual(store.rdfs_subterms(self.letter), [])
+        self.assertRaises(ValueError, store.rdfs_subterms, self.letter,
+                          RDF.type)
+
+    def testSubproperties(self):
+        store = self.graph.store
+        self.context.add((URIRef(u'p1'), RDFS.subPropertyOf, URIRef(u'p2')))
+        self.context.add((URIRef(u'p2'), RDFS.subPropertyOf, URIRef(u'p3')))
+        self.assertEqual(
+            set(store.rdfs_subterms(URIRef(u'p3'), RDFS.subPropertyOf)),
+            set([URIRef(u'p1'), URIRef(u'p2')]))
+
+    def testEntailedTypes(self):
+        self.assertEqual(self.instances(self.document),
+                         set([URIRef(u'd1'), URIRef(u'a1'), URIRef(u'l1')]))
+        self.assertEqual(self.instances(URIRef(u'Thing')),
+                         set([URIRef(u'd1'), URIRef(u'a1'), URIRef(u'l1')]))
+        self.assertEqual(self.instances(self.letter), set([URIRef(u'l1')]))
+        # The stored statements themselves are not affected
+        self.assertEqual(len(self.graph.store), 6)
+
+    def testIncrementalClosure(self):
+        memo = URIRef(u'Memo')
+        self.context.add((memo, RDFS.subClassOf, self.letter))
+        self.context.add((URIRef(u'm1'), RDF.type, memo))
+        self.assertTrue(URIRef(u'm1') in self.instances(self.document))
+        self.context.remove((self.article, RDFS.subClassOf, self.document))
+        self.assertEqual(self.instances(self.document), set([URIRef(u'd1')]))
+        self.assertEqual(set(self.graph.store.rdfs_subterms(self.article)),
+                         set([self.letter, memo]))
+
+    def closure(self):
+        store = self.graph.store
+        c = store._db.cursor()
+        c.execute("SELECT predicate, sub, subType, super, superType "
+                  "FROM %s_rdfs_closure" % store._internedId)
+        rows = set(c.fetchall())
+        c.close()
+        return rows
+
+    def testRemoveFromDiamond(self):
+        a, b, c, d = [URIRef(u'K%s' % name) for name in 'abcd']
+        for sub, sup in [(a, b), (a, c), (b, d), (c, d), (d, self.letter)]:
+            self.context.add((sub, RDFS.subClassOf, sup))
+        self.context.remove((a, RDFS.subClassOf, b))
+        self.assertEqual(set(self.graph.store.rdfs_subterms(d)),
+                         set([a, b, c]))
+        self.assertEqual(set(self.graph.store.rdfs_subterms(b)), set())
+        self.context.remove((d, RDFS.subClassOf, self.letter))
+        self.assertEqual(set(self.graph.store.rdfs_subterms(self.document)),
+                         set([self.article, self.letter]))
+        # The same closure as computed from scratch
+        closure = self.closure()
+        store = self.graph.store
+        c = store._db.cursor()
+        store._refreshRDFSClosure(c)
+        c.close()
+        self.assertEqual(closure, self.closure())
+
+    def testWildcardsMatchStoredStatements(self):
+        store = self.graph.store
+        self.assertEqual(len(list(store.triples((None, None, None)))),
+                         len(store))
+        self.assertEqual(
+            len(list(store.triples((URIRef(u'l1'), None, None)))), 1)
+        self.assertEqual(
+            len(list(store.contexts((URIRef(u'l1'), RDF.type,
+                                     self.document)))), 1)
+
+
+class PostgreSQLContextSetTests(PostgreSQLStoreTestCase):
+    path = configString + " hot_predicates=name"
+    likes = URIRef(u'likes')
+    name = URIRef(u'name')
+
+    def populate(self):
+        store = self.graph.store
+        self.first = Graph(store, URIRef(u'context-1'))
+        self.second = Graph(store, URIRef(u'context-2'))
+        self.target = Graph(store, URIRef(u'context-3'))
+        bob, tom = URIRef(u'bob'), URIRef(u'tom')
+        self.shared = [(bob, self.likes, tom),
+                       (bob, self.name, Literal(u'Bob')),
+                       (bob, RDF.type, URIRef(u'Person'))]
+        self.onlyFirst = [(tom, self.likes, Literal(u'cheese', lang='en')),
+                          (tom, self.name, Literal(u'Tom'))]
+        self.onlySecond = [(tom, RDF.type, URIRef(u'Person'))]
+        for triple in self.shared + self.onlyFirst:
+            self.first.add(triple)
+        for triple in self.onlySecond + self.shared:
+            self.second.add(triple)
+
+    def testSetOperations(self):
+        store = self.graph.store
+        self.assertEqual(
+            set(store.union([self.first, self.second])),
+            set(self.shared + self.onlyFirst + self.onlySecond))
+        self.assertEqual(
+            set(store.intersection([self.first, self.second])),
+            set(self.shared))
+        self.assertEqual(set(store.difference(self.first, self.second)),
+                         set(self.onlyFirst))
+        self.assertEqual(set(store.difference(self.second, self.first)),
+                         set(self.onlySecond))
+
+    def testTarget(self):
+        store = self.graph.store
+        counts = store.difference(self.first, self.second, self.target)
+        self.assertEqual(sum(counts.values()), 2)
+        self.assertEqual(set(self.target), set(self.onlyFirst))
+        # Statements the target already holds are not added again
+        counts = store.union([self.first, self.second], self.target)
+        self.assertEqual(sum(counts.values()), 4)
+        self.assertEqual(len(self.target), 6)
+        counts = store.union([self.second], self.first)
+        self.assertEqual(sum(counts.values()), 1)
+        self.assertEqual(len(self.first), 6)
+
+    def testContextHash(self):
+        store = self.graph.store
+        self.assertNotEqual(store.context_hash(self.first),
+                            store.context_hash(self.second))
+        for triple in reversed(self.onlyFirst + self.shared):
+            self.target.add(triple)
+        self.assertEqual(store.context_hash(self.first),
+                         store.context_hash(self.target))
+        self.assertNotEqual(store.context_hash(self.first),
+                            store.context_hash(Graph(store, URIRef(u'x'))))
+
+    def testContextHashBNodes(self):
+        store = self.graph.store
+        for context in (self.first, self.second):
+            person = BNode()
+            context.add((person, self.name, Literal(u'Anonymous')))
+            context.add((URIRef(u'bob'), self.likes, person))
+        for context in (self.first, self.second):
+            context.remove((URIRef(u'tom'), None, None))
+        self.assertNotEqual(store.context_hash(self.first),
+                            store.context_hash(self.second))
+        self.assertEqual(store.context_hash(self.first, ignore_bnodes=True),
+                         store.context_hash(self.second, ignore_bnodes=True))
+
+
+class PostgreSQLUpdateTests(PostgreSQLStoreTestCase):
+    path = configString + " hot_predicates=label"
+    old = URIRef(u'old')
+    new = URIRef(u'new')
+
+    def populate(self):
+        self.context = Graph(self.graph.store, URIRef(u'context-1'))
+        self.other = Graph(self.graph.store, URIRef(u'context-2'))
+        for i in range(4):
+            subject = URIRef(u'item-%d' % i)
+            self.context.add((subject, self.old, Literal(i)))
+            self.context.add((subject, self.old, URIRef(u'thing-%d' % i)))
+            self.context.add((subject, URIRef(u'label'),
+                              Literal(u'Item %d' % i, lang='en')))
+        self.context.add((URIRef(u'thing-1'), RDF.type, URIRef(u'Thing')))
+        self.other.add((URIRef(u'item-0'), self.old, Literal(0)))
+
+    def testModify(self):
+        expected = set([(s, self.new, o) for s, p, o
+                        in self.context.triples((None, self.old, None))])
+        counts = self.context.update(
+            "DELETE { ?s <old> ?o } INSERT { ?s <new> ?o } "
+            "WHERE { ?s <old> ?o }")
+        self.assertEqual(counts, [(8, 8)])
+        self.assertEqual(set(self.context.triples((None, None, None))) -
+                         set(self.context.triples(
+                             (None, URIRef(u'label'), None))),
+                         expected | set([(URIRef(u'thing-1'), RDF.type,
+                                          URIRef(u'Thing'))]))
+        # Other contexts are left alone
+        self.assertEqual(len(self.other), 1)
+        # The typed value columns are filled in
+        self.assertEqual(len(list(self.graph.store.triples_in_range(
+            self.new, 1, 2))), 2)
+
+    def testJoinAndGraphs(self):
+        counts = self.graph.update(
+            "INSERT { GRAPH <context-2> { ?s a <HasThing> . "
+            "?s <label> ?label } } WHERE { ?s <old> ?thing . "
+            "?thing a <Thing> . ?s <label> ?label }")
+        self.assertEqual(counts, [(0, 2)])
+        self.assertEqual(set(self.other.subjects(RDF.type, URIRef(
+            u'HasThing'))), set([URIRef(u'item-1')]))
+        self.assertEqual(list(self.other.objects(
+            URIRef(u'item-1'), URIRef(u'label'))),
+            [Literal(u'Item 1', lang='en')])
+        # Inserting statements again adds nothing
+        self.assertEqual(self.graph.update(
+            "INSERT { GRAPH <context-2> { ?s a <HasThing> } } "
+            "WHERE { ?s <old> ?thing . ?thing a <Thing> }"), [(0, 0)])
+
+    def testDeleteWhere(self):
+        counts = self.graph.update(
+            "DELETE WHERE { <item-0> <old> ?o }")
+        self.assertEqual(counts, [(3, 0)])
+        self.assertEqual(len(self.other), 0)
+        self.assertEqual(len(self.context), 11)
+
+    def testFallback(self):
+        store = self.graph.store
+        query = "DELETE { ?s <old> ?o } WHERE { ?s <old> ?o " \
+            "FILTER (?o > 1) }"
+        self.assertRaises(NotImplementedError, store.update,
+                          query, {}, {}, self.context.identifier)
+        # rdflib evaluates the updates the store doesn't compile
+        self.context.update(query)
+        self.assertEqual(len(list(self.context.triples(
+            (None, self.old, None)))), 6)
+        self.assertRaises(NotImplementedError, store.update,
+                          "INSERT { ?s <new> ?o } WHERE { ?s <old> ?o }",
+                          {}, {}, '__UNION__')
+
+
+class PostgreSQLPageTests(PostgreSQLStoreTestCase):
+    path = configString + " hot_predicates=label"
+
+    def populate(self):
+        self.context = Graph(self.graph.store, URIRef(u'context-1'))
+        self.other = Graph(self.graph.store, URIRef(u'context-2'))
+        label = URIRef(u'label')
+        for i in range(5):
+            subject = URIRef(u'item-%d' % i)
+            self.context.add((subject, RDF.type, URIRef(u'Thing')))
+            self.context.add((subject, label, Literal(u'chat', lang='en')))
+            self.context.add((subject, label, Literal(u'chat', lang='fr')))
+            self.context.add((subject, URIRef(u'size'), Literal(i)))
+            self.other.add((subject, URIRef(u'size'), Literal(i)))
+
+    def pages(self, triple, context=None, limit=3):
+        store = self.graph.store
+        page, token = store.triples_page(triple, context, limit=limit)
+        result = list(page)
+        while token is not None:
+            page, token = store.triples_page(
+                triple, context, after=token, limit=limit)
+            result.extend(page)
+        return [(statement, set([graph.identifier for graph in contexts]))
+                for statement, contexts in result]
+
+    def expected(self, triple, context=None):
+        return sorted([
+            (statement, set([graph.identifier for graph in contexts]))
+            for statement, contexts
+            in self.graph.store.triples(triple, context)])
+
+    def testAllPages(self):
+        result = self.pages((None, None, None))
+        self.assertEqual(len(result), 20)
+        self.assertEqual(sorted(result), self.expected((None, None, None)))
+        self.assertEqual(
+            dict(result)[(URIRef(u'item-2'), URIRef(u'size'), Literal(2))],
+            set([URIRef(u'context-1'), URIRef(u'context-2')]))
+
+    def testPatternPages(self):
+        for triple in ((None, URIRef(u'label'), None),
+                       (URIRef(u'item-1'), None, None),
+                       (None, RDF.type, URIRef(u'Thing'))):
+            self.assertEqual(sorted(self.pages(triple, limit=2)),
+                             self.expected(triple))
+
+    def testContextPages(self):
+        triple = (None, URIRef(u'size'), None)
+        self.assertEqual(self.pages(triple, self.other, limit=2),
+                         self.expected(triple, self.other))
+
+    def testLastPage(self):
+        page, token = self.graph.store.triples_page(
+            (URIRef(u'item-1'), None, None), limit=10)
+        self.assertEqual(len(page), 4)
+        self.assertEqual(token, None)
+
+    def testLastTripleContexts(self):
+        subject = URIRef(u'item-9')
+        label = URIRef(u'label')
+        self.context.add((subject, label, Literal(u'chat', lang='en')))
+        self.other.add((subject, label, Literal(u'chat', lang='fr')))
+        (statement, contexts), = self.graph.store.triples_page(
+            (subject, label, None), limit=1)[0]
+        self.assertEqual(statement[2], Literal(u'chat', lang='en'))
+        self.assertEqual([graph.identifier for graph in contexts],
+                         [URIRef(u'context-1')])
+
+    def testKeyIndexes(self):
+        store = self.graph.store
+        size = URIRef(u'size')
+        for i in range(2000):
+            subject = URIRef(u'thing-%d' % i)
+            self.context.add((subject, RDF.type, URIRef(u'Thing')))
+            self.context.add((subject, size, Literal(i)))
+            self.context.add((subject, size, URIRef(u'size-%d' % i)))
+        self.graph.commit()
+        c = store._db.cursor()
+        for table in ('asserted', 'type', 'literal', 'quoted'):
+            c.execute("ANALYZE %s_%s_statements" % (
+                store._internedId, table))
+        q, parameters = store._pageQuery(
+            (None, None, None), None, '>',
+            store._pageKey((URIRef(u'thing-1000'), size, Literal(0))), 10)
+        store.executeSQL(c, "EXPLAIN " + q, parameters)
+        plan = '\n'.join([row for (row,) in c.fetchall()])
+        c.close()
+        # The page is read in key order off the indexes, not sorted whole
+        self.assertTrue('Index Scan' in plan, plan)
+        self.assertFalse('Seq Scan' in plan, plan)
+
+    def testInvalidToken(self):
+        self.assertRaises(ValueError, self.graph.store.triples_page,
+                          (None, None, None), after='not a token')
+
+
+class PostgreSQLSnapshotTests(PostgreSQLStoreTestCase):
+
+    def populate(self):
+        self.context = Graph(self.graph.store, URIRef(u'context-1'))
+        for i in range(3):
+            self.context.add((URIRef(u'item-%d' % i), RDF.type,
+                              URIRef(u'Thing')))
+            self.context.add((URIRef(u'item-%d' % i), URIRef(u'size'),
+                              Literal(i)))
+
+    def testSnapshotIgnoresCommittedWrites(self):
+        store = self.graph.store
+        other = Graph(store, URIRef(u'context-2'))
+        with store.snapshot():
+            self.assertEqual(len(store), 6)
+            other.add((URIRef(u'item-3'), URIRef(u'size'), Literal(3)))
+            self.context.remove((URIRef(u'item-0'), None, None))
+            store.commit()
+            self.assertEqual(len(store), 6)
+            self.assertEqual(len(list(store.triples((None, None, None)))),
+                             6)
+            self.assertEqual([graph.identifier
+                              for graph in store.contexts()],
+                             [URIRef(u'context-1')])
+            with store.snapshot():
+                self.assertEqual(store.__len__(self.context), 6)
+        self.assertEqual(len(store), 5)
+        self.assertEqual(sorted([graph.identifier
+                                 for graph in store.contexts()]),
+                         [URIRef(u'context-1'), URIRef(u'context-2')])
+
+    def testSnapshotIsReadOnly(self):
+        store = self.graph.store
+        with store.snapshot():
+            self.assertEqual(len(store), 6)
+            self.assertTrue(store._snapshot.db.readonly)
+        self.assertEqual(getattr(store._snapshot, 'db', None), None)
+
+
+class PostgreSQLReplicaTests(PostgreSQLStoreTestCase):
+    """
+    A second database stands in for a replica: it holds different
+    statements, so that the tests can tell where a read went
+    """
+    replicaPath = re.sub(r'dbname=\S+', 'dbname=rdflibpostgresql_replica',
+                         configString)
+    path = configString + " replicas=/rdflibpostgresql_replica"
+    name = URIRef(u'name')
+
+    def setUp(self):
+        self.replica = ConjunctiveGraph(store=self.store_name)
+        try:
+            self.replica.destroy(self.replicaPath)
+        except Exception:
+            raise SkipTest("The rdflibpostgresql_replica database "
+                           "is not available")
+        self.replica.open(self.replicaPath, create=True)
+        context = Graph(self.replica.store, URIRef(u'context-1'))
+        for i in range(2):
+            context.add((URIRef(u'item-%d' % i), self.name,
+                         Literal(u'replica')))
+        self.replica.bind(u'ex', URIRef(u'http://example.org/replica/'))
+        self.replica.commit()
+        super(PostgreSQLReplicaTests, self).setUp()
+
+    def populate(self):
+        self.context = Graph(self.graph.store, URIRef(u'context-1'))
+        self.context.add((URIRef(u'item-0'), self.name, Literal(u'primary')))
+
+    def tearDown(self):
+        super(PostgreSQLReplicaTests, self).tearDown()
+        self.replica.destroy(self.replicaPath)
+        self.replica.close()
+
+    def testReadsGoToReplica(self):
+        self.assertEqual(len(self.graph), 2)
+        self.assertEqual(set(self.graph.objects(None, self.name)),
+                         set([Literal(u'replica')]))
+        self.assertEqual([graph.identifier for graph in self.graph.contexts()],
+                         [URIRef(u'context-1')])
+        self.assertEqual(self.graph.store.namespace(u'ex'),
+                         URIRef(u'http://example.org/replica/'))
+
+    def testUncommittedReadsGoToPrimary(self):
+        self.context.add((URIRef(u'item-1'), self.name, Literal(u'primary')))
+        self.assertEqual(len(self.graph), 2)
+        self.assertEqual(set(self.graph.objects(None, self.name)),
+                         set([Literal(u'primary')]))
+        self.graph.commit()
+        self.assertEqual(set(self.graph.objects(None, self.name)),
+                         set([Literal(u'replica')]))
+
+    def testReadYourWrites(self):
+        store = self.graph.store
+        store.read_your_writes = True
+        self.assertEqual(len(self.graph), 2)
+        self.context.remove((URIRef(u'item-0'), None, None))
+        self.graph.commit()
+        # The stand-in replica never replays anything
+        self.assertEqual(len(self.graph), 0)
+
+    def testReadsLeaveThePrimary(self):
+        store = self.graph.store
+        store.read_your_writes = True
+        self.context.remove((URIRef(u'item-0'), None, None))
+        self.graph.commit()
+        self.assertEqual(len(self.graph), 0)
+        # Once a replica has replayed the commit, reads go back to it
+        # although the primary is in the transaction of the last read
+        store._replayLSN = None
+        self.assertEqual(len(self.graph), 2)
+
+
+shardedConfigString = configString + \
+    " shards=/rdflibpostgresql_test,/rdflibpostgresql_shard"
+
+
+class ShardedPostgreSQLContextTestCase(context_case.ContextTestCase):
+    store_name = "ShardedPostgreSQL"
+    storetest = True
+    path = shardedConfigString
+    create = True
+
+    def testLenInMultipleContexts(self):
+        raise SkipTest("Known issue with __len__")
+
+
+class ShardedPostgreSQLTests(PostgreSQLStoreTestCase):
+    store_name = "ShardedPostgreSQL"
+    path = shardedConfigString
+    name = URIRef(u'name')
+    # The number of shards a context's statements can be in
+    contextShards = 1
+
+    def populate(self):
+        self.contexts = [Graph(self.graph.store, URIRef(u'graph-%d' % i))
+                         for i in range(6)]
+        for i, context in enumerate(self.contexts):
+            context.add((URIRef(u'item-%d' % i), RDF.type, URIRef(u'Thing')))
+            context.add((URIRef(u'item-%d' % i), self.name,
+                         Literal(u'Item %d' % i)))
+            context.add((URIRef(u'shared'), self.name, Literal(u'Shared')))
+
+    def testSpread(self):
+        store = self.graph.store
+        self.assertEqual(len(store.shards), 2)
+        self.assertEqual(sum([len(shard) for shard in store.shards]), 18)
+        self.assertTrue(min([len(shard) for shard in store.shards]) > 0)
+
+    def testLen(self):
+        self.assertEqual(len(self.graph.store), 18)
+        self.assertEqual(len(self.contexts[2]), 3)
+
+    def testContexts(self):
+        self.assertEqual(
+            sorted([graph.identifier for graph in self.graph.contexts()]),
+            [context.identifier for context in self.contexts])
+        for graph in self.graph.contexts():
+            self.assertTrue(graph.store is self.graph.store)
+
+    def testMergedTriples(self):
+        store = self.graph.store
+        triples = list(store.triples((None, None, None)))
+        self.assertEqual([triple for triple, contexts in triples],
+                         sorted([triple for triple, contexts in triples],
+                                key=lambda triple: [unicode(term).encode(
+                                    'utf-8') for term in triple]))
+        self.assertEqual(len(triples), 13)
+        shared = dict(triples)[
+            (URIRef(u'shared'), self.name, Literal(u'Shared'))]
+        self.assertEqual(
+            sorted([graph.identifier for graph in shared]),
+            [context.identifier for context in self.contexts])
+
+    def testContextTriples(self):
+        context = self.contexts[4]
+        self.assertEqual(len(self.graph.store._shards(None, context)),
+                         self.contextShards)
+        self.assertEqual(
+            set(context.subjects(self.name, None)),
+            set([URIRef(u'item-4'), URIRef(u'shared')]))
+
+    def testRemove(self):
+        self.graph.remove((URIRef(u'shared'), None, None))
+        self.assertEqual(len(self.graph.store), 12)
+        self.contexts[1].remove((None, None, None))
+        self.graph.commit()
+        self.assertEqual(len(self.graph.store), 10)
+
+    def testRemoveCounts(self):
+        counts = self.graph.store.remove((URIRef(u'shared'), None, None))
+        self.assertEqual(sum(counts.values()), 6)
+
+    def testParallelClose(self):
+        import threading
+        from rdflib_postgresql.ShardedPostgreSQL import parallel
+        threads = threading.active_count()
+        first, second = parallel(
+            [lambda: iter(xrange(100000)), lambda: iter(xrange(10))],
+            queueSize=10)
+        self.assertEqual(first.next(), 0)
+        self.assertEqual(list(second), range(10))
+        first.close()
+        self.assertEqual(threading.active_count(), threads)
+
+
+class ShardedBySubjectPostgreSQLTests(ShardedPostgreSQLTests):
+    path = shardedConfigString + " shard_by=subject"
+    contextShards = 2
+
+    def testSubjectTriples(self):
+        store = self.graph.store
+        self.assertEqual(store.shard_by, 'subject')
+        self.assertEqual(len(store._shards(URIRef(u'shared'), None)), 1)
+        self.assertEqual(
+            len(list(self.graph.triples((URIRef(u'shared'), None, None)))),
+            1)
+
+
+class SharedLayoutPostgreSQLContextTestCase(context_case.ContextTestCase):
+    store_name = "PostgreSQL"
+    storetest = True
+    path = configString + " layout=shared"
+    create = True
+
+    def testLenInMultipleContexts(self):
+        raise SkipTest("Known issue with __len__")
+
+
+class PostgreSQLSharedLayoutTests(PostgreSQLStoreTestCase):
+    path = configString + " layout=shared write_buffer=2"
+    name = URIRef(u'name')
+
+    def openStore(self, identifier):
+        graph = ConjunctiveGraph(plugin.get(self.store_name, Store)(
+            identifier=identifier))
+        graph.destroy(self.path)
+        graph.open(self.path, create=self.create)
+        return graph
+
+    def setUp(self):
+        self.graphs = [self.openStore(u'store-%d' % i) for i in range(2)]
+        for i, graph in enumerate(self.graphs):
+            context = Graph(graph.store, URIRef(u'context-1'))
+            for j in range(i + 2):
+                context.add((URIRef(u'item-%d' % j), self.name,
+                             Literal(u'Item %d' % j)))
+            context.add((URIRef(u'item-0'), RDF.type, URIRef(u'Thing')))
+            graph.bind(u'ex', URIRef(u'http://example.org/%d/' % i))
+            graph.commit()
+
+    def tearDown(self):
+        for graph in self.graphs:
+            graph.destroy(self.path)
+            graph.close()
+
+    def relations(self):
+        c = self.graphs[0].store._db.cursor()
+        c.execute("SELECT count(*) FROM pg_class")
+        count = c.fetchone()[0]
+        c.close()
+        self.graphs[0].commit()
+        return count
+
+    def testStoresAreSeparate(self):
+        first, second = self.graphs
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 4)
+        self.assertEqual(len(list(second.triples((None, self.name, None)))),
+                         3)
+        self.assertEqual(first.store.namespace(u'ex'),
+                         URIRef(u'http://example.org/0/'))
+        self.assertEqual(second.store.namespace(u'ex'),
+                         URIRef(u'http://example.org/1/'))
+
+    def testRemove(self):
+        first, second = self.graphs
+        first.remove((None, self.name, None))
+        first.commit()
+        self.assertEqual(len(first), 1)
+        self.assertEqual(len(second), 4)
+
+    def testDestroy(self):
+        first, second = self.graphs
+        first.destroy(self.path)
+        self.assertEqual(len(first), 0)
+        self.assertEqual(len(second), 4)
+
+    def testSharedTables(self):
+        store = self.graphs[0].store
+        self.assertEqual(store._internedId, 'rdflib_store')
+        c = store._db.cursor()
+        c.execute("SELECT relkind FROM pg_class WHERE relname = "
+                  "'rdflib_store_asserted_statements'")
+        self.assertEqual(c.fetchone()[0], 'v')
+        c.execute("SELECT to_regclass('%s_asserted_statements')" % (
+            store._storeId))
+        self.assertEqual(c.fetchone()[0], None)
+        c.close()
+
+    def testOpenWithoutDDL(self):
+        relations = self.relations()
+        self.graphs.append(self.openStore(u'store-2'))
+        self.assertEqual(len(self.graphs[-1]), 0)
+        self.assertEqual(self.relations(), relations)
+
+    def testUnsupportedOption(self):
+        graph = ConjunctiveGraph(store=self.store_name)
+        self.assertRaises(RuntimeError, graph.open,
+                          self.path + " hot_predicates=name")
+
+    def testOpenUnknownStore(self):
+        graph = ConjunctiveGraph(plugin.get(self.store_name, Store)(
+            identifier=u'store-unknown'))
+        self.assertEqual(graph.open(self.path, create=False), NO_STORE)
+        first = self.graphs[0]
+        first.destroy(self.path)
+        reopened = ConjunctiveGraph(plugin.get(self.store_name, Store)(
+            identifier=first.store.identifier))
+        self.assertEqual(reopened.open(self.path, create=False), NO_STORE)
+        reopened = ConjunctiveGraph(plugin.get(self.store_name, Store)(
+            identifier=self.graphs[1].store.identifier))
+        self.assertEqual(reopened.open(self.path, create=False),
+                         VALID_STORE)
+        reopened.close()
+
+
+class PostgreSQLOpenTests(PostgreSQLStoreTestCase):
+
+    def execute(self, *statements):
+        import psycopg2
+        from rdflib_postgresql.PostgreSQL import GetConfigurationString
+        db = psycopg2.connect(GetConfigurationString(self.path))
+        c = db.cursor()
+        for statement in statements:
+            c.execute(statement)
+        db.commit()
+        db.close()
+
+    def testSchemaVersion(self):
+        from rdflib_postgresql.PostgreSQL import SCHEMA_VERSION
+        store = self.graph.store
+        self.assertEqual(store.schema_version, SCHEMA_VERSION)
+        reopened = ConjunctiveGraph(store=self.store_name)
+        reopened.open(self.path, create=False)
+        self.assertEqual(reopened.store.schema_version, SCHEMA_VERSION)
+        reopened.close()
+
+    def testNewerSchemaVersion(self):
+        from rdflib_postgresql.PostgreSQL import SCHEMA_VERSION
+        self.execute("COMMENT ON TABLE %s_asserted_statements IS "
+                     "'schema version: %d'" % (
+                         self.graph.store._internedId, SCHEMA_VERSION + 1))
+        reopened = ConjunctiveGraph(store=self.store_name)
+        self.assertRaises(RuntimeError, reopened.open, self.path,
+                          create=False)
+
+    def testUnmarkedStore(self):
+        from rdflib_postgresql.PostgreSQL import SCHEMA_VERSION
+        name = URIRef(u'name')
+        self.createBaselineStore([(URIRef(u'item-0'), name, Literal(u'a'))])
+        reopened = ConjunctiveGraph(store=self.store_name)
+        reopened.open(self.path, create=False)
+        # The store is brought up to date
+        store = reopened.store
+        self.assertEqual(store.schema_version, SCHEMA_VERSION)
+        self.assertTrue(store._statisticsTable())
+        reopened.add((URIRef(u'item-1'), name, Literal(u'b')))
+        reopened.commit()
+        self.assertEqual(len(store), 2)
+        c = store._db.cursor()
+        c.execute("SELECT count(*) FROM pg_trigger WHERE tgrelid = "
+                  "'%s_namespace_binds'::regclass" % store._internedId)
+        self.assertEqual(c.fetchone()[0], 1)
+        c.close()
+        reopened.close()
+
+    def testUpgradeCreatesPatternIndexes(self):
+        import psycopg2
+        from rdflib_postgresql.PostgreSQL import GetConfigurationString
+        index = "%s_A_s_pattern_index" % self.graph.store._internedId
+        self.execute(
+            "DROP INDEX %s" % index,
+            "COMMENT ON TABLE %s_asserted_statements IS "
+            "'schema version: 1'" % self.graph.store._internedId)
+        reopened = ConjunctiveGraph(store=self.store_name)
+        reopened.open(self.path, create=False)
+        db = psycopg2.connect(GetConfigurationString(self.path))
+        c = db.cursor()
+        c.execute("SELECT to_regclass('%s') IS NOT NULL" % index.lower())
+        self.assertTrue(c.fetchone()[0])
+        db.close()
+        reopened.close()
+
+    def testExistsIsCachedPerConnection(self):
+        store = self.graph.store
+        table = "%s_quoted_statements" % store._internedId
+        self.execute("ALTER TABLE %s RENAME TO moved_statements" % table)
+        try:
+            self.assertEqual(store.db_exists(), 1)
+            reopened = ConjunctiveGraph(store=self.store_name)
+            self.assertEqual(reopened.open(self.path, create=False),
+                             NO_STORE)
+        finally:
+            self.execute("ALTER TABLE moved_statements RENAME TO %s" % table)
+
+
+class PostgreSQLNamespaceCacheTests(PostgreSQLStoreTestCase):
+    namespace = URIRef("http://example.org/ns#")
+
+    def reopen(self):
+        graph = ConjunctiveGraph(store=self.store_name)
+        graph.open(self.path, create=False)
+        return graph.store
+
+    def waitForNotification(self, store):
+        import select
+        select.select([store._db], [], [], 5)
+
+    def testLookupsAreCached(self):
+        store = self.graph.store
+        store.bind('ex', self.namespace)
+
+        def readCursor():
+            raise AssertionError('namespace lookup queried the database')
+        store._readCursor = readCursor
+        self.assertEqual(store.namespace('ex'), self.namespace)
+        self.assertEqual(store.prefix(self.namespace), 'ex')
+        self.assertTrue(('ex', self.namespace) in list(store.namespaces()))
+        self.assertEqual(store.namespace('missing'), None)
+
+    def testBindWritesThrough(self):
+        store = self.graph.store
+        store.bind('ex', self.namespace)
+        self.graph.commit()
+        other = self.reopen()
+        self.assertEqual(other.namespace('ex'), self.namespace)
+        other.close()
+
+    def testBindIsNotReplaced(self):
+        store = self.graph.store
+        store.bind('ex', self.namespace)
+        store.bind('ex', URIRef("http://example.org/other#"))
+        self.graph.commit()
+        self.assertEqual(store.namespace('ex'), self.namespace)
+
+    def testConcurrentBindDoesNotAbort(self):
+        store = self.graph.store
+        other = self.reopen()
+        other.bind('ex', self.namespace)
+        other.commit()
+        # Inserting the binding again must not abort the transaction
+        store.bind('ex', URIRef("http://example.org/other#"))
+        self.graph.add((URIRef(u'tarek'), URIRef(u'likes'),
+                        URIRef(u'pizza')))
+        self.graph.commit()
+        self.assertEqual(store.namespace('ex'), self.namespace)
+        self.assertEqual(len(self.graph), 1)
+        other.close()
+
+    def testExternalChangeInvalidates(self):
+        store = self.graph.store
+        self.assertEqual(store.namespace('ex'), None)
+        other = self.reopen()
+        other.bind('ex', self.namespace)
+        other.commit()
+        self.waitForNotification(store)
+        self.assertEqual(store.namespace('ex'), self.namespace)
+        c = other._db.cursor()
+        c.execute("DELETE FROM %s_namespace_binds WHERE prefix = 'ex'" % (
+            other._internedId))
+        other.commit()
+        # Notifications are delivered between the store's transactions
+        self.waitForNotification(store)
+        store.commit()
+        self.assertEqual(store.namespace('ex'), None)
+        self.assertEqual(store.prefix(self.namespace), None)
+        other.close()
+
+    def testNoPollInTransaction(self):
+        store = self.graph.store
+        store.namespace('ex')
+        len(store)
+
+        def poll():
+            raise AssertionError('namespace lookup polled the connection')
+        db = store._db
+        store._db = type('Connection', (object, ), dict(
+            poll=poll, get_transaction_status=db.get_transaction_status))()
+        try:
+            self.assertEqual(store.namespace('ex'), None)
+        finally:
+            store._db = db
+
+    def testRollbackDropsBindings(self):
+        store = self.graph.store
+        store.bind('ex', self.namespace)
+        self.graph.rollback()
+        self.assertEqual(store.namespace('ex'), None)
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,62 @@
+import unittest
+import os
+from time import time
+from nose.exc import SkipTest
+from rdflib import Graph
+from rdfextras.store.REGEXMatching import REGEXTerm
+from test_postgresql import configString
+
+
+class RegexPerformanceTestCase(unittest.TestCase):
+    """
+    Compares REGEXTerm matches over the sp2b data with and without the
+    trigram indexes of stores opened with trigram=true
+    """
+    store = "PostgreSQL"
+    storetest = True
+    performancetest = True
+    datasize = '5ktriples'
+    patterns = [
+        (REGEXTerm(u'http://localhost/persons/Paul_Erdoes'), None, None),
+        (None, None, REGEXTerm(u'.*Journal 1 ')),
+        (REGEXTerm(u'.*/Article1[0-9]$'), None, None),
+    ]
+
+    def setUp(self):
+        self.input = Graph()
+        self.input.parse(location=os.path.join(
+            os.path.dirname(__file__), 'sp2b/%s.n3' % self.datasize),
+            format="n3")
+
+    def _testPatterns(self, path):
+        graph = Graph(store=self.store)
+        graph.destroy(path)
+        graph.open(path, create=True)
+        graph.store.addN([t + (graph, ) for t in self.input])
+        graph.commit()
+        c = graph.store._db.cursor()
+        c.execute("ANALYZE")
+        c.close()
+        times = []
+        for pattern in self.patterns:
+            t0 = time()
+            list(graph.store.triples(pattern, None))
+            times.append(time() - t0)
+        graph.destroy(path)
+        graph.close()
+        return times
+
+    def testTime(self):
+        plain = self._testPatterns(configString)
+        for pattern, t0 in zip(self.patterns, plain):
+            print("%s: %.3g (no index)" % (repr(pattern), t0))
+        try:
+            trigram = self._testPatterns(configString + " trigram=true")
+        except Exception, e:
+            raise SkipTest("trigram indexes unavailable: %s" % e)
+        for pattern, t1 in zip(self.patterns, trigram):
+            print("%s: %.3g (trigram)" % (repr(pattern), t1))
+
+
+if __name__ == '__main__':
+    unittest.main()